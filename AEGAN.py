@@ -1,7 +1,11 @@
 import tensorflow as tf
-import numpy as np
 import matplotlib.pyplot as plt
 
+import input_pipeline
+from masked_conv import masked_conv3d
+from ms_ssim import ms_ssim
+from quantizer import Mask, Q
+
 # reset graph
 tf.reset_default_graph()
 
@@ -23,100 +27,26 @@ def decode(raw):
     return tf.image.decode_jpeg(raw, channels=3)
 
 
-def get_train_dataset(path, batch_size):
-    files = tf.data.Dataset.list_files(path)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(tf.data.TFRecordDataset, cycle_length=4))
+def get_train_dataset(path, batch_size, raw=False):
+    """ :param raw: if True, path is a glob of records made with `tf_records.py mk_raw_recs --image_keys image/encoded
+    image/label` instead """
+    if raw:
+        return input_pipeline.get_raw_dataset(path, batch_size, image_keys=('image/encoded', 'image/label'),
+                                              extra_keys=())
+    dataset = input_pipeline.read_records(path, cycle_length=4)
     dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
-    dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(20))
     dataset = dataset.map(_parse_function, num_parallel_calls=4)
     dataset = dataset.prefetch(batch_size)
 
     return dataset
 
-# MS-SSIM functions ------------------------------------------------------------------------------------------------------------------
-
-def _tf_fspecial_gauss(size, sigma):
-    """Function to mimic the 'fspecial' gaussian MATLAB function
-    """
-    x_data, y_data = np.mgrid[-size // 2 + 1:size // 2 + 1, -size // 2 + 1:size // 2 + 1]
-
-    x_data = np.expand_dims(x_data, axis=-1)
-    x_data = np.expand_dims(x_data, axis=-1)
-
-    y_data = np.expand_dims(y_data, axis=-1)
-    y_data = np.expand_dims(y_data, axis=-1)
-
-    x = tf.constant(x_data, dtype=tf.float32)
-    y = tf.constant(y_data, dtype=tf.float32)
-
-    g = tf.exp(-((x ** 2 + y ** 2) / (2.0 * sigma ** 2)))
-    return g / tf.reduce_sum(g)
-
-
-def tf_ssim(img1, img2, cs_map=False, mean_metric=True, size=9, sigma=1.5):
-
-    window = _tf_fspecial_gauss(size, sigma)  # window shape [size, size]
-    K1 = 0.01
-    K2 = 0.03
-    L = 1  # depth of image (255 in case the image has a different scale)
-    C1 = (K1 * L) ** 2
-    C2 = (K2 * L) ** 2
-    mu1 = tf.nn.conv2d(img1, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu2 = tf.nn.conv2d(img2, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu1_sq = mu1 * mu1
-    mu2_sq = mu2 * mu2
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = tf.nn.conv2d(img1 * img1, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_sq
-    sigma2_sq = tf.nn.conv2d(img2 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu2_sq
-    sigma12 = tf.nn.conv2d(img1 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_mu2
-    if cs_map:
-        value = (((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)), (2.0 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2))
-    else:
-        value = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
-
-
-def tf_ms_ssim(img1, img2, mean_metric=True, level=5):
-
-    weight = tf.constant([0.0448, 0.2856, 0.3001, 0.2363, 0.1333], dtype=tf.float32)
-    mssim = []
-    mcs = []
-    for l in range(level):
-        ssim_map, cs_map = tf_ssim(img1, img2, cs_map=True, mean_metric=False)
-        mssim.append(tf.reduce_mean(ssim_map))
-        mcs.append(tf.reduce_mean(cs_map))
-        filtered_im1 = tf.nn.avg_pool(img1, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        filtered_im2 = tf.nn.avg_pool(img2, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        img1 = filtered_im1
-        img2 = filtered_im2
-
-    # list to tensor of dim D+1
-    mssim = tf.stack(mssim, axis=0)
-    mcs = tf.stack(mcs, axis=0)
-
-    value = (tf.reduce_prod(mcs[0:level - 1] ** weight[0:level - 1]) * (mssim[level - 1] ** weight[level - 1]))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
-
-
 # Context Model functions ------------------------------------------------------------------------------------------------------------------
 
-def get_weights(name, shape, mask_filter):
+def get_weights(name, shape):
 
     weights_initializer1 = tf.contrib.layers.xavier_initializer()
 
-    W = tf.get_variable(name, shape, tf.float32, weights_initializer1)
-
-    W = W * mask_filter
-
-    return W
+    return tf.get_variable(name, shape, tf.float32, weights_initializer1)
 
 
 def get_bias(name, shape):
@@ -129,76 +59,6 @@ def conv3d(z, W):
     return tf.nn.conv3d(z, W, strides=[1, 1, 1, 1, 1], padding='SAME')
 
 
-def H_context_model(P, best_centroids, L, t_primo, beta, z):
-
-    shape2 = z.get_shape().as_list()
-
-    X2, Y2, Z2, W2 = tf.meshgrid(np.arange(shape2[0]), np.arange(shape2[1]), np.arange(shape2[2]), np.arange(shape2[3]))
-    idx2 = tf.transpose(tf.stack([tf.reshape(X2, [-1]), tf.reshape(Y2, [-1]), tf.reshape(Z2, [-1]), tf.reshape(W2, [-1]), tf.reshape(best_centroids, [-1])]))
-
-    log_base_change_factor_cm = tf.constant(np.log2(np.e), dtype=tf.float32)
-
-    h = tf.reduce_sum(- log_base_change_factor_cm * tf.log(tf.maximum(1e-9, tf.reshape(tf.gather_nd(P, idx2), [shape2[0], shape2[1], shape2[2], shape2[3]]))), axis=[3, 2, 1])
-
-    return tf.reduce_sum(tf.maximum(0.0, beta * (h - t_primo)))
-
-
-# Mask and Quantization functions ------------------------------------------------------------------------------------------------------------------
-
-def Mask(y, K):
-
-    yy = tf.transpose(tf.reshape(tf.tile(tf.reshape(y, [-1]), [K]), [K, tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2]]), [1, 2, 3, 0])
-    kk = tf.transpose(tf.reshape(tf.tile(tf.linspace(0., K-1, K), [np.prod(y.get_shape().as_list())]), [tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2], K]), [0, 1, 2, 3])
-    m = yy - kk
-    z = tf.zeros(tf.shape(m))
-    m = tf.maximum(x=m, y=z)
-    z = tf.ones(tf.shape(m))
-    m = tf.minimum(x=m, y=z)
-
-    # gradient trick
-    m = m + tf.stop_gradient(tf.ceil(m) - m)
-
-    return m
-
-
-def Q(z_masked, centroids, L, z):
-
-    zz = tf.transpose(tf.reshape(tf.tile(
-        tf.reshape(z_masked, [-1]), [L]), [L, tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3]]), [1, 2, 3, 4, 0])
-    cc = tf.reshape(tf.tile(centroids, [tf.size(z_masked)]), [tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3], L])
-    best_centroids = tf.argmin(tf.abs(zz - cc), axis=-1)
-
-    shape = z.get_shape().as_list()
-
-    X, Y, Z, W = tf.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]))
-    idx = tf.transpose(tf.stack([tf.reshape(X, [-1]), tf.reshape(Y, [-1]), tf.reshape(Z, [-1]), tf.reshape(W, [-1]), tf.reshape(best_centroids, [-1])]))
-    z_hat = tf.reshape(tf.gather_nd(cc, idx), [shape[0], shape[1], shape[2], shape[3]])
-
-    return (z_hat, best_centroids)
-
-
-def H(m, P, best_centroids, L, t_primo, beta, z):
-
-    shape = z.get_shape().as_list()
-
-    X, Y, Z, W = tf.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]))
-    idx = tf.transpose(tf.stack([tf.reshape(X, [-1]), tf.reshape(Y, [-1]), tf.reshape(Z, [-1]), tf.reshape(W, [-1]), tf.reshape(best_centroids, [-1])]))
-
-    log_base_change_factor = tf.constant(np.log2(np.e), dtype=tf.float32)
-
-    h = tf.reduce_sum(- m * log_base_change_factor * tf.log(tf.maximum(1e-9, tf.reshape(tf.gather_nd(P, idx), [shape[0], shape[1], shape[2], shape[3]]))), axis=[3, 2, 1])
-
-    return tf.reduce_sum(tf.maximum(0.0, beta * (h - t_primo)))
-
-def getMSSSIM(x, x_hat):
-
-    msssim_indexR = tf_ms_ssim(x[:, :, :, 0:1], x_hat[:, :, :, 0:1])
-    msssim_indexG = tf_ms_ssim(x[:, :, :, 1:2], x_hat[:, :, :, 1:2])
-    msssim_indexB = tf_ms_ssim(x[:, :, :, 2:3], x_hat[:, :, :, 2:3])
-    acc = (msssim_indexR + msssim_indexG + msssim_indexB) / 3
-
-    return acc
-
 def getAlpha(acc):
 
     return 2000*((acc - 1)**2) + 5
@@ -319,20 +179,10 @@ batch_size = 30
 
 
 
-mask_filter1 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 0, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter2 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 1, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter3 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 1, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter1 = tf.transpose(mask_filter1, [2, 3, 4, 0, 1])
-mask_filter2 = tf.transpose(mask_filter2, [2, 3, 4, 0, 1])
-mask_filter3 = tf.transpose(mask_filter3, [2, 3, 4, 0, 1])
-mask_filter1 = tf.reshape(tf.tile(mask_filter1, [1, 1, 1, 1, 24]), [3, 3, 3, 1, 24])
-mask_filter2 = tf.reshape(tf.tile(mask_filter2, [1, 1, 1, 24, 24]), [3, 3, 3, 24, 24])
-mask_filter3 = tf.reshape(tf.tile(mask_filter3, [1, 1, 1, 24, L]), [3, 3, 3, 24, L])
-
 
 # dataset and iterator initialization
 
-dataset = get_train_dataset("/mnt/disks/disk2/ae_out/records/train/train-*", batch_size)
+dataset = get_train_dataset("/mnt/disks/disk2/ae_out/records/train/*.tfrecord", batch_size)
 
 iterator = tf.data.Iterator.from_structure(dataset.output_types,
                                            dataset.output_shapes)
@@ -454,7 +304,7 @@ y = tf.sigmoid(tf.nn.relu(y_out)) * K
 
 m = Mask(y, K)
 z_masked = tf.multiply(z, m)
-z_hat, best_centroids = Q(z_masked, centroids, L, z)
+z_hat, best_centroids = Q(z_masked, centroids)
 z_differentiable = tf.stop_gradient(z_hat)
 
 
@@ -555,21 +405,21 @@ x_hat_norm = tf.clip_by_value(x_hat_norm, 0, 1.0)
 
 z_hat_contex_model = tf.stop_gradient(tf.expand_dims(z_differentiable, 4))
 
-W_conv1 = get_weights('W_conv1', [3, 3, 3, 1, 24], mask_filter1)
+W_conv1 = get_weights('W_conv1', [3, 3, 3, 1, 24])
 b_conv1 = get_bias("b_conv1", [24])
-conv1 = tf.nn.relu(tf.nn.bias_add(conv3d(z_hat_contex_model, W_conv1), b_conv1))
+conv1 = tf.nn.relu(tf.nn.bias_add(masked_conv3d(z_hat_contex_model, W_conv1, include_center=False), b_conv1))
 
-W_conv2 = get_weights('W_conv2', [3, 3, 3, 24, 24], mask_filter2)
+W_conv2 = get_weights('W_conv2', [3, 3, 3, 24, 24])
 b_conv2 = get_bias("b_conv2", [24])
-conv2 = tf.nn.relu(tf.nn.bias_add(conv3d(conv1, W_conv2), b_conv2))
+conv2 = tf.nn.relu(tf.nn.bias_add(masked_conv3d(conv1, W_conv2, include_center=True), b_conv2))
 
-W_conv3 = get_weights('W_conv3', [3, 3, 3, 24, 24], mask_filter2)
+W_conv3 = get_weights('W_conv3', [3, 3, 3, 24, 24])
 b_conv3 = get_bias("b_conv3", [24])
-conv3 = tf.nn.bias_add(conv3d(conv2, W_conv3), b_conv3)
+conv3 = tf.nn.bias_add(masked_conv3d(conv2, W_conv3, include_center=True), b_conv3)
 
-W_conv4 = get_weights('W_conv4', [3, 3, 3, 24, n_centroids], mask_filter3)
+W_conv4 = get_weights('W_conv4', [3, 3, 3, 24, n_centroids])
 b_conv4 = get_bias("b_conv4", [n_centroids])
-conv4 = tf.nn.relu(tf.nn.bias_add(conv3d(conv3 + conv1, W_conv4), b_conv4))
+conv4 = tf.nn.relu(tf.nn.bias_add(masked_conv3d(conv3 + conv1, W_conv4, include_center=True), b_conv4))
 
 P = tf.nn.softmax(conv4)
 
@@ -585,8 +435,8 @@ s_gz = tf.summary.image("Gz", Gz, 1)
 s_x_ae = tf.summary.image("x_ae", x_ae, 1)
 s_x = tf.summary.image("x", x, 1)
 
-g_acc = getMSSSIM(x, Gz)
-ae_acc = getMSSSIM(x, x_ae)
+_, g_acc = ms_ssim(x, Gz)
+_, ae_acc = ms_ssim(x, x_ae)
 
 tf.summary.scalar('ms-ssim_G', g_acc)
 tf.summary.scalar('delta_ms-ssim', (g_acc - ae_acc))
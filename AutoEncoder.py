@@ -2,131 +2,43 @@ import tensorflow as tf
 import numpy as np
 import matplotlib.pyplot as plt
 
+import input_pipeline
+from context_model import group_ids, NUM_SLICES_VARIABLE, TEMPORAL_VARIABLE
+from masked_conv import masked_conv3d
+from ms_ssim import ms_ssim
+from quantizer import Mask, quantize, entropies
+
 # reset graph
 tf.reset_default_graph()
 
 # Input functions ------------------------------------------------------------------------------------------------------
 
 
-def _parse_function(example_proto):
-    keys_to_features = {'image/encoded': tf.VarLenFeature(tf.string),
-                        'image/filename': tf.FixedLenFeature([], tf.string)}
-    parsed_features = tf.parse_example(example_proto, keys_to_features)
-    raw = tf.sparse_tensor_to_dense(parsed_features['image/encoded'], default_value="0", )
-
-    filenames = parsed_features['image/filename']
-
-    return (tf.map_fn(decode_random_crop, tf.squeeze(raw), dtype=tf.uint8, back_prop=False), filenames)
-
-
-def decode_random_crop(raw):
-    img = tf.image.decode_jpeg(raw, channels=3)
+def get_train_dataset(raw_records_glob=None):
+    """ :param raw_records_glob: if given, read the records of `tf_records.py mk_raw_recs --crop_size 160` instead """
+    if raw_records_glob:
+        return input_pipeline.get_raw_dataset(raw_records_glob, batch_size=30, cycle_length=4)
+    return input_pipeline.get_dataset("/mnt/disks/disk2/records/train/train-*", batch_size=30, cycle_length=4)
 
-    return tf.random_crop(img, [160, 160, 3])
 
-
-def get_train_dataset():
-    files = tf.data.Dataset.list_files("/mnt/disks/disk2/records/train/train-*")
-    dataset = files.interleave(tf.data.TFRecordDataset, cycle_length=1)
-    dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(30))
-    dataset = dataset.shuffle(3500).repeat()
-    dataset = dataset.map(_parse_function)
-    dataset = dataset.prefetch(30)
-
-    return dataset
+def get_train_frames_dataset(num_frames):
+    """ Batches of 30 frames, 30 / num_frames examples of `tf_records.py mk_img_recs --num_per_ex NUM_FRAMES` """
+    return input_pipeline.get_frames_dataset("/mnt/disks/disk2/records/frames/train-*", batch_size=30 // num_frames,
+                                             num_frames=num_frames, cycle_length=4)
 
 
 def get_test_dataset():
-    files = tf.data.Dataset.list_files("/path/to/validation/validation-*")
-    dataset = files.interleave(tf.data.TFRecordDataset, cycle_length=1)
-    dataset = dataset.batch(100).map(_parse_function)
-
-    return dataset
-
-# MS-SSIM functions ------------------------------------------------------------------------------------------------------------------
-
-def _tf_fspecial_gauss(size, sigma):
-    """Function to mimic the 'fspecial' gaussian MATLAB function
-    """
-    x_data, y_data = np.mgrid[-size // 2 + 1:size // 2 + 1, -size // 2 + 1:size // 2 + 1]
-
-    x_data = np.expand_dims(x_data, axis=-1)
-    x_data = np.expand_dims(x_data, axis=-1)
-
-    y_data = np.expand_dims(y_data, axis=-1)
-    y_data = np.expand_dims(y_data, axis=-1)
-
-    x = tf.constant(x_data, dtype=tf.float32)
-    y = tf.constant(y_data, dtype=tf.float32)
-
-    g = tf.exp(-((x ** 2 + y ** 2) / (2.0 * sigma ** 2)))
-    return g / tf.reduce_sum(g)
-
-
-def tf_ssim(img1, img2, cs_map=False, mean_metric=True, size=9, sigma=1.5):
-
-    window = _tf_fspecial_gauss(size, sigma)  # window shape [size, size]
-    K1 = 0.01
-    K2 = 0.03
-    L = 1  # depth of image (255 in case the image has a different scale)
-    C1 = (K1 * L) ** 2
-    C2 = (K2 * L) ** 2
-    mu1 = tf.nn.conv2d(img1, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu2 = tf.nn.conv2d(img2, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu1_sq = mu1 * mu1
-    mu2_sq = mu2 * mu2
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = tf.nn.conv2d(img1 * img1, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_sq
-    sigma2_sq = tf.nn.conv2d(img2 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu2_sq
-    sigma12 = tf.nn.conv2d(img1 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_mu2
-    if cs_map:
-        value = (((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)), (2.0 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2))
-    else:
-        value = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
-
-
-def tf_ms_ssim(img1, img2, mean_metric=True, level=5):
-
-    weight = tf.constant([0.0448, 0.2856, 0.3001, 0.2363, 0.1333], dtype=tf.float32)
-    mssim = []
-    mcs = []
-    for l in range(level):
-        ssim_map, cs_map = tf_ssim(img1, img2, cs_map=True, mean_metric=False)
-        mssim.append(tf.reduce_mean(ssim_map))
-        mcs.append(tf.reduce_mean(cs_map))
-        filtered_im1 = tf.nn.avg_pool(img1, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        filtered_im2 = tf.nn.avg_pool(img2, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        img1 = filtered_im1
-        img2 = filtered_im2
-
-    # list to tensor of dim D+1
-    mssim = tf.stack(mssim, axis=0)
-    mcs = tf.stack(mcs, axis=0)
-
-    value = (tf.reduce_prod(mcs[0:level - 1] ** weight[0:level - 1]) * (mssim[level - 1] ** weight[level - 1]))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
+    return input_pipeline.get_dataset("/path/to/validation/validation-*", batch_size=100, shuffle_buffer_bytes=0,
+                                      training=False)
 
 
 # Context Model functions ------------------------------------------------------------------------------------------------------------------
 
-def get_weights(name, shape, mask_filter):
+def get_weights(name, shape):
 
     weights_initializer1 = tf.contrib.layers.xavier_initializer()
 
-    W = tf.get_variable(name, shape, tf.float32, weights_initializer1)
-
-    W = W * mask_filter
-
-    return W
+    return tf.get_variable(name, shape, tf.float32, weights_initializer1)
 
 
 def get_bias(name, shape):
@@ -139,85 +51,88 @@ def conv3d(z, W):
     return tf.nn.conv3d(z, W, strides=[1, 1, 1, 1, 1], padding='SAME')
 
 
-def H_context_model(P, best_centroids, L, t_primo, beta, z):
-
-    shape2 = z.get_shape().as_list()
-
-    X2, Y2, Z2, W2 = tf.meshgrid(np.arange(shape2[0]), np.arange(shape2[1]), np.arange(shape2[2]), np.arange(shape2[3]))
-    idx2 = tf.transpose(tf.stack([tf.reshape(X2, [-1]), tf.reshape(Y2, [-1]), tf.reshape(Z2, [-1]), tf.reshape(W2, [-1]), tf.reshape(best_centroids, [-1])]))
-
-    log_base_change_factor_cm = tf.constant(np.log2(np.e), dtype=tf.float32)
-
-    h = tf.reduce_sum(- log_base_change_factor_cm * tf.log(tf.maximum(1e-9, tf.reshape(tf.gather_nd(P, idx2), [shape2[0], shape2[1], shape2[2], shape2[3]]))), axis=[3, 2, 1])
-
-    return tf.reduce_sum(tf.maximum(0.0, beta * (h - t_primo)))
-
-
-# Mask and Quantization functions ------------------------------------------------------------------------------------------------------------------
-
-def Mask(y, K):
-
-    yy = tf.transpose(tf.reshape(tf.tile(tf.reshape(y, [-1]), [K]), [K, tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2]]), [1, 2, 3, 0])
-    kk = tf.transpose(tf.reshape(tf.tile(tf.linspace(0., K-1, K), [np.prod(y.get_shape().as_list())]), [tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2], K]), [0, 1, 2, 3])
-    m = yy - kk
-    z = tf.zeros(tf.shape(m))
-    m = tf.maximum(x=m, y=z)
-    z = tf.ones(tf.shape(m))
-    m = tf.minimum(x=m, y=z)
-
-    # gradient trick
-    m = m + tf.stop_gradient(tf.ceil(m) - m)
-
-    return m
-
-
-def soft_Q(z_masked, sigma, centroids, L):
+def masked_context_model(z_hat, L, conditioning=None):
+    """
+    :param conditioning: if given, [N, H, W, K, C] inputs known to the decoder before z_hat. They go through an
+    unmasked conv3d, added to the first layer.
+    """
+    z_hat_contex_model = tf.expand_dims(z_hat, 4)
 
-    zz = tf.transpose(tf.reshape(tf.tile(
-        tf.reshape(z_masked, [-1]), [L]), [L, tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3]]), [1, 2, 3, 4, 0])
-    cc = tf.reshape(tf.tile(centroids, [tf.size(z_masked)]), [tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3], L])
-    z_tilde = tf.reduce_sum(tf.nn.softmax(tf.abs(zz - cc) * (-sigma), axis=4) * cc, axis=4)
+    W_conv1 = get_weights('W_conv1', [3, 3, 3, 1, 24])
+    b_conv1 = get_bias("b_conv1", [24])
+    conv1 = masked_conv3d(z_hat_contex_model, W_conv1, include_center=False)
+    if conditioning is not None:
+        Wt_conv1 = get_weights(TEMPORAL_VARIABLE, [3, 3, 3, conditioning.get_shape().as_list()[-1], 24])
+        conv1 += conv3d(conditioning, Wt_conv1)
+    conv1 = tf.nn.relu(tf.nn.bias_add(conv1, b_conv1))
 
-    return z_tilde
+    W_conv2 = get_weights('W_conv2', [3, 3, 3, 24, 24])
+    b_conv2 = get_bias("b_conv2", [24])
+    conv2 = tf.nn.relu(tf.nn.bias_add(masked_conv3d(conv1, W_conv2, include_center=True), b_conv2))
 
+    W_conv3 = get_weights('W_conv3', [3, 3, 3, 24, 24])
+    b_conv3 = get_bias("b_conv3", [24])
+    conv3 = tf.nn.bias_add(masked_conv3d(conv2, W_conv3, include_center=True), b_conv3)
 
-def Q(z_masked, centroids, L, z):
+    W_conv4 = get_weights('W_conv4', [3, 3, 3, 24, L])
+    b_conv4 = get_bias("b_conv4", [L])
+    conv4 = tf.nn.relu(tf.nn.bias_add(masked_conv3d(conv3 + conv1, W_conv4, include_center=True), b_conv4))
 
-    zz = tf.transpose(tf.reshape(tf.tile(
-        tf.reshape(z_masked, [-1]), [L]), [L, tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3]]), [1, 2, 3, 4, 0])
-    cc = tf.reshape(tf.tile(centroids, [tf.size(z_masked)]), [tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3], L])
-    best_centroids = tf.argmin(tf.abs(zz - cc), axis=-1)
+    return tf.nn.softmax(conv4)
 
-    shape = z.get_shape().as_list()
 
-    X, Y, Z, W = tf.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]))
-    idx = tf.transpose(tf.stack([tf.reshape(X, [-1]), tf.reshape(Y, [-1]), tf.reshape(Z, [-1]), tf.reshape(W, [-1]), tf.reshape(best_centroids, [-1])]))
-    z_hat = tf.reshape(tf.gather_nd(cc, idx), [shape[0], shape[1], shape[2], shape[3]])
+def temporal_context_model(z_hat, L, num_frames):
+    """
+    Masked context model conditioned on the latent of the previous frame, see TemporalContextModel in
+    context_model.py. z_hat holds frame 0 of all examples, then frame 1, ..., as in input_pipeline.get_frames_dataset.
+    Frame 0 has no previous frame, its conditioning is 0, which is the masked model used for single images.
+    """
+    shape = z_hat.get_shape().as_list()
+    num_examples = shape[0] // num_frames
+    has_prev = np.arange(shape[0]) >= num_examples
+    z_prev = tf.concat([tf.zeros([num_examples] + shape[1:]), z_hat[:-num_examples]], axis=0)
+    indicator = tf.constant(np.broadcast_to(has_prev.reshape(-1, 1, 1, 1), shape).astype(np.float32))
+    return masked_context_model(z_hat, L, conditioning=tf.stack([z_prev, indicator], axis=-1))
 
-    return (z_hat, best_centroids)
 
+def grouped_context_model(z_hat, L, num_slices):
+    """
+    Context model that can be decoded in 2 * num_slices batched steps, see context_model.py. The symbols are split into
+    groups by channel slice and spatial checkerboard, the network is evaluated once per group, with only the symbols
+    of previous groups (and an indicator of them) as input.
+    """
+    shape = z_hat.get_shape().as_list()
+    groups = group_ids(shape[1:], num_slices)
+    num_groups = 2 * num_slices
 
-def H(m, P, best_centroids, L, t_primo, beta, z):
+    known = np.stack([groups < g for g in range(num_groups)]).astype(np.float32)[:, np.newaxis]  # [G, 1, H, W, K]
+    z_in = tf.stack([tf.expand_dims(z_hat, 0) * known, tf.tile(known, [1, shape[0], 1, 1, 1])], axis=-1)
+    z_in = tf.reshape(z_in, [num_groups * shape[0]] + shape[1:] + [2])
 
-    shape = z.get_shape().as_list()
+    tf.get_variable(NUM_SLICES_VARIABLE, initializer=num_slices, trainable=False)
 
-    X, Y, Z, W = tf.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]))
-    idx = tf.transpose(tf.stack([tf.reshape(X, [-1]), tf.reshape(Y, [-1]), tf.reshape(Z, [-1]), tf.reshape(W, [-1]), tf.reshape(best_centroids, [-1])]))
+    W_conv1 = get_weights('Wg_conv1', [3, 3, 3, 2, 24])
+    b_conv1 = get_bias("bg_conv1", [24])
+    conv1 = tf.nn.relu(tf.nn.bias_add(conv3d(z_in, W_conv1), b_conv1))
 
-    log_base_change_factor = tf.constant(np.log2(np.e), dtype=tf.float32)
+    W_conv2 = get_weights('Wg_conv2', [3, 3, 3, 24, 24])
+    b_conv2 = get_bias("bg_conv2", [24])
+    conv2 = tf.nn.relu(tf.nn.bias_add(conv3d(conv1, W_conv2), b_conv2))
 
-    h = tf.reduce_sum(- m * log_base_change_factor * tf.log(tf.maximum(1e-9, tf.reshape(tf.gather_nd(P, idx), [shape[0], shape[1], shape[2], shape[3]]))), axis=[3, 2, 1])
+    W_conv3 = get_weights('Wg_conv3', [3, 3, 3, 24, 24])
+    b_conv3 = get_bias("bg_conv3", [24])
+    conv3 = tf.nn.bias_add(conv3d(conv2, W_conv3), b_conv3)
 
-    return tf.reduce_sum(tf.maximum(0.0, beta * (h - t_primo)))
+    W_conv4 = get_weights('Wg_conv4', [3, 3, 3, 24, L])
+    b_conv4 = get_bias("bg_conv4", [L])
+    conv4 = tf.nn.relu(tf.nn.bias_add(conv3d(conv3 + conv1, W_conv4), b_conv4))
 
+    # every symbol takes its probabilities from the pass of its own group
+    P_all = tf.reshape(tf.nn.softmax(conv4), [num_groups] + shape + [L])
+    select = np.eye(num_groups, dtype=np.float32)[groups]  # [H, W, K, G]
+    select = np.transpose(select, [3, 0, 1, 2])[:, np.newaxis, :, :, :, np.newaxis]  # [G, 1, H, W, K, 1]
+    return tf.reduce_sum(P_all * select, axis=0)
 
-# dataset and iterator initialization
-
-training_dataset = get_train_dataset()
-test_dataset = get_test_dataset()
-
-iterator = tf.data.Iterator.from_structure(training_dataset.output_types,
-                                           training_dataset.output_shapes)
 
 # variables initialization ------------------------------------------------------------------------------------------------------------------
 
@@ -241,15 +156,22 @@ n_centroids = 6
 beta = 500
 L = n_centroids
 
-mask_filter1 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 0, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter2 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 1, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter3 = tf.constant([[[[[1, 1, 1], [1, 1, 1], [1, 1, 1]], [[1, 1, 1], [1, 1, 0], [0, 0, 0]], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]]]], dtype=tf.float32)
-mask_filter1 = tf.transpose(mask_filter1, [2, 3, 4, 0, 1])
-mask_filter2 = tf.transpose(mask_filter2, [2, 3, 4, 0, 1])
-mask_filter3 = tf.transpose(mask_filter3, [2, 3, 4, 0, 1])
-mask_filter1 = tf.reshape(tf.tile(mask_filter1, [1, 1, 1, 1, 24]), [3, 3, 3, 1, 24])
-mask_filter2 = tf.reshape(tf.tile(mask_filter2, [1, 1, 1, 24, 24]), [3, 3, 3, 24, 24])
-mask_filter3 = tf.reshape(tf.tile(mask_filter3, [1, 1, 1, 24, L]), [3, 3, 3, 24, L])
+# 'masked': masked conv3d, decoded symbol by symbol. 'grouped': decoded in 2 * num_slices batched steps.
+# 'temporal': masked, conditioned on the previous frame, trained on examples of num_frames consecutive frames
+context_model_type = 'masked'
+num_slices = 2
+num_frames = 2
+
+# dataset and iterator initialization
+
+if context_model_type == 'temporal':
+    training_dataset = get_train_frames_dataset(num_frames)
+else:
+    training_dataset = get_train_dataset()
+test_dataset = get_test_dataset()
+
+iterator = tf.data.Iterator.from_structure(training_dataset.output_types,
+                                           training_dataset.output_shapes)
 
 
 # Graph definition ------------------------------------------------------------------------------------------------------------------
@@ -367,8 +289,7 @@ y = tf.sigmoid(tf.nn.relu(y_out)) * K
 
 m = Mask(y, K)
 z_masked = tf.multiply(z, m) 
-z_tilde = soft_Q(z_masked, sigma, centroids, L)
-z_hat, best_centroids = Q(z_masked, centroids, L, z)
+z_tilde, z_hat, best_centroids = quantize(z_masked, sigma, centroids)
 z_differentiable = tf.stop_gradient(z_hat - z_tilde) + z_tilde
 
 
@@ -474,39 +395,24 @@ tf.summary.image("x_hat_norm", x_hat_norm, 5)
 
 # Context Model
 
-z_hat_contex_model = tf.stop_gradient(tf.expand_dims(z_differentiable, 4))
-
-W_conv1 = get_weights('W_conv1', [3, 3, 3, 1, 24], mask_filter1)
-b_conv1 = get_bias("b_conv1", [24])
-conv1 = tf.nn.relu(tf.nn.bias_add(conv3d(z_hat_contex_model, W_conv1), b_conv1))
-
-W_conv2 = get_weights('W_conv2', [3, 3, 3, 24, 24], mask_filter2)
-b_conv2 = get_bias("b_conv2", [24])
-conv2 = tf.nn.relu(tf.nn.bias_add(conv3d(conv1, W_conv2), b_conv2))
-
-W_conv3 = get_weights('W_conv3', [3, 3, 3, 24, 24], mask_filter2)
-b_conv3 = get_bias("b_conv3", [24])
-conv3 = tf.nn.bias_add(conv3d(conv2, W_conv3), b_conv3)
-
-W_conv4 = get_weights('W_conv4', [3, 3, 3, 24, n_centroids], mask_filter3)
-b_conv4 = get_bias("b_conv4", [n_centroids])
-conv4 = tf.nn.relu(tf.nn.bias_add(conv3d(conv3 + conv1, W_conv4), b_conv4))
-
-P = tf.nn.softmax(conv4)
+if context_model_type == 'grouped':
+    P = grouped_context_model(tf.stop_gradient(z_differentiable), L, num_slices)
+elif context_model_type == 'temporal':
+    P = temporal_context_model(tf.stop_gradient(z_differentiable), L, num_frames)
+else:
+    P = masked_context_model(tf.stop_gradient(z_differentiable), L)
 
 # Distortion rate index
-msssim_indexR = tf_ms_ssim(x[:, :, :, 0:1], x_hat_norm[:, :, :, 0:1])
-msssim_indexG = tf_ms_ssim(x[:, :, :, 1:2], x_hat_norm[:, :, :, 1:2])
-msssim_indexB = tf_ms_ssim(x[:, :, :, 2:3], x_hat_norm[:, :, :, 2:3])
-acc = (msssim_indexR + msssim_indexG + msssim_indexB) / 3
+_, acc = ms_ssim(x, x_hat_norm)
 d = k_ms_ssim * (1 - acc)
 mse = (tf.reduce_sum(tf.square(x_hat_norm - x), axis=[1, 2, 3, 0]) / (128*batch_size))
 distortion_rate = tf.where(tf.is_nan(d), mse, d)
 tf.summary.scalar('accuracy', acc*100.)
 
 # Entropy
-h_context_model = H_context_model(P, best_centroids, L, t_primo, beta, z) / (400 * K)
-h = H(m, P, best_centroids, L, t_primo, beta, z) / (400 * K)
+h, h_context_model = entropies(m, P, best_centroids, t_primo, beta)
+h_context_model = h_context_model / (400 * K)
+h = h / (400 * K)
 tf.summary.scalar('entropy_context_model', h_context_model)
 tf.summary.scalar('entropy', h)
 
@@ -564,8 +470,9 @@ for i in range(num_batch):
     fn, batch_img_out, batch_img = sess.run((filenames, x_hat_norm, x), feed_dict={training: True})
 
     for j in range(len(fn)):
-        name = "/mnt/disks/disk2/ae_out/label/" + str(fn[j])[2:-1]
+        file_name = str(fn[j])[2:-1] or "img_{}_{}.png".format(i, j)  # records of frames have no filenames
+        name = "/mnt/disks/disk2/ae_out/label/" + file_name
         plt.imsave(name, batch_img[j])
 
-        name = "/mnt/disks/disk2/ae_out/in/" + str(fn[j])[2:-1]
+        name = "/mnt/disks/disk2/ae_out/in/" + file_name
         plt.imsave(name, batch_img_out[j])
@@ -0,0 +1,464 @@
+"""
+Compress images into real bitstreams with a trained AutoEncoder.py checkpoint, and decompress them again.
+
+The symbols (best_centroids of Q()) are entropy coded with a range coder, using the probabilities P of the context
+model of the checkpoint (masked, grouped or temporal), evaluated with context_model.py.
+
+In the default 'masked' mode, the importance map is coded first, as the number of active channels at each location.
+Then only the channels that are active under Mask() are coded, all others are known to be the centroid closest to 0.
+In the 'dense' mode, every symbol of the latent is coded.
+
+With --tile_size, the image is split into tiles that are coded independently, each one as its own bitstream in a
+container with a tile offset table. Tiles are entropy coded in parallel worker processes, and single regions can be
+decoded without touching the other tiles.
+
+Consecutive frames of a video are coded with a checkpoint of the temporal context model: every frame is a bitstream
+as above, coded with the context model conditioned on the symbols of the previous frame, in a container with a
+frame offset table. Frames are encoded in parallel, but decoded one after the other.
+
+    python codec.py compress CKPT IMAGE OUT [--coding_mode dense] [--tile_size 160]
+    python codec.py decompress CKPT IN OUT_IMAGE [--region TOP LEFT HEIGHT WIDTH]
+    python codec.py compress_frames CKPT OUT FRAME [FRAME ...] [--coding_mode dense]
+    python codec.py decompress_frames CKPT IN OUT_DIR
+"""
+import argparse
+import os
+import struct
+import sys
+from concurrent import futures
+import numpy as np
+from PIL import Image
+
+import context_model
+from range_coder import RangeEncoder, RangeDecoder, AdaptiveFrequencies, freqs_to_cdf
+
+try:  # only Codec needs TensorFlow, the functions that entropy code latents do not
+    import tensorflow as tf
+    import model
+except ImportError:
+    tf = model = None
+
+
+_MAGIC = b'ICMP'
+_VERSION = 2
+# magic, version, mode, image height, image width, latent height, latent width, K, L, per channel mean and variance
+_HEADER = struct.Struct('<4sBBHHHHBB3f3f')
+
+_TILED_MAGIC = b'ICMT'
+# magic, version, tile size, image height, image width, number of tiles. Followed by number of tiles + 1 uint32 offsets
+_TILED_HEADER = struct.Struct('<4sBHHHI')
+
+_VIDEO_MAGIC = b'ICMV'
+# magic, version, number of frames. Followed by number of frames + 1 uint32 offsets
+_VIDEO_HEADER = struct.Struct('<4sBI')
+
+MODES = ('dense', 'masked')
+
+
+def importance_levels(y, K):
+    """ Number of channels kept by Mask() at each location. :param y: [H, W, 1] :return: int array [H, W] """
+    return np.sum(y > np.arange(K), axis=-1)
+
+
+def active_channels(levels, K):
+    """ :return: bool array [H, W, K], True where Mask() is 1 """
+    return np.arange(K) < levels[..., np.newaxis]
+
+
+def quantize(z, y, centroids):
+    """
+    Same as Mask() followed by Q() of AutoEncoder.py, for a single latent.
+    :param z: [H, W, K] :param y: [H, W, 1] :return: best_centroids, int array [H, W, K]
+    """
+    z_masked = z * active_channels(importance_levels(y, z.shape[-1]), z.shape[-1])
+    return np.argmin(np.abs(z_masked[..., np.newaxis] - centroids), axis=-1)
+
+
+def zero_symbol(centroids):
+    """ Symbol of all masked out channels, i.e., Q() of 0 """
+    return int(np.argmin(np.abs(centroids)))
+
+
+def encode_symbols(symbols, cm, levels=None, logits=None):
+    """
+    Range code a [H, W, K] volume of symbols, in the coding order of the context model cm.
+    :param levels: if given, int array [H, W] of importance levels. They are coded first, followed by the active
+    symbols only.
+    :param logits: cm.logits(symbols), if already computed
+    :return: bytes
+    """
+    if logits is None:
+        logits = cm.logits(symbols)
+    freqs = context_model.logits_to_freqs(logits)
+    order = cm.coding_order(symbols.shape)
+    cdfs = freqs_to_cdf(freqs.reshape(-1, freqs.shape[-1])[order])
+    symbols_ordered = symbols.reshape(-1)[order]
+    encoder = RangeEncoder()
+    if levels is not None:
+        levels_model = AdaptiveFrequencies(symbols.shape[2] + 1)
+        for level in levels.reshape(-1).tolist():
+            levels_model.encode(encoder, level)
+        active = active_channels(levels, symbols.shape[2]).reshape(-1)[order]
+        symbols_ordered, cdfs = symbols_ordered[active], cdfs[active]
+    encoder.encode_symbols(symbols_ordered, cdfs)
+    return encoder.finish()
+
+
+def decode_symbols(data, shape, cm, masked_symbol=None):
+    """
+    Inverse of encode_symbols.
+    :param shape: (H, W, K)
+    :param masked_symbol: if given, the bitstream was written with levels, and masked out symbols are set to this.
+    :return: int array of shape `shape`
+    """
+    decoder = RangeDecoder(data)
+    if masked_symbol is None:
+        active = np.ones(shape, dtype=bool)
+        masked_symbol = 0
+    else:
+        levels_model = AdaptiveFrequencies(shape[2] + 1)
+        levels = np.array([levels_model.decode(decoder) for _ in range(shape[0] * shape[1])]).reshape(shape[:2])
+        active = active_channels(levels, shape[2])
+
+    return cm.decode(shape, decoder.decode, active, masked_symbol)
+
+
+def compress_latent(img_shape, z, y, mean, var, centroids, cm, mode='masked'):
+    """
+    Quantize and entropy code the encoder output of a single image. Does not need TF.
+    :param img_shape: (height, width) of the image, before padding
+    :param z: [H, W, K] :param y: [H, W, 1] :param mean: [3] :param var: [3]
+    :return: bytes
+    """
+    symbols = quantize(z, y, centroids)
+    levels = importance_levels(y, symbols.shape[2]) if mode == 'masked' else None
+    return compress_symbols(img_shape, symbols, levels, mean, var, centroids, cm)
+
+
+def compress_symbols(img_shape, symbols, levels, mean, var, centroids, cm, logits=None):
+    """
+    compress_latent of an already quantized latent.
+    :param levels: importance levels [H, W] in the 'masked' mode, None in the 'dense' mode
+    :param logits: cm.logits(symbols), if already computed
+    :return: bytes
+    """
+    mode = 'dense' if levels is None else 'masked'
+    header = _HEADER.pack(_MAGIC, _VERSION, MODES.index(mode), img_shape[0], img_shape[1],
+                          symbols.shape[0], symbols.shape[1], symbols.shape[2], len(centroids),
+                          *np.reshape(mean, [-1]), *np.reshape(var, [-1]))
+    return header + encode_symbols(symbols, cm, levels, logits)
+
+
+def decompress_latent(data, centroids, cm):
+    """
+    Inverse of compress_latent. Does not need TF.
+    :return: tuple (z_hat [H, W, K], mean [3], var [3], (height, width) of the image)
+    """
+    symbols, mean, var, img_shape = decompress_symbols(data, centroids, cm)
+    return centroids[symbols], mean, var, img_shape
+
+
+def decompress_symbols(data, centroids, cm):
+    """ Like decompress_latent, but returns the symbols instead of z_hat """
+    fields = _HEADER.unpack_from(data)
+    magic, version, mode, img_h, img_w, h, w, k, num_centroids = fields[:9]
+    assert magic == _MAGIC and version == _VERSION, 'Not a bitstream of this codec (version {})'.format(_VERSION)
+    assert num_centroids == len(centroids), 'Bitstream was written with {} centroids'.format(num_centroids)
+    mean = np.array(fields[9:12], dtype=np.float32)
+    var = np.array(fields[12:15], dtype=np.float32)
+
+    masked_symbol = zero_symbol(centroids) if MODES[mode] == 'masked' else None
+    symbols = decode_symbols(data[_HEADER.size:], (h, w, k), cm, masked_symbol)
+    return symbols, mean, var, (img_h, img_w)
+
+
+# Worker processes get the model parameters once, in _init_worker, instead of with every tile.
+_worker_params = None
+
+
+def _init_worker(centroids, cm):
+    global _worker_params
+    _worker_params = (centroids, cm)
+
+
+def _compress_latent_in_worker(args):
+    img_shape, z, y, mean, var, mode = args
+    return compress_latent(img_shape, z, y, mean, var, *_worker_params, mode=mode)
+
+
+def _decompress_latent_in_worker(data):
+    return decompress_latent(data, *_worker_params)
+
+
+def _compress_frame_in_worker(args):
+    """ compress_symbols with the context model conditioned on prev_symbols, the symbols of the previous frame """
+    img_shape, symbols, levels, mean, var, prev_symbols = args
+    centroids, cm = _worker_params
+    return compress_symbols(img_shape, symbols, levels, mean, var, centroids, cm.given(prev_symbols))
+
+
+def _pack_streams(header, streams):
+    """ header, followed by len(streams) + 1 uint32 offsets and the streams """
+    offsets = np.cumsum([0] + [len(stream) for stream in streams]).astype('<u4')
+    return b''.join([header, offsets.tobytes()] + streams)
+
+
+def _unpack_streams(data, header_size, num_streams):
+    """ Inverse of _pack_streams. Offsets in the table count from the end of the table. """
+    table = np.frombuffer(data, dtype='<u4', count=num_streams + 1, offset=header_size)
+    offsets = table.astype(np.int64) + header_size + table.nbytes
+    assert offsets[-1] == len(data) and np.all(np.diff(offsets) >= 0), 'Invalid offset table'
+    return [data[offsets[i]:offsets[i + 1]] for i in range(num_streams)]
+
+
+def pad_to_multiple(img, multiple):
+    pad_h = -img.shape[0] % multiple
+    pad_w = -img.shape[1] % multiple
+    return np.pad(img, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+
+
+def tile_grid(img_h, img_w, tile_size):
+    """ :return: list of (top, left, height, width) of all tiles, in raster order """
+    return [(top, left, min(tile_size, img_h - top), min(tile_size, img_w - left))
+            for top in range(0, img_h, tile_size)
+            for left in range(0, img_w, tile_size)]
+
+
+def _intersects(tile, region):
+    top, left, height, width = tile
+    r_top, r_left, r_height, r_width = region
+    return top < r_top + r_height and r_top < top + height and left < r_left + r_width and r_left < left + width
+
+
+class Codec(object):
+
+    def __init__(self, ckpt_path, num_workers=None, batch_size=16):
+        """
+        :param num_workers: number of processes used to entropy code tiles, defaults to the number of CPUs
+        :param batch_size: number of tiles that go through the encoder or decoder network at once
+        """
+        assert tf is not None, 'Codec needs TensorFlow'
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.x = tf.placeholder(tf.float32, [None, None, None, 3], name="x")
+            model.get_centroids()
+            x_n, self.mean, self.var = model.normalize(self.x)
+            self.z, self.y = model.encoder(x_n, training=False)
+
+            self.z_hat = tf.placeholder(tf.float32, [None, None, None, model.K], name="z_hat")
+            self.mean_in = tf.placeholder(tf.float32, [None, 1, 1, 3], name="mean")
+            self.var_in = tf.placeholder(tf.float32, [None, 1, 1, 3], name="var")
+            self.x_hat = model.denormalize(model.decoder(self.z_hat, training=False), self.mean_in, self.var_in)
+
+            self.sess = tf.Session()
+            tf.train.Saver().restore(self.sess, ckpt_path)
+
+        reader = tf.train.load_checkpoint(ckpt_path)
+        self.centroids = reader.get_tensor('centroid')
+        self.context_model = context_model.from_checkpoint(reader.get_tensor, reader.has_tensor, self.centroids)
+
+    def _params(self):
+        return self.centroids, self.context_model
+
+    def _assert_temporal(self):
+        assert isinstance(self.context_model, context_model.TemporalContextModel), \
+            'Video coding needs a checkpoint of the temporal context model'
+
+    def _quantize_batch(self, imgs, mode):
+        """ :return: list of (symbols, levels, mean, var) of the images imgs, which have the same shape """
+        z, y, mean, var = self._run_encoder([pad_to_multiple(img, model.SUBSAMPLING) for img in imgs])
+        latents = []
+        for i in range(len(imgs)):
+            symbols = quantize(z[i], y[i], self.centroids)
+            levels = importance_levels(y[i], symbols.shape[2]) if mode == 'masked' else None
+            latents.append((symbols, levels, mean[i], var[i]))
+        return latents
+
+    def _pool(self):
+        return futures.ProcessPoolExecutor(self.num_workers, initializer=_init_worker, initargs=self._params())
+
+    def _run_encoder(self, imgs):
+        """ :param imgs: list of uint8 arrays [H, W, 3] of the same shape, padded to a multiple of SUBSAMPLING """
+        x = np.stack(imgs).astype(np.float32) / 255.
+        return self.sess.run((self.z, self.y, self.mean, self.var), feed_dict={self.x: x})
+
+    def _run_decoder(self, z_hats, means, variances):
+        x_hat = self.sess.run(self.x_hat, feed_dict={self.z_hat: np.stack(z_hats),
+                                                     self.mean_in: np.reshape(means, [-1, 1, 1, 3]),
+                                                     self.var_in: np.reshape(variances, [-1, 1, 1, 3])})
+        return np.round(x_hat * 255.).astype(np.uint8)
+
+    def compress(self, img, mode='masked'):
+        """ :param img: uint8 array [H, W, 3] :param mode: one of MODES :return: bytes """
+        z, y, mean, var = self._run_encoder([pad_to_multiple(img, model.SUBSAMPLING)])
+        return compress_latent(img.shape[:2], z[0], y[0], mean[0], var[0], *self._params(), mode=mode)
+
+    def decompress(self, data):
+        """ :param data: bytes, as returned by compress() or compress_tiled() :return: uint8 array [H, W, 3] """
+        if data[:len(_TILED_MAGIC)] == _TILED_MAGIC:
+            return self.decompress_tiled(data)
+        z_hat, mean, var, (img_h, img_w) = decompress_latent(data, *self._params())
+        return self._run_decoder([z_hat], [mean], [var])[0, :img_h, :img_w]
+
+    def compress_tiled(self, img, tile_size=160, mode='masked'):
+        """ Split img into tiles of tile_size x tile_size, which are coded independently. :return: bytes """
+        assert tile_size % model.SUBSAMPLING == 0, 'tile_size must be a multiple of {}'.format(model.SUBSAMPLING)
+        tiles = tile_grid(img.shape[0], img.shape[1], tile_size)
+        img_padded = pad_to_multiple(img, tile_size)
+        latents = []
+        for i in range(0, len(tiles), self.batch_size):
+            batch = tiles[i:i + self.batch_size]
+            z, y, mean, var = self._run_encoder([img_padded[top:top + tile_size, left:left + tile_size]
+                                                 for top, left, _, _ in batch])
+            latents.extend(((height, width), z[j], y[j], mean[j], var[j], mode)
+                           for j, (_, _, height, width) in enumerate(batch))
+        with self._pool() as pool:
+            tile_streams = list(pool.map(_compress_latent_in_worker, latents))
+
+        header = _TILED_HEADER.pack(_TILED_MAGIC, _VERSION, tile_size, img.shape[0], img.shape[1], len(tiles))
+        return _pack_streams(header, tile_streams)
+
+    def decompress_tiled(self, data, region=None):
+        """
+        :param region: optional (top, left, height, width). If given, only tiles intersecting it are decoded.
+        :return: uint8 array, the whole image or the region
+        """
+        magic, version, tile_size, img_h, img_w, num_tiles = _TILED_HEADER.unpack_from(data)
+        assert magic == _TILED_MAGIC and version == _VERSION, 'Not a tiled bitstream (version {})'.format(_VERSION)
+        tile_streams = _unpack_streams(data, _TILED_HEADER.size, num_tiles)
+        region = region or (0, 0, img_h, img_w)
+
+        tiles = tile_grid(img_h, img_w, tile_size)
+        assert len(tiles) == num_tiles, 'Invalid tile table'
+        needed = [i for i, tile in enumerate(tiles) if _intersects(tile, region)]
+        with self._pool() as pool:
+            latents = list(pool.map(_decompress_latent_in_worker, [tile_streams[i] for i in needed]))
+
+        r_top, r_left, r_height, r_width = region
+        out = np.zeros((r_height, r_width, 3), dtype=np.uint8)
+        for b in range(0, len(needed), self.batch_size):
+            batch = latents[b:b + self.batch_size]
+            x_hats = self._run_decoder(*zip(*[latent[:3] for latent in batch]))
+            for i, x_hat in zip(needed[b:b + self.batch_size], x_hats):
+                top, left, height, width = tiles[i]
+                y0, y1 = max(top, r_top), min(top + height, r_top + r_height)
+                x0, x1 = max(left, r_left), min(left + width, r_left + r_width)
+                out[y0 - r_top:y1 - r_top, x0 - r_left:x1 - r_left] = x_hat[y0 - top:y1 - top, x0 - left:x1 - left]
+        return out
+
+    def compress_frames(self, frames, mode='masked'):
+        """
+        Code consecutive frames of a video, each one conditioned on the previous one.
+        :param frames: list of uint8 arrays [H, W, 3] of the same shape, at least one
+        :return: bytes
+        """
+        self._assert_temporal()
+        assert len(frames) > 0, 'No frames to compress'
+        latents = []
+        for b in range(0, len(frames), self.batch_size):
+            latents.extend(self._quantize_batch(frames[b:b + self.batch_size], mode))
+        with self._pool() as pool:
+            frame_streams = list(pool.map(_compress_frame_in_worker, [
+                (frames[0].shape[:2], symbols, levels, mean, var, latents[i - 1][0] if i > 0 else None)
+                for i, (symbols, levels, mean, var) in enumerate(latents)]))
+        return _pack_streams(_VIDEO_HEADER.pack(_VIDEO_MAGIC, _VERSION, len(frames)), frame_streams)
+
+    def decompress_frames(self, data):
+        """ Inverse of compress_frames. :return: list of uint8 arrays [H, W, 3] """
+        self._assert_temporal()
+        magic, version, num_frames = _VIDEO_HEADER.unpack_from(data)
+        assert magic == _VIDEO_MAGIC and version == _VERSION, 'Not a video bitstream (version {})'.format(_VERSION)
+        latents = []
+        prev_symbols = None
+        for frame_stream in _unpack_streams(data, _VIDEO_HEADER.size, num_frames):
+            symbols, mean, var, (img_h, img_w) = decompress_symbols(
+                frame_stream, self.centroids, self.context_model.given(prev_symbols))
+            latents.append((self.centroids[symbols], mean, var))
+            prev_symbols = symbols
+        frames = []
+        for b in range(0, num_frames, self.batch_size):
+            frames.extend(self._run_decoder(*zip(*latents[b:b + self.batch_size]))[:, :img_h, :img_w])
+        return frames
+
+
+def _bits_per_pixel(num_bytes, img):
+    return 8. * num_bytes / (img.shape[0] * img.shape[1])
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    mode_subparsers = parser.add_subparsers(dest='mode', title='Mode')
+    parser_compress = mode_subparsers.add_parser('compress', help='Compress an image to a bitstream.')
+    parser_compress.add_argument('ckpt', type=str)
+    parser_compress.add_argument('image', type=str)
+    parser_compress.add_argument('out', type=str)
+    parser_compress.add_argument('--coding_mode', type=str, choices=MODES, default='masked')
+    parser_compress.add_argument('--tile_size', type=int,
+                                 help='If given, code tiles of TILE_SIZE x TILE_SIZE independently and in parallel.')
+    parser_compress.add_argument('--num_workers', type=int, help='Number of processes for tiles, default: all CPUs.')
+    parser_decompress = mode_subparsers.add_parser('decompress', help='Decompress a bitstream to an image.')
+    parser_decompress.add_argument('ckpt', type=str)
+    parser_decompress.add_argument('bitstream', type=str)
+    parser_decompress.add_argument('out', type=str)
+    parser_decompress.add_argument('--region', type=int, nargs=4, metavar=('TOP', 'LEFT', 'HEIGHT', 'WIDTH'),
+                                   help='Only decode this region. Needs a bitstream written with --tile_size.')
+    parser_decompress.add_argument('--num_workers', type=int, help='Number of processes for tiles, default: all CPUs.')
+    parser_compress_frames = mode_subparsers.add_parser(
+        'compress_frames', help='Compress consecutive frames of a video, with a checkpoint of the temporal model.')
+    parser_compress_frames.add_argument('ckpt', type=str)
+    parser_compress_frames.add_argument('out', type=str)
+    parser_compress_frames.add_argument('frames', type=str, nargs='+')
+    parser_compress_frames.add_argument('--coding_mode', type=str, choices=MODES, default='masked')
+    parser_compress_frames.add_argument('--num_workers', type=int,
+                                        help='Number of processes for frames, default: all CPUs.')
+    parser_decompress_frames = mode_subparsers.add_parser(
+        'decompress_frames', help='Decompress the frames of a video to OUT_DIR/frame_I.png.')
+    parser_decompress_frames.add_argument('ckpt', type=str)
+    parser_decompress_frames.add_argument('bitstream', type=str)
+    parser_decompress_frames.add_argument('out_dir', type=str)
+    flags = parser.parse_args(args)
+    if flags.mode == 'compress':
+        img = np.array(Image.open(flags.image).convert('RGB'))
+        codec = Codec(flags.ckpt, flags.num_workers)
+        if flags.tile_size:
+            data = codec.compress_tiled(img, flags.tile_size, flags.coding_mode)
+        else:
+            data = codec.compress(img, flags.coding_mode)
+        with open(flags.out, 'wb') as f:
+            f.write(data)
+        print('{}: {} bytes, {:.4f} bpp'.format(flags.out, len(data), _bits_per_pixel(len(data), img)))
+    elif flags.mode == 'decompress':
+        with open(flags.bitstream, 'rb') as f:
+            data = f.read()
+        codec = Codec(flags.ckpt, flags.num_workers)
+        if flags.region:
+            img = codec.decompress_tiled(data, flags.region)
+        else:
+            img = codec.decompress(data)
+        Image.fromarray(img).save(flags.out)
+        print('{}: {}x{}'.format(flags.out, img.shape[1], img.shape[0]))
+    elif flags.mode == 'compress_frames':
+        frames = [np.array(Image.open(p).convert('RGB')) for p in flags.frames]
+        codec = Codec(flags.ckpt, flags.num_workers)
+        data = codec.compress_frames(frames, flags.coding_mode)
+        with open(flags.out, 'wb') as f:
+            f.write(data)
+        print('{}: {} frames, {} bytes, {:.4f} bpp'.format(
+            flags.out, len(frames), len(data), _bits_per_pixel(len(data), frames[0]) / len(frames)))
+    elif flags.mode == 'decompress_frames':
+        with open(flags.bitstream, 'rb') as f:
+            data = f.read()
+        codec = Codec(flags.ckpt)
+        frames = codec.decompress_frames(data)
+        os.makedirs(flags.out_dir, exist_ok=True)
+        for i, frame in enumerate(frames):
+            Image.fromarray(frame).save(os.path.join(flags.out_dir, 'frame_{:04d}.png'.format(i)))
+        print('{}: {} frames of {}x{}'.format(flags.out_dir, len(frames), frames[0].shape[1], frames[0].shape[0]))
+    else:
+        parser.print_usage()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,284 @@
+"""
+NumPy evaluation of the masked conv3d context model of AutoEncoder.py, used for entropy coding.
+
+Encoder and decoder have to agree bit-exactly on every probability, so the network is evaluated in fixed point:
+weights and activations are scaled by 2**FRAC_BITS and rounded to integers. They are stored in float64 arrays,
+where all products and sums stay integers below 2**53, i.e., every result is exact and independent of the
+summation order used by BLAS. The softmax is replaced by an integer exp table.
+
+Three variants are supported, selected with context_model_type in AutoEncoder.py:
+- MaskedContextModel: the masked conv3d model, symbols are decoded one by one in raster order.
+- GroupedContextModel: symbols are split into groups, by channel slice and by a spatial checkerboard. Each group is
+  conditioned on all previous groups only, so a whole group is decoded with one forward pass.
+- TemporalContextModel: the masked model, also conditioned on the symbols of the previous frame of a video.
+"""
+import copy
+import math
+import numpy as np
+
+from range_coder import MAX_TOTAL, freqs_to_cdf
+
+
+FRAC_BITS = 10
+_SCALE = float(1 << FRAC_BITS)
+
+_EXP_TABLE_RANGE = 16  # exp(-16) is already far below the 1/MAX_TOTAL resolution of the coder
+_EXP_TABLE = np.array([int(round(math.exp(-i / _SCALE) * MAX_TOTAL))
+                       for i in range(_EXP_TABLE_RANGE * (1 << FRAC_BITS) + 1)], dtype=np.int64)
+
+LAYER_NAMES = ('conv1', 'conv2', 'conv3', 'conv4')
+
+# Causal masks over (row, column, channel), as mask_filter1, mask_filter2 and mask_filter3 in AutoEncoder.py
+MASK_A = np.array([[[1, 1, 1], [1, 1, 1], [1, 1, 1]],
+                   [[1, 1, 1], [1, 0, 0], [0, 0, 0]],
+                   [[0, 0, 0], [0, 0, 0], [0, 0, 0]]], dtype=np.float64)
+MASK_B = np.array([[[1, 1, 1], [1, 1, 1], [1, 1, 1]],
+                   [[1, 1, 1], [1, 1, 0], [0, 0, 0]],
+                   [[0, 0, 0], [0, 0, 0], [0, 0, 0]]], dtype=np.float64)
+_MASKS = {'conv1': MASK_A, 'conv2': MASK_B, 'conv3': MASK_B, 'conv4': MASK_B}
+
+
+GROUPED_PREFIX = 'g'  # variables of the grouped model are Wg_conv1, bg_conv1, ...
+NUM_SLICES_VARIABLE = 'context_model_slices'
+TEMPORAL_VARIABLE = 'Wt_conv1'  # unmasked conv3d over the previous frame, only in checkpoints of the temporal model
+
+
+def checkpoint_variable_names(prefix=''):
+    """ Names of the context model variables in a checkpoint written by AutoEncoder.py """
+    return ['W' + prefix + '_' + name for name in LAYER_NAMES] + ['b' + prefix + '_' + name for name in LAYER_NAMES]
+
+
+def quantize_weights(variables, prefix='', masked=True):
+    """
+    :param variables: dict with the float values of W_conv1..W_conv4, b_conv1..b_conv4
+    :return: dict layer name -> (W, b), masked and in fixed point. W has shape [3, 3, 3, C_in, C_out]
+    """
+    qweights = {}
+    for name in LAYER_NAMES:
+        W = np.asarray(variables['W' + prefix + '_' + name], dtype=np.float64)
+        b = np.asarray(variables['b' + prefix + '_' + name], dtype=np.float64)
+        if masked:
+            W = W * _MASKS[name][:, :, :, np.newaxis, np.newaxis]
+        qweights[name] = (np.round(W * _SCALE), np.round(b * _SCALE * _SCALE))
+    return qweights
+
+
+def quantize_centroids(centroids):
+    return np.round(np.asarray(centroids, dtype=np.float64) * _SCALE)
+
+
+def _conv3d_acc(a, W):
+    """ 'SAME' conv3d without bias and rescaling. a: [D, H, W, C_in] -> [D, H, W, C_out], at scale 2**(2 FRAC_BITS) """
+    d, h, w = a.shape[:3]
+    a = np.pad(a, ((1, 1), (1, 1), (1, 1), (0, 0)), mode='constant')
+    # im2col over the taps that are not masked out, followed by a single matrix product
+    taps = np.nonzero(np.any(W != 0, axis=(3, 4)))
+    patches = np.concatenate([a[i:i + d, j:j + h, k:k + w] for i, j, k in zip(*taps)], axis=-1)
+    return np.dot(patches.reshape(d * h * w, -1), W[taps].reshape(-1, W.shape[-1])).reshape(d, h, w, -1)
+
+
+def _conv3d(a, W, b):
+    """ 'SAME' conv3d. a: [D, H, W, C_in] -> [D, H, W, C_out], at scale 2**FRAC_BITS. b: [C_out] or [D, H, W, C_out] """
+    return np.floor((_conv3d_acc(a, W) + b) / _SCALE)
+
+
+def _forward(volume, qweights):
+    """ :param volume: [H, W, K, C_in] fixed point inputs :return: logits [H, W, K, L] """
+    conv1 = np.maximum(_conv3d(volume, *qweights['conv1']), 0)
+    conv2 = np.maximum(_conv3d(conv1, *qweights['conv2']), 0)
+    conv3 = _conv3d(conv2, *qweights['conv3'])
+    return np.maximum(_conv3d(conv3 + conv1, *qweights['conv4']), 0)
+
+
+def logits(symbols, qcentroids, qweights):
+    """
+    Evaluate the masked context model on a fully known volume, i.e., on the encoder side.
+    :param symbols: int array [H, W, K] of centroid indices
+    :return: logits [H, W, K, L] in fixed point
+    """
+    return _forward(qcentroids[symbols][..., np.newaxis], qweights)
+
+
+def group_ids(shape, num_slices):
+    """
+    Decoding group of every symbol for the grouped context model. Channels are split into num_slices slices, each
+    slice into the two fields of a spatial checkerboard. Groups are decoded in the order slice 0 field 0, slice 0
+    field 1, slice 1 field 0, ...
+    :param shape: (H, W, K) :return: int array [H, W, K]
+    """
+    H, W, K = shape
+    assert K % num_slices == 0, 'K={} is not divisible into {} slices'.format(K, num_slices)
+    h, w, k = np.meshgrid(np.arange(H), np.arange(W), np.arange(K), indexing='ij')
+    return 2 * (k // (K // num_slices)) + (h + w) % 2
+
+
+def from_checkpoint(get_tensor, has_tensor, centroids):
+    """
+    :param get_tensor: function returning the value of a checkpoint variable, e.g., CheckpointReader.get_tensor
+    :param has_tensor: function returning whether a variable is in the checkpoint
+    :return: MaskedContextModel, GroupedContextModel or TemporalContextModel, depending on which one was trained
+    """
+    if has_tensor(NUM_SLICES_VARIABLE):
+        variables = {name: get_tensor(name) for name in checkpoint_variable_names(GROUPED_PREFIX)}
+        return GroupedContextModel(variables, centroids, int(get_tensor(NUM_SLICES_VARIABLE)))
+    variables = {name: get_tensor(name) for name in checkpoint_variable_names()}
+    if has_tensor(TEMPORAL_VARIABLE):
+        variables[TEMPORAL_VARIABLE] = get_tensor(TEMPORAL_VARIABLE)
+        return TemporalContextModel(variables, centroids)
+    return MaskedContextModel(variables, centroids)
+
+
+class MaskedContextModel(object):
+
+    def __init__(self, variables, centroids):
+        self.qweights = quantize_weights(variables)
+        self.qcentroids = quantize_centroids(centroids)
+
+    def logits(self, symbols):
+        """ :param symbols: int array [H, W, K] :return: fixed point logits [H, W, K, L] """
+        return logits(symbols, self.qcentroids, self.qweights)
+
+    def coding_order(self, shape):
+        """ :return: flat indices of all symbols in the order in which they are coded """
+        return np.arange(np.prod(shape))
+
+    def decode(self, shape, decode_symbol, active, fill_symbol):
+        """
+        :param decode_symbol: function, cdf (list of L + 1 ints) -> symbol
+        :param active: bool array [H, W, K], symbols to decode
+        :param fill_symbol: value of all symbols that are not active
+        :return: int array [H, W, K]
+        """
+        symbols = np.full(shape, fill_symbol, dtype=np.int64)
+        cm = IncrementalContextModel(shape, self.qweights, self.qcentroids[fill_symbol])
+        for h, w, k in np.ndindex(*shape):
+            cm.advance(h, w, k)
+            if not active[h, w, k]:
+                continue
+            s = decode_symbol(freqs_to_cdf(logits_to_freqs(cm.logits(h, w, k))).tolist())
+            symbols[h, w, k] = s
+            cm.set(h, w, k, self.qcentroids[s])
+        return symbols
+
+
+class TemporalContextModel(MaskedContextModel):
+    """
+    Masked model, conditioned on the symbols of the previous frame. Their centroids and an indicator channel go through
+    an unmasked conv3d, Wt_conv1, whose output is added to the first layer. As the previous frame is known to the
+    decoder, this is just a bias of conv1 per position. Without a previous frame, both inputs are 0, and the model is
+    the masked model, which is what this class evaluates for single images.
+    """
+
+    def __init__(self, variables, centroids):
+        super(TemporalContextModel, self).__init__(variables, centroids)
+        self.qWt = np.round(np.asarray(variables[TEMPORAL_VARIABLE], dtype=np.float64) * _SCALE)
+
+    def given(self, prev_symbols):
+        """
+        :param prev_symbols: int array [H, W, K], symbols of the previous frame, or None for the first frame
+        :return: context model of the next frame, with the same interface as MaskedContextModel
+        """
+        if prev_symbols is None:
+            return self
+        cm = copy.copy(self)
+        W, b = self.qweights['conv1']
+        prev = np.stack([self.qcentroids[prev_symbols], np.full(prev_symbols.shape, _SCALE)], axis=-1)
+        cm.qweights = dict(self.qweights, conv1=(W, b + _conv3d_acc(prev, self.qWt)))
+        return cm
+
+
+class GroupedContextModel(object):
+
+    def __init__(self, variables, centroids, num_slices):
+        self.qweights = quantize_weights(variables, prefix=GROUPED_PREFIX, masked=False)
+        self.qcentroids = quantize_centroids(centroids)
+        self.num_slices = num_slices
+
+    def _group_logits(self, symbols, known):
+        """ Logits given the symbols where known is True. known is 0 or 1, and also an input of the network. """
+        known = known.astype(np.float64)
+        return _forward(np.stack([self.qcentroids[symbols] * known, known * _SCALE], axis=-1), self.qweights)
+
+    def logits(self, symbols):
+        groups = group_ids(symbols.shape, self.num_slices)
+        l = np.zeros(symbols.shape + (len(self.qcentroids),))
+        for g in range(2 * self.num_slices):
+            l[groups == g] = self._group_logits(symbols, groups < g)[groups == g]
+        return l
+
+    def coding_order(self, shape):
+        return np.argsort(group_ids(shape, self.num_slices).reshape(-1), kind='stable')
+
+    def decode(self, shape, decode_symbol, active, fill_symbol):
+        symbols = np.full(shape, fill_symbol, dtype=np.int64)
+        groups = group_ids(shape, self.num_slices)
+        for g in range(2 * self.num_slices):
+            decode_now = (groups == g) & active
+            cdfs = freqs_to_cdf(logits_to_freqs(self._group_logits(symbols, groups < g)[decode_now]))
+            symbols[decode_now] = [decode_symbol(cdf) for cdf in cdfs.tolist()]
+        return symbols
+
+
+class IncrementalContextModel(object):
+    """
+    Evaluates the context model one position at a time, in raster order, for decoding.
+
+    The activations of all layers are cached. Since every layer is causal, the activations at a position only depend
+    on symbols before it, and are final as soon as they are computed. Every step therefore only evaluates the four
+    layers at the new position, instead of the whole receptive field.
+    """
+
+    def __init__(self, shape, qweights, fill_value=0.):
+        """
+        :param shape: (H, W, K) of the symbol volume
+        :param fill_value: fixed point value of all symbols that are not set(), e.g., masked out symbols
+        """
+        padded = tuple(d + 2 for d in shape)
+        self.volume = np.zeros(padded + (1,))
+        self.volume[1:-1, 1:-1, 1:-1] = fill_value
+        self.conv1 = np.zeros(padded + (qweights['conv1'][0].shape[-1],))
+        self.conv2 = np.zeros(padded + (qweights['conv2'][0].shape[-1],))
+        self.conv3_conv1 = np.zeros(padded + (qweights['conv3'][0].shape[-1],))
+        self.layers = {name: (W.reshape(-1, W.shape[-1]), b) for name, (W, b) in qweights.items()}
+
+    def _layer(self, name, a, window, position=None):
+        W, b = self.layers[name]
+        if b.ndim > 1:  # bias per position, see TemporalContextModel
+            b = b[position]
+        return np.floor((np.dot(a[window].reshape(-1), W) + b) / _SCALE)
+
+    def advance(self, h, w, k):
+        """ Compute the activations at (h, w, k). All symbols before it have to be set() already. """
+        window = (slice(h, h + 3), slice(w, w + 3), slice(k, k + 3))
+        p = (h + 1, w + 1, k + 1)
+        self.conv1[p] = np.maximum(self._layer('conv1', self.volume, window, (h, w, k)), 0)
+        self.conv2[p] = np.maximum(self._layer('conv2', self.conv1, window), 0)
+        self.conv3_conv1[p] = self._layer('conv3', self.conv2, window) + self.conv1[p]
+
+    def logits(self, h, w, k):
+        """ Logits of the symbol at (h, w, k), after advance(h, w, k) """
+        window = (slice(h, h + 3), slice(w, w + 3), slice(k, k + 3))
+        return np.maximum(self._layer('conv4', self.conv3_conv1, window), 0)
+
+    def set(self, h, w, k, value):
+        self.volume[h + 1, w + 1, k + 1, 0] = value
+
+
+def logits_to_freqs(l):
+    """ Integer softmax. l: [..., L] fixed point logits -> freqs: int64 [..., L], each >= 1, sum <= MAX_TOTAL """
+    l = np.asarray(l).astype(np.int64)
+    num_symbols = l.shape[-1]
+    d = np.minimum(np.max(l, axis=-1, keepdims=True) - l, len(_EXP_TABLE) - 1)
+    e = _EXP_TABLE[d]
+    return 1 + (e * (MAX_TOTAL - num_symbols)) // np.sum(e, axis=-1, keepdims=True)
+
+
+def bits(l, symbols):
+    """
+    Code length in bits of symbols under the softmax of the fixed point logits l, as in H_context_model.
+    :param l: [..., L] :param symbols: int array [...] :return: float64 array [...]
+    """
+    l = np.asarray(l, dtype=np.float64) / _SCALE
+    l_max = np.max(l, axis=-1, keepdims=True)
+    log_z = l_max[..., 0] + np.log(np.sum(np.exp(l - l_max), axis=-1))
+    return (log_z - np.take_along_axis(l, symbols[..., np.newaxis], axis=-1)[..., 0]) / np.log(2.)
@@ -0,0 +1,238 @@
+"""
+Evaluate an AutoEncoder.py checkpoint on a set of images. For each image, the report has
+- ms_ssim, psnr: of the decoded image, as returned by codec.py, against the input
+- estimated_bpp: bits per pixel of all symbols under the context model, as in H_context_model (without the clipping)
+- bpp, num_bytes: size of the real bitstream written by codec.py
+
+    python evaluate.py CKPT INPUT REPORT [--coding_mode dense] [--crop 160] [--batch_size 16] [--num_workers 4]
+                       [--video NUM_FRAMES]
+
+INPUT is a directory of images, or a glob of TFRecords with 'image/encoded' and 'image/filename' features, as written
+by util/tf_records.py. REPORT is a .csv or .json file. Images go through the networks and the metrics in batches of
+images of the same shape, so use --crop for sets of images of different sizes. MS-SSIM needs images of at least
+144 x 144 pixels.
+
+With --video, INPUT is a glob of TFRecords of NUM_FRAMES consecutive frames per example, written by
+`tf_records.py mk_img_recs --num_per_ex NUM_FRAMES`, and CKPT a checkpoint of the temporal context model. For each
+frame, the report has the bpp when coded on its own (intra) and conditioned on the previous frame (inter), as
+codec.py compress_frames does. The reconstruction is the same for both.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+import codec
+import context_model
+import input_pipeline
+import model
+from ms_ssim import ms_ssim
+
+
+_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm')
+_FIELDS = ('name', 'height', 'width', 'ms_ssim', 'psnr', 'estimated_bpp', 'bpp', 'num_bytes')
+_VIDEO_FIELDS = ('name', 'frame', 'height', 'width', 'bpp_intra', 'bpp_inter', 'estimated_bpp_intra',
+                 'estimated_bpp_inter')
+_KEY_FIELDS = ('name', 'frame', 'height', 'width')  # not averaged in JSON reports
+
+
+def iterate_images(path):
+    """ :param path: directory of images or glob of TFRecords :return: generator of (name, uint8 array [H, W, 3]) """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(_IMAGE_EXTENSIONS):
+                yield name, np.array(Image.open(os.path.join(path, name)).convert('RGB'))
+        return
+    record_paths = sorted(glob.glob(path))
+    assert len(record_paths) > 0, 'No images or records at {}'.format(path)
+    for record_path in record_paths:
+        options = input_pipeline.record_options(input_pipeline.record_compression(record_path))
+        for record in tf.python_io.tf_record_iterator(record_path, options):
+            features = tf.train.Example.FromString(record).features.feature
+            name = features['image/filename'].bytes_list.value[0].decode()
+            encoded = features['image/encoded'].bytes_list.value[0]
+            yield name, np.array(Image.open(io.BytesIO(encoded)).convert('RGB'))
+
+
+def iterate_frame_sequences(records_glob, num_frames, feature_key='M'):
+    """ :return: generator of (name, uint8 array [num_frames, H, W, 3]) of the examples of the records """
+    keys = [feature_key + '_' + str(i) for i in range(num_frames)]
+    record_paths = sorted(glob.glob(records_glob))
+    assert len(record_paths) > 0, 'No records at {}'.format(records_glob)
+    for record_path in record_paths:
+        options = input_pipeline.record_options(input_pipeline.record_compression(record_path))
+        for i, record in enumerate(tf.python_io.tf_record_iterator(record_path, options)):
+            features = tf.train.Example.FromString(record).features.feature
+            frames = [np.array(Image.open(io.BytesIO(features[key].bytes_list.value[0])).convert('RGB'))
+                      for key in keys]
+            yield '{}:{}'.format(os.path.basename(record_path), i), np.stack(frames)
+
+
+def center_crop(img, size):
+    top = max(0, (img.shape[0] - size) // 2)
+    left = max(0, (img.shape[1] - size) // 2)
+    return img[top:top + size, left:left + size]
+
+
+def _batches(images, batch_size):
+    """ Batches of consecutive images of the same shape """
+    batch = []
+    for name, img in images:
+        if batch and (len(batch) == batch_size or batch[0][1].shape != img.shape):
+            yield batch
+            batch = []
+        batch.append((name, img))
+    if batch:
+        yield batch
+
+
+# The workers run in the pool of codec.Codec, which sets codec._worker_params once per process.
+def _evaluate_latent_in_worker(args):
+    """ :return: (number of bytes of the bitstream, estimated number of bits, z_hat) """
+    img_shape, z, y, mean, var, mode = args
+    centroids, cm = codec._worker_params
+    symbols = codec.quantize(z, y, centroids)
+    logits = cm.logits(symbols)
+    levels = codec.importance_levels(y, symbols.shape[2]) if mode == 'masked' else None
+    data = codec.compress_symbols(img_shape, symbols, levels, mean, var, centroids, cm, logits)
+    return len(data), np.sum(context_model.bits(logits, symbols)), centroids[symbols]
+
+
+def _evaluate_frame_in_worker(args):
+    """ :return: (number of bytes intra, inter, estimated number of bits intra, inter) of a video frame """
+    img_shape, symbols, levels, mean, var, prev_symbols = args
+    centroids, cm = codec._worker_params
+    num_bytes, estimated_bits = [], []
+    for frame_cm in (cm, cm.given(prev_symbols)):
+        logits = frame_cm.logits(symbols)
+        data = codec.compress_symbols(img_shape, symbols, levels, mean, var, centroids, frame_cm, logits)
+        num_bytes.append(len(data))
+        estimated_bits.append(np.sum(context_model.bits(logits, symbols)))
+    return num_bytes + estimated_bits
+
+
+class Evaluator(codec.Codec):
+
+    def __init__(self, ckpt_path, num_workers=None, batch_size=16):
+        super(Evaluator, self).__init__(ckpt_path, num_workers, batch_size)
+        with self.graph.as_default():
+            self.x_ref = tf.placeholder(tf.float32, [None, None, None, 3], name="x_ref")
+            self.x_rec = tf.placeholder(tf.float32, [None, None, None, 3], name="x_rec")
+            self.ms_ssim, _ = ms_ssim(self.x_ref, self.x_rec)
+            mse = tf.reduce_mean(tf.square(self.x_ref - self.x_rec), axis=[1, 2, 3])
+            self.psnr = 10. * tf.log(1. / tf.maximum(mse, 1e-10)) / np.log(10.)
+
+    def evaluate(self, images, mode='masked'):
+        """
+        :param images: iterable of (name, uint8 array [H, W, 3])
+        :return: generator of dicts with the keys of _FIELDS, one per image
+        """
+        with self._pool() as pool:
+            for batch in _batches(images, self.batch_size):
+                names, imgs = zip(*batch)
+                img_h, img_w = imgs[0].shape[:2]
+                z, y, mean, var = self._run_encoder([codec.pad_to_multiple(img, model.SUBSAMPLING) for img in imgs])
+                num_bytes, estimated_bits, z_hats = zip(*pool.map(
+                    _evaluate_latent_in_worker, [((img_h, img_w), z[i], y[i], mean[i], var[i], mode)
+                                                 for i in range(len(imgs))]))
+                x_hat = self._run_decoder(z_hats, mean, var)[:, :img_h, :img_w]
+                ms_ssim_values, psnr_values = self.sess.run((self.ms_ssim, self.psnr), feed_dict={
+                    self.x_ref: np.stack(imgs).astype(np.float32) / 255.,
+                    self.x_rec: x_hat.astype(np.float32) / 255.})
+                num_pixels = float(img_h * img_w)
+                for i, name in enumerate(names):
+                    yield dict(zip(_FIELDS, (name, img_h, img_w, float(ms_ssim_values[i]), float(psnr_values[i]),
+                                             estimated_bits[i] / num_pixels, 8. * num_bytes[i] / num_pixels,
+                                             num_bytes[i])))
+
+    def evaluate_video(self, sequences, num_frames, mode='masked'):
+        """
+        :param sequences: iterable of (name, uint8 array [num_frames, H, W, 3])
+        :return: generator of dicts with the keys of _VIDEO_FIELDS, one per frame
+        """
+        self._assert_temporal()
+        with self._pool() as pool:
+            for batch in _batches(sequences, max(1, self.batch_size // num_frames)):
+                names, sequence_frames = zip(*batch)
+                img_h, img_w = sequence_frames[0].shape[1:3]
+                latents = self._quantize_batch([frame for frames in sequence_frames for frame in frames], mode)
+                results = pool.map(_evaluate_frame_in_worker, [
+                    ((img_h, img_w), symbols, levels, mean, var, latents[i - 1][0] if i % num_frames else None)
+                    for i, (symbols, levels, mean, var) in enumerate(latents)])
+                num_pixels = float(img_h * img_w)
+                for i, (bytes_intra, bytes_inter, bits_intra, bits_inter) in enumerate(results):
+                    yield dict(zip(_VIDEO_FIELDS, (names[i // num_frames], i % num_frames, img_h, img_w,
+                                                   8. * bytes_intra / num_pixels, 8. * bytes_inter / num_pixels,
+                                                   bits_intra / num_pixels, bits_inter / num_pixels)))
+
+
+def write_report(results, path, ckpt_path, mode, fields=_FIELDS):
+    """ Write results to path, as CSV or, if path ends with .json, as JSON with the means over all images """
+    if path.endswith('.json'):
+        means = {field: float(np.mean([r[field] for r in results])) for field in fields if field not in _KEY_FIELDS}
+        with open(path, 'w') as f:
+            json.dump({'ckpt': ckpt_path, 'coding_mode': mode, 'num_images': len(results), 'mean': means,
+                       'images': results}, f, indent=2)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def evaluate_video(flags):
+    sequences = iterate_frame_sequences(flags.input, flags.video)
+    if flags.crop:
+        sequences = ((name, np.stack([center_crop(frame, flags.crop) for frame in frames]))
+                     for name, frames in sequences)
+    evaluator = Evaluator(flags.ckpt, flags.num_workers, flags.batch_size)
+    results = []
+    for result in evaluator.evaluate_video(sequences, flags.video, flags.coding_mode):
+        results.append(result)
+        print('{name} frame {frame}: {bpp_intra:.4f} bpp intra, {bpp_inter:.4f} bpp inter'.format(**result))
+    assert len(results) > 0, 'No frames at {}'.format(flags.input)
+    write_report(results, flags.report, flags.ckpt, flags.coding_mode, _VIDEO_FIELDS)
+    bpp_intra, bpp_inter = (np.mean([r[field] for r in results]) for field in ('bpp_intra', 'bpp_inter'))
+    print('{} frames, mean bpp {:.4f} intra, {:.4f} inter: {:.1%} smaller -> {}'.format(
+        len(results), bpp_intra, bpp_inter, 1. - bpp_inter / bpp_intra, flags.report))
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ckpt', type=str)
+    parser.add_argument('input', type=str, help='Directory of images or glob of TFRecords.')
+    parser.add_argument('report', type=str, help='Output .csv or .json file.')
+    parser.add_argument('--coding_mode', type=str, choices=codec.MODES, default='masked')
+    parser.add_argument('--crop', type=int, help='If given, center crop all images to CROP x CROP.')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, help='Number of processes for entropy coding, default: all CPUs.')
+    parser.add_argument('--video', type=int, metavar='NUM_FRAMES',
+                        help='Compare intra and inter frame coding on records of NUM_FRAMES consecutive frames.')
+    flags = parser.parse_args(args)
+    if flags.video:
+        evaluate_video(flags)
+        return
+
+    images = iterate_images(flags.input)
+    if flags.crop:
+        images = ((name, center_crop(img, flags.crop)) for name, img in images)
+    evaluator = Evaluator(flags.ckpt, flags.num_workers, flags.batch_size)
+    results = []
+    for result in evaluator.evaluate(images, flags.coding_mode):
+        results.append(result)
+        print('{name}: MS-SSIM {ms_ssim:.4f}, PSNR {psnr:.2f} dB, {bpp:.4f} bpp '
+              '(estimated {estimated_bpp:.4f})'.format(**result))
+    assert len(results) > 0, 'No images at {}'.format(flags.input)
+    write_report(results, flags.report, flags.ckpt, flags.coding_mode)
+    print('{} images, mean MS-SSIM {:.4f}, mean bpp {:.4f} -> {}'.format(
+        len(results), np.mean([r['ms_ssim'] for r in results]), np.mean([r['bpp'] for r in results]), flags.report))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
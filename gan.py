@@ -1,5 +1,7 @@
 import tensorflow as tf
-import numpy as np
+
+import input_pipeline
+from ms_ssim import ms_ssim
 
 # reset graph
 tf.reset_default_graph()
@@ -31,98 +33,21 @@ def decode(raw):
     return tf.image.decode_jpeg(raw, channels=3)
 
 
-def get_train_dataset(path, batch_size):
-    files = tf.data.Dataset.list_files(path)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(tf.data.TFRecordDataset, cycle_length=4))
+def get_train_dataset(path, batch_size, raw=False):
+    """ :param raw: if True, path is a glob of records made with `tf_records.py mk_raw_recs --image_keys image/encoded
+    image/label` instead """
+    if raw:
+        return input_pipeline.get_raw_dataset(path, batch_size, image_keys=('image/encoded', 'image/label'),
+                                              extra_keys=())
+    dataset = input_pipeline.read_records(path, cycle_length=4)
     dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
-    dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(20))
     dataset = dataset.map(_parse_function, num_parallel_calls=4)
     dataset = dataset.prefetch(batch_size)
 
     return dataset
 
 
-# MS-SSIM functions ------------------------------------------------------------------------------------------------------------------
-
-def _tf_fspecial_gauss(size, sigma):
-    """Function to mimic the 'fspecial' gaussian MATLAB function
-    """
-    x_data, y_data = np.mgrid[-size // 2 + 1:size // 2 + 1, -size // 2 + 1:size // 2 + 1]
-
-    x_data = np.expand_dims(x_data, axis=-1)
-    x_data = np.expand_dims(x_data, axis=-1)
-
-    y_data = np.expand_dims(y_data, axis=-1)
-    y_data = np.expand_dims(y_data, axis=-1)
-
-    x = tf.constant(x_data, dtype=tf.float32)
-    y = tf.constant(y_data, dtype=tf.float32)
-
-    g = tf.exp(-((x ** 2 + y ** 2) / (2.0 * sigma ** 2)))
-    return g / tf.reduce_sum(g)
-
-
-def tf_ssim(img1, img2, cs_map=False, mean_metric=True, size=9, sigma=1.5):
-    window = _tf_fspecial_gauss(size, sigma)  # window shape [size, size]
-    K1 = 0.01
-    K2 = 0.03
-    L = 1  # depth of image (255 in case the image has a different scale)
-    C1 = (K1 * L) ** 2
-    C2 = (K2 * L) ** 2
-    mu1 = tf.nn.conv2d(img1, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu2 = tf.nn.conv2d(img2, window, strides=[1, 1, 1, 1], padding='VALID')
-    mu1_sq = mu1 * mu1
-    mu2_sq = mu2 * mu2
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = tf.nn.conv2d(img1 * img1, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_sq
-    sigma2_sq = tf.nn.conv2d(img2 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu2_sq
-    sigma12 = tf.nn.conv2d(img1 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_mu2
-    if cs_map:
-        value = (((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)),
-                 (2.0 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2))
-    else:
-        value = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
-
-
-def tf_ms_ssim(img1, img2, mean_metric=True, level=5):
-    weight = tf.constant([0.0448, 0.2856, 0.3001, 0.2363, 0.1333], dtype=tf.float32)
-    mssim = []
-    mcs = []
-    for l in range(level):
-        ssim_map, cs_map = tf_ssim(img1, img2, cs_map=True, mean_metric=False)
-        mssim.append(tf.reduce_mean(ssim_map))
-        mcs.append(tf.reduce_mean(cs_map))
-        filtered_im1 = tf.nn.avg_pool(img1, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        filtered_im2 = tf.nn.avg_pool(img2, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
-        img1 = filtered_im1
-        img2 = filtered_im2
-
-    # list to tensor of dim D+1
-    mssim = tf.stack(mssim, axis=0)
-    mcs = tf.stack(mcs, axis=0)
-
-    value = (tf.reduce_prod(mcs[0:level - 1] ** weight[0:level - 1]) * (mssim[level - 1] ** weight[level - 1]))
-
-    if mean_metric:
-        value = tf.reduce_mean(value)
-
-    return value
-
-
-def getMSSSIM(x, x_hat):
-
-    msssim_indexR = tf_ms_ssim(x[:, :, :, 0:1], x_hat[:, :, :, 0:1])
-    msssim_indexG = tf_ms_ssim(x[:, :, :, 1:2], x_hat[:, :, :, 1:2])
-    msssim_indexB = tf_ms_ssim(x[:, :, :, 2:3], x_hat[:, :, :, 2:3])
-    acc = (msssim_indexR + msssim_indexG + msssim_indexB) / 3
-
-    return acc
-
+# Model functions ------------------------------------------------------------------------------------------------------------------
 
 def getMSE(x, x_hat):
 
@@ -291,7 +216,7 @@ epochsD = 1
 epochsGAN = 10
 batch_size = 30
 
-dataset = get_train_dataset("/mnt/disks/disk2/ae_out/records/train/train-*", batch_size)
+dataset = get_train_dataset("/mnt/disks/disk2/ae_out/records/train/*.tfrecord", batch_size)
 
 iterator = tf.data.Iterator.from_structure(dataset.output_types,
                                            dataset.output_shapes)
@@ -307,8 +232,8 @@ s_gz = tf.summary.image("Gz", Gz, 1)
 s_x_ae = tf.summary.image("x_ae", x_ae, 1)
 s_x = tf.summary.image("x", x, 1)
 
-g_acc = getMSSSIM(x, Gz)
-ae_acc = getMSSSIM(x, x_ae)
+_, g_acc = ms_ssim(x, Gz)
+_, ae_acc = ms_ssim(x, x_ae)
 mse = getMSE(x, Gz)
 tf.summary.scalar('ms-ssim_G', g_acc)
 tf.summary.scalar('delta_ms-ssim', (g_acc - ae_acc))
@@ -318,7 +243,7 @@ Dx = discriminator(x, Dregularizer, DregularizerDense, batch_size)
 Dg = discriminator(Gz, Dregularizer, DregularizerDense, batch_size, reuse_variables=True)
 
 # losses
-ae_loss = tf.losses.mean_squared_error(x, Gz)  # getMSSSIM(x, Gz)
+ae_loss = tf.losses.mean_squared_error(x, Gz)  # ms_ssim(x, Gz)
 s_ae_loss = tf.summary.scalar('loss_autoencoder', ae_loss)
 
 d_loss_real = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(logits=Dx, labels=tf.ones_like(Dx)))
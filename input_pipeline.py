@@ -0,0 +1,297 @@
+"""
+tf.data input pipeline of AutoEncoder.py: random crops of the JPEGs in TFRecords written by util/tf_records.py.
+
+Record files are read in a new random order every epoch, several at once, and their examples are shuffled in a
+buffer of a fixed number of bytes (SHUFFLE_BUFFER_BYTES). They are then decoded and cropped in parallel, one
+example per call, fused with the batching. Prefetching is autotuned. Only the crop window of each JPEG is decoded, or,
+with crops_per_image > 1, each JPEG is decoded once for several crops. get_raw_dataset reads records of pre-decoded
+images instead, written by `tf_records.py mk_raw_recs`, which need no decoding at all. get_frames_dataset reads records
+of consecutive frames, for the temporal context model. Records written with GZIP or ZLIB compression
+(`tf_records.py --record_compression`) are detected and read the same way.
+
+Measure the throughput, optionally against the previous pipeline, with
+
+    python input_pipeline.py "/mnt/disks/disk2/records/train/train-*" [--batch_size 30] [--num_batches 200]
+                             [--crops_per_image 4] [--legacy] [--raw_pattern "/path/to/raw/shard_*"]
+"""
+import argparse
+import glob
+import itertools
+import os
+import sys
+import time
+import tensorflow as tf
+
+from util import record_reader
+
+
+CROP_SIZE = 160
+AUTOTUNE = tf.contrib.data.AUTOTUNE
+SHUFFLE_BUFFER_BYTES = 256 * 2 ** 20
+RAW_SUFFIX = '/raw'  # pre-decoded image of the feature KEY is stored in KEY/raw, see util/tf_records.py
+
+
+def parse_example(example_proto):
+    """ :param example_proto: a single serialized example :return: (encoded image, filename) """
+    keys_to_features = {'image/encoded': tf.VarLenFeature(tf.string),
+                        'image/filename': tf.FixedLenFeature([], tf.string)}
+    parsed_features = tf.parse_single_example(example_proto, keys_to_features)
+    return parsed_features['image/encoded'].values[0], parsed_features['image/filename']
+
+
+def decode_random_crop(encoded, crop_size=CROP_SIZE):
+    img = tf.image.decode_jpeg(encoded, channels=3)
+
+    return tf.random_crop(img, [crop_size, crop_size, 3])
+
+
+def decode_random_crop_window(encoded, crop_size=CROP_SIZE):
+    """ Same as decode_random_crop, but only the crop window is decoded. The image shape is read from the header. """
+    shape = tf.image.extract_jpeg_shape(encoded)
+    top = tf.random_uniform([], 0, shape[0] - crop_size + 1, dtype=tf.int32)
+    left = tf.random_uniform([], 0, shape[1] - crop_size + 1, dtype=tf.int32)
+    img = tf.image.decode_and_crop_jpeg(encoded, tf.stack([top, left, crop_size, crop_size]), channels=3)
+
+    return tf.reshape(img, [crop_size, crop_size, 3])
+
+
+def decode_random_crops(encoded, num_crops, crop_size=CROP_SIZE):
+    """ Decode once and take num_crops random crops. :return: [num_crops, crop_size, crop_size, 3] """
+    img = tf.image.decode_jpeg(encoded, channels=3)
+
+    return tf.stack([tf.random_crop(img, [crop_size, crop_size, 3]) for _ in range(num_crops)])
+
+
+def parse_raw_example(example_proto, shape, image_keys=('image/encoded',), extra_keys=('image/filename',),
+                      compression=None):
+    """
+    Parse an example of the pre-decoded records written by `tf_records.py mk_raw_recs`.
+    :param shape: shape of the stored images, e.g., (160, 160, 3)
+    :param image_keys: keys of the images in the JPEG records the raw records were made from
+    :param extra_keys: keys of string features copied from the JPEG records, e.g., 'image/filename'
+    :param compression: None or 'zlib', as given to mk_raw_recs
+    :return: tuple of uint8 images of the given shape, one per image key, followed by the extra features
+    """
+    keys_to_features = {key: tf.FixedLenFeature([], tf.string) for key in extra_keys}
+    keys_to_features.update({key + RAW_SUFFIX: tf.FixedLenFeature([], tf.string) for key in image_keys})
+    parsed_features = tf.parse_single_example(example_proto, keys_to_features)
+    images = []
+    for key in image_keys:
+        raw = parsed_features[key + RAW_SUFFIX]
+        if compression == 'zlib':
+            raw = tf.decode_compressed(raw, compression_type='ZLIB')
+        images.append(tf.reshape(tf.decode_raw(raw, tf.uint8), shape))
+    return tuple(images) + tuple(parsed_features[key] for key in extra_keys)
+
+
+def record_compression(file_pattern):
+    """
+    :return: compression type of the records matching file_pattern, '', 'GZIP' or 'ZLIB', from the first file. '' if
+    there are none, so that building a dataset of records that are not there only fails when it is run, in list_files.
+    """
+    paths = sorted(glob.glob(file_pattern))
+    return record_reader.detect_compression(paths[0]) if paths else ''
+
+
+def _record_files(file_pattern):
+    """
+    :return: the files matching file_pattern, or file_pattern if there are none, for list_files. Unlike the glob of
+    tf, that of Python does not match hidden files, such as the indices .SHARD.tfrecord.index next to the records.
+    """
+    return sorted(glob.glob(file_pattern)) or file_pattern
+
+
+def record_options(compression_type):
+    """ :return: tf.python_io.TFRecordOptions for compression_type, as returned by record_compression """
+    return tf.python_io.TFRecordOptions(
+            getattr(tf.python_io.TFRecordCompressionType, compression_type or 'NONE'))
+
+
+def shuffle_buffer_size(file_pattern, buffer_bytes, cycle_length, num_samples=100):
+    """
+    Number of examples that fit into buffer_bytes, from the mean size of the first num_samples examples. Also prints
+    how much shuffling this gives, relative to the number of examples estimated from the size of the files on disk.
+    Compressed files are smaller than their records, so for them, this estimate is a lower bound.
+    """
+    paths = sorted(glob.glob(file_pattern))
+    assert paths, 'Did not find any records matching {}'.format(file_pattern)
+    compression_type = record_compression(file_pattern)
+    records = tf.python_io.tf_record_iterator(paths[0], record_options(compression_type))
+    sizes = [len(record) for record in itertools.islice(records, num_samples)]
+    example_bytes = max(1., sum(sizes) / max(1, len(sizes)))
+    buffer_size = max(1, int(buffer_bytes // example_bytes))
+    # each record has 16 bytes of length and CRCs
+    num_examples = max(1, int(sum(os.path.getsize(p) for p in paths) // (example_bytes + 16)))
+    share = ('at most {:.2%} of at least {} examples ({} compressed on disk)' if compression_type else
+             '{:.2%} of ~{} examples').format(min(1., buffer_size / num_examples), num_examples, compression_type)
+    print('Shuffle: {} record files in a new order every epoch, {} read at once. Buffer of {} examples '
+          '({:.0f} MB at {:.1f} KB per example), {}: an example moves by ~{} positions, '
+          '~{} examples of each file being read.'.format(
+              len(paths), cycle_length, buffer_size, buffer_size * example_bytes / 2 ** 20, example_bytes / 2 ** 10,
+              share, buffer_size, buffer_size // cycle_length))
+    return buffer_size
+
+
+def read_records(file_pattern, shuffle_buffer_bytes=SHUFFLE_BUFFER_BYTES, cycle_length=4, training=True):
+    """
+    Serialized examples of the records matching file_pattern. cycle_length files are read at once, one example of each
+    in turn, and the examples go through a shuffle buffer whose size is given in bytes, instead of examples. All files
+    need the same compression, which is detected from the first one.
+    :param shuffle_buffer_bytes: memory budget of the shuffle buffer, 0 to keep the order of the records
+    :param training: if True, the files are read forever, in a new random order every epoch, without deterministic
+    interleaving
+    """
+    compression_type = record_compression(file_pattern)
+    files = tf.data.Dataset.list_files(_record_files(file_pattern), shuffle=training)
+    if training:
+        files = files.repeat()
+    dataset = files.apply(tf.contrib.data.parallel_interleave(
+            lambda f: tf.data.TFRecordDataset(f, compression_type), cycle_length=cycle_length, sloppy=training))
+    if shuffle_buffer_bytes:
+        dataset = dataset.shuffle(shuffle_buffer_size(file_pattern, shuffle_buffer_bytes, cycle_length))
+    return dataset
+
+
+def get_dataset(file_pattern, batch_size, shuffle_buffer_bytes=SHUFFLE_BUFFER_BYTES, cycle_length=4,
+                num_parallel_calls=AUTOTUNE, crop_size=CROP_SIZE, crops_per_image=1, training=True):
+    """
+    :param shuffle_buffer_bytes: memory budget of the shuffle buffer of the records, 0 to keep their order
+    :param cycle_length: number of record files read at once
+    :param num_parallel_calls: number of examples decoded at once
+    :param crops_per_image: if 1, only a random crop window of each image is decoded. Otherwise, each image is decoded
+    once and gives crops_per_image random crops, which are shuffled over batch_size * crops_per_image crops.
+    :param training: see read_records
+    :return: dataset of (uint8 images [batch_size, crop_size, crop_size, 3], filenames [batch_size])
+    """
+    dataset = read_records(file_pattern, shuffle_buffer_bytes, cycle_length, training)
+    if crops_per_image == 1:
+        def _decode(example_proto):
+            encoded, filename = parse_example(example_proto)
+            return decode_random_crop_window(encoded, crop_size), filename
+
+        dataset = dataset.apply(tf.contrib.data.map_and_batch(_decode, batch_size, drop_remainder=True,
+                                                              num_parallel_calls=num_parallel_calls))
+    else:
+        def _decode_crops(example_proto):
+            encoded, filename = parse_example(example_proto)
+            return decode_random_crops(encoded, crops_per_image, crop_size), tf.fill([crops_per_image], filename)
+
+        dataset = dataset.map(_decode_crops, num_parallel_calls=num_parallel_calls)
+        dataset = dataset.apply(tf.contrib.data.unbatch())
+        if shuffle_buffer_bytes:
+            dataset = dataset.shuffle(batch_size * crops_per_image)
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def get_raw_dataset(file_pattern, batch_size, shape=(CROP_SIZE, CROP_SIZE, 3), image_keys=('image/encoded',),
+                    extra_keys=('image/filename',), compression=None, shuffle_buffer_bytes=SHUFFLE_BUFFER_BYTES,
+                    cycle_length=4, num_parallel_calls=AUTOTUNE, training=True):
+    """
+    Like get_dataset, for records written by `tf_records.py mk_raw_recs`, without any image decoding.
+    :return: dataset of tuples of uint8 images [batch_size] + shape, one per image key, followed by the extra features
+    """
+    dataset = read_records(file_pattern, shuffle_buffer_bytes, cycle_length, training)
+    dataset = dataset.apply(tf.contrib.data.map_and_batch(
+        lambda example_proto: parse_raw_example(example_proto, shape, image_keys, extra_keys, compression),
+        batch_size, drop_remainder=True, num_parallel_calls=num_parallel_calls))
+    return dataset.prefetch(AUTOTUNE)
+
+
+def get_frames_dataset(file_pattern, batch_size, num_frames=2, feature_key='M',
+                       shuffle_buffer_bytes=SHUFFLE_BUFFER_BYTES, cycle_length=4, num_parallel_calls=AUTOTUNE,
+                       crop_size=CROP_SIZE, training=True):
+    """
+    Consecutive frames, from records written by `tf_records.py mk_img_recs --num_per_ex NUM_FRAMES`, for the temporal
+    context model of AutoEncoder.py. All frames of an example are cropped at the same random position.
+    :param batch_size: number of examples per batch
+    :return: dataset of (uint8 images [num_frames * batch_size, crop_size, crop_size, 3], filenames), frame 0 of all
+    examples first, then frame 1, ... The records have no filenames, they are all empty.
+    """
+    keys = [feature_key + '_' + str(i) for i in range(num_frames)]  # as tf_records.keys_for_num_frames_per_example
+
+    def _decode_frames(example_proto):
+        parsed_features = tf.parse_single_example(example_proto, {key: tf.FixedLenFeature([], tf.string)
+                                                                  for key in keys})
+        frames = []
+        for key in keys:
+            frame = tf.image.decode_image(parsed_features[key], channels=3)
+            frame.set_shape((None, None, 3))
+            frames.append(frame)
+        return tf.random_crop(tf.stack(frames), [num_frames, crop_size, crop_size, 3])
+
+    dataset = read_records(file_pattern, shuffle_buffer_bytes, cycle_length, training)
+    dataset = dataset.apply(tf.contrib.data.map_and_batch(_decode_frames, batch_size, drop_remainder=True,
+                                                          num_parallel_calls=num_parallel_calls))
+    dataset = dataset.map(lambda frames: (tf.reshape(tf.transpose(frames, [1, 0, 2, 3, 4]),
+                                                     [num_frames * batch_size, crop_size, crop_size, 3]),
+                                          tf.fill([num_frames * batch_size], '')))
+    return dataset.prefetch(AUTOTUNE)
+
+
+def _legacy_dataset(file_pattern, batch_size):
+    """ Previous get_train_dataset() of AutoEncoder.py """
+    def _parse_function(example_proto):
+        keys_to_features = {'image/encoded': tf.VarLenFeature(tf.string),
+                            'image/filename': tf.FixedLenFeature([], tf.string)}
+        parsed_features = tf.parse_example(example_proto, keys_to_features)
+        raw = tf.sparse_tensor_to_dense(parsed_features['image/encoded'], default_value="0", )
+        return (tf.map_fn(decode_random_crop, tf.squeeze(raw), dtype=tf.uint8, back_prop=False),
+                parsed_features['image/filename'])
+
+    files = tf.data.Dataset.list_files(_record_files(file_pattern))
+    compression_type = record_compression(file_pattern)
+    dataset = files.interleave(lambda f: tf.data.TFRecordDataset(f, compression_type), cycle_length=1)
+    dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
+    dataset = dataset.shuffle(3500).repeat()
+    dataset = dataset.map(_parse_function)
+    return dataset.prefetch(batch_size)
+
+
+def benchmark(dataset, num_batches, batch_size, warmup_batches=10):
+    """ :return: images per second, over num_batches batches after warmup_batches """
+    next_batch = dataset.make_one_shot_iterator().get_next()
+    with tf.Session() as sess:
+        for _ in range(warmup_batches):
+            sess.run(next_batch)
+        start = time.time()
+        for _ in range(num_batches):
+            sess.run(next_batch)
+        return num_batches * batch_size / (time.time() - start)
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file_pattern', type=str, help='Glob of TFRecords.')
+    parser.add_argument('--batch_size', type=int, default=30)
+    parser.add_argument('--num_batches', type=int, default=200)
+    parser.add_argument('--shuffle_buffer_mb', type=float, default=SHUFFLE_BUFFER_BYTES / 2 ** 20)
+    parser.add_argument('--cycle_length', type=int, default=4)
+    parser.add_argument('--num_parallel_calls', type=int, default=AUTOTUNE)
+    parser.add_argument('--crops_per_image', type=int, default=1)
+    parser.add_argument('--legacy', action='store_true', help='Also measure the previous pipeline.')
+    parser.add_argument('--raw_pattern', type=str,
+                        help='Also measure records made from FILE_PATTERN with `tf_records.py mk_raw_recs`.')
+    parser.add_argument('--raw_compression', type=str, choices=('zlib',))
+    flags = parser.parse_args(args)
+
+    shuffle_buffer_bytes = int(flags.shuffle_buffer_mb * 2 ** 20)
+    pipelines = [('parallel', lambda: get_dataset(flags.file_pattern, flags.batch_size, shuffle_buffer_bytes,
+                                                  flags.cycle_length, flags.num_parallel_calls,
+                                                  crops_per_image=flags.crops_per_image))]
+    if flags.legacy:
+        pipelines.append(('legacy', lambda: _legacy_dataset(flags.file_pattern, flags.batch_size)))
+    if flags.raw_pattern:
+        pipelines.append(('raw', lambda: get_raw_dataset(flags.raw_pattern, flags.batch_size,
+                                                         compression=flags.raw_compression,
+                                                         shuffle_buffer_bytes=shuffle_buffer_bytes,
+                                                         cycle_length=flags.cycle_length,
+                                                         num_parallel_calls=flags.num_parallel_calls)))
+    for name, build in pipelines:
+        with tf.Graph().as_default():
+            images_per_sec = benchmark(build(), flags.num_batches, flags.batch_size)
+        print('{}: {:.1f} images/sec'.format(name, images_per_sec))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,47 @@
+"""
+Causal 3D convolution of the context model that only evaluates the taps that are not masked out.
+
+The causal masks of the context model (MASK_A and MASK_B in context_model.py) keep 13 (without center) or 14 (with
+center) of the 27 taps of a 3x3x3 kernel over (row, column, channel). Instead of a dense tf.nn.conv3d with W * mask,
+the kernel is split into its nonzero parts, each evaluated as a 2D convolution over (column, channel) of every row:
+- previous row: all 9 taps, a 3x3 convolution, shifted down by one row
+- same row, previous column: 3 taps over the channels, a 1x3 convolution, shifted right by one column
+- same row and column: the previous channel (and the center), 1x1 convolutions
+
+The kernel variable keeps its [3, 3, 3, C_in, C_out] shape, so checkpoints stay compatible, but only the unmasked taps
+are ever read, so no mask multiplication is needed.
+"""
+import tensorflow as tf
+
+
+def _shift(t, axis):
+    """ Shift t by one along axis, i.e., out[i] = t[i - 1], with zeros at i = 0 """
+    paddings = [[0, 0]] * len(t.get_shape())
+    paddings[axis] = [1, 0]
+    return tf.slice(tf.pad(t, paddings), [0] * len(paddings), tf.shape(t))
+
+
+def _conv2d(x, W):
+    return tf.nn.conv2d(x, W, strides=[1, 1, 1, 1], padding='SAME')
+
+
+def masked_conv3d(z, W, include_center):
+    """
+    Same as tf.nn.conv3d(z, W * mask, strides=[1, 1, 1, 1, 1], padding='SAME').
+    :param z: [N, D, H, W, C_in]
+    :param W: [3, 3, 3, C_in, C_out], unmasked
+    :param include_center: False for MASK_A (first layer), True for MASK_B
+    """
+    shape = tf.shape(z)
+    c_in = z.get_shape().as_list()[-1]
+    rows = tf.reshape(z, [shape[0] * shape[1], shape[2], shape[3], c_in])
+
+    previous_row = _conv2d(rows, W[0])
+    previous_column = _shift(_conv2d(rows, W[1, 0:1]), axis=1)
+    same_column = _shift(_conv2d(rows, W[1, 1:2, 0:1]), axis=2)
+    if include_center:
+        same_column += _conv2d(rows, W[1, 1:2, 1:2])
+
+    out_shape = tf.concat([shape[:4], [W.get_shape().as_list()[-1]]], axis=0)
+    return (_shift(tf.reshape(previous_row, out_shape), axis=1) +
+            tf.reshape(previous_column + same_column, out_shape))
@@ -0,0 +1,141 @@
+"""
+Encoder and decoder of AutoEncoder.py as functions, for inference outside of the training script.
+
+Variables are created with the same names and in the same order as in AutoEncoder.py, so that its checkpoints can be
+restored into a graph built with these functions.
+"""
+import tensorflow as tf
+
+
+K = 32
+n_centroids = 6
+depth = 5  # Depth residual block for the AutoEncoder
+SUBSAMPLING = 8  # the encoder has three stride 2 convolutions
+
+
+def _residual_conv(inputs, name, regularizer):
+    return tf.layers.conv2d(inputs=inputs,
+                            filters=128,
+                            kernel_size=[3, 3],
+                            strides=(1, 1),
+                            padding="same",
+                            kernel_regularizer=regularizer,
+                            name=name)
+
+
+def get_centroids(L=n_centroids):
+    return tf.get_variable(name="centroid", shape=(L,), dtype=tf.float32,
+                           initializer=tf.random_uniform_initializer(minval=-2, maxval=2, seed=666))
+
+
+def normalize(x):
+    """ Per image version of the normalization in AutoEncoder.py, which uses statistics of the whole batch """
+    [mean, var] = tf.nn.moments(x, axes=[1, 2], keep_dims=True)
+    return (x - mean) / tf.sqrt(var + 1e-10), mean, var
+
+
+def denormalize(x_hat, mean, var):
+    return tf.clip_by_value(x_hat * tf.sqrt(var + 1e-10) + mean, 0, 1.0)
+
+
+def encoder(x_n, training, regularizer=None, regularizer2=None):
+    """ :return: z, the latent of shape [N, H/8, W/8, K], and y, the importance map of shape [N, H/8, W/8, 1] """
+    conv1 = tf.layers.conv2d(inputs=x_n,
+                             filters=64,
+                             kernel_size=[5, 5],
+                             strides=(2, 2),
+                             padding="same",
+                             kernel_regularizer=regularizer,
+                             name="conv1")
+
+    conv1 = tf.layers.batch_normalization(inputs=conv1, training=training)
+    conv1 = tf.nn.relu(conv1)
+    conv2 = tf.layers.conv2d(inputs=conv1,
+                             filters=128,
+                             kernel_size=[5, 5],
+                             strides=(2, 2),
+                             padding="same",
+                             kernel_regularizer=regularizer,
+                             name="conv2")
+
+    conv2 = tf.layers.batch_normalization(inputs=conv2, training=training)
+    conv2 = tf.nn.relu(conv2)
+
+    tmp = conv2
+    for i in range(depth):
+        tmp3 = tmp
+        for j in range(3):
+            tmp2 = tmp
+            tmp = _residual_conv(tmp, "conv" + str(6 * i + 2 * j + 3), regularizer)
+            tmp = tf.nn.relu(tf.layers.batch_normalization(inputs=tmp, training=training))
+            tmp = _residual_conv(tmp, "conv" + str(6 * i + 2 * j + 4), regularizer) + tmp2
+        tmp = tmp3 + tmp
+
+    tmp2 = tmp
+    tmp = _residual_conv(tmp, "conv" + str(depth * 6 + 3), regularizer)
+    tmp = tf.nn.relu(tf.layers.batch_normalization(inputs=tmp, training=training))
+    tmp = _residual_conv(tmp, "conv" + str(depth * 6 + 4), regularizer) + tmp2 + conv2
+
+    e_out = tf.layers.conv2d(inputs=tmp,
+                             filters=K,
+                             kernel_size=[5, 5],
+                             strides=(2, 2),
+                             padding="same",
+                             kernel_regularizer=regularizer,
+                             name="conv" + str(depth * 6 + 5))
+
+    y_out = tf.layers.conv2d(inputs=tmp,
+                             filters=1,
+                             kernel_size=[5, 5],
+                             strides=(2, 2),
+                             padding="same",
+                             kernel_regularizer=regularizer2,
+                             name="conv" + str(depth * 6 + 6))
+
+    return e_out, tf.sigmoid(tf.nn.relu(y_out)) * K
+
+
+def decoder(z_hat, training, regularizer=None):
+    """ :return: x_hat, the normalized reconstruction """
+    first = tf.layers.conv2d_transpose(inputs=z_hat,
+                                       filters=128,
+                                       kernel_size=[3, 3],
+                                       strides=(2, 2),
+                                       padding="same",
+                                       kernel_regularizer=regularizer,
+                                       name="conv" + str(depth * 6 + 7))
+
+    first = tf.nn.relu(tf.layers.batch_normalization(inputs=first, training=training))
+    tmp = first
+
+    for i in range(depth):
+        tmp3 = tmp
+        for j in range(3):
+            tmp2 = tmp
+            tmp = _residual_conv(tmp, "conv" + str(6 * i + 2 * j + depth * 6 + 8), regularizer)
+            tmp = tf.nn.relu(tf.layers.batch_normalization(inputs=tmp, training=training))
+            tmp = _residual_conv(tmp, "conv" + str(6 * i + 2 * j + depth * 6 + 9), regularizer) + tmp2
+        tmp = tmp3 + tmp
+
+    tmp2 = tmp
+    tmp = _residual_conv(tmp, "conv" + str(depth * 14 + 4), regularizer)
+    tmp = tf.nn.relu(tf.layers.batch_normalization(inputs=tmp, training=training))
+    tmp = _residual_conv(tmp, "conv" + str(depth * 14 + 5), regularizer) + tmp2 + first
+
+    deconv1 = tf.layers.conv2d_transpose(inputs=tmp,
+                                         filters=64,
+                                         kernel_size=[5, 5],
+                                         strides=(2, 2),
+                                         padding="same",
+                                         kernel_regularizer=regularizer,
+                                         name="deconv1")
+
+    deconv1 = tf.layers.batch_normalization(inputs=deconv1, training=training)
+    deconv1 = tf.nn.relu(deconv1)
+    return tf.layers.conv2d_transpose(inputs=deconv1,
+                                      filters=3,
+                                      kernel_size=[5, 5],
+                                      strides=(2, 2),
+                                      padding="same",
+                                      kernel_regularizer=regularizer,
+                                      name="deconv2")
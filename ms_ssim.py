@@ -0,0 +1,70 @@
+"""
+MS-SSIM of AutoEncoder.py, gan.py and AEGAN.py.
+
+All the channels of both images, and their products, are blurred together: they are stacked into a single tensor
+and filtered by one depthwise convolution per direction with the separable 1D Gaussian window, instead of 5 conv2d
+calls with a 2D window per channel and per level. The window is computed once, with numpy.
+"""
+import numpy as np
+import tensorflow as tf
+
+
+MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+
+
+def gaussian_window(size=9, sigma=1.5):
+    """ 1D window whose outer product is the 'fspecial' gaussian MATLAB window """
+    x = np.arange(-size // 2 + 1, size // 2 + 1, dtype=np.float64)
+    g = np.exp(-x ** 2 / (2.0 * sigma ** 2))
+    return (g / np.sum(g)).astype(np.float32)
+
+
+def _blur(x, window):
+    """ :param x: [N, H, W, C] :param window: 1D window of size S :return: VALID gaussian blur [N, H-S+1, W-S+1, C] """
+    channels = x.get_shape().as_list()[-1]
+    size = window.shape[0]
+    rows = tf.constant(np.tile(window.reshape([size, 1, 1, 1]), [1, 1, channels, 1]))
+    cols = tf.constant(np.tile(window.reshape([1, size, 1, 1]), [1, 1, channels, 1]))
+    x = tf.nn.depthwise_conv2d(x, rows, strides=[1, 1, 1, 1], padding='VALID')
+    return tf.nn.depthwise_conv2d(x, cols, strides=[1, 1, 1, 1], padding='VALID')
+
+
+def ssim(img1, img2, window):
+    """ :return: (ssim_map, cs_map), [N, H', W', C] """
+    K1 = 0.01
+    K2 = 0.03
+    L = 1  # depth of image (255 in case the image has a different scale)
+    C1 = (K1 * L) ** 2
+    C2 = (K2 * L) ** 2
+    blurred = _blur(tf.concat([img1, img2, img1 * img1, img2 * img2, img1 * img2], axis=-1), window)
+    mu1, mu2, img1_sq, img2_sq, img12 = tf.split(blurred, 5, axis=-1)
+    mu1_sq = mu1 * mu1
+    mu2_sq = mu2 * mu2
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img12 - mu1_mu2
+    cs_map = (2.0 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2)
+    return ((2 * mu1_mu2 + C1) / (mu1_sq + mu2_sq + C1)) * cs_map, cs_map
+
+
+def ms_ssim(img1, img2, level=5, size=9, sigma=1.5):
+    """
+    :param img1, img2: [N, H, W, C] images in [0, 1]
+    :return: (per image MS-SSIM averaged over the channels [N], MS-SSIM of the whole batch averaged over the channels).
+    The batch value is computed from the statistics pooled over the batch, as the training losses always did: it is
+    less noisy, and does not become NaN because of a single image, whose contrast terms can be negative.
+    """
+    window = gaussian_window(size, sigma)
+    weight = MS_SSIM_WEIGHTS[:level]
+    per_image = batch = 1.
+    for l in range(level):
+        ssim_map, cs_map = ssim(img1, img2, window)
+        value_map = cs_map if l < level - 1 else ssim_map
+        per_image *= tf.reduce_mean(value_map, axis=[1, 2]) ** weight[l]
+        batch *= tf.reduce_mean(value_map, axis=[0, 1, 2]) ** weight[l]
+        if l < level - 1:
+            img1 = tf.nn.avg_pool(img1, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
+            img2 = tf.nn.avg_pool(img2, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
+
+    return tf.reduce_mean(per_image, axis=-1), tf.reduce_mean(batch)
@@ -0,0 +1,62 @@
+"""
+Mask and quantization functions of AutoEncoder.py and AEGAN.py, written with broadcasting.
+
+The distances between the latent and the centroids are computed once, as a single [N, H, W, K, L] tensor, and shared
+between the soft (soft_Q) and the hard (Q) quantization. No tiled copies of the latent or the centroids are made.
+
+The entropy terms H and H_context_model are computed together by entropies(), from a single lookup of the symbol
+probabilities. Nothing depends on static shapes, so the batch size can be dynamic.
+"""
+import numpy as np
+import tensorflow as tf
+
+
+def Mask(y, K):
+    """ :param y: importance map [N, H, W, 1] with values in [0, K] :return: mask [N, H, W, K] """
+    m = tf.clip_by_value(y - tf.range(K, dtype=y.dtype), 0., 1.)
+
+    # gradient trick
+    return m + tf.stop_gradient(tf.ceil(m) - m)
+
+
+def centroid_distances(z_masked, centroids):
+    """ :return: |z_masked - c| for all centroids c, [N, H, W, K, L] """
+    return tf.abs(tf.expand_dims(z_masked, -1) - centroids)
+
+
+def soft_Q(z_masked, sigma, centroids, distances=None):
+    if distances is None:
+        distances = centroid_distances(z_masked, centroids)
+    return tf.reduce_sum(tf.nn.softmax(distances * (-sigma), axis=-1) * centroids, axis=-1)
+
+
+def Q(z_masked, centroids, distances=None):
+    """ :return: (z_hat, best_centroids) """
+    if distances is None:
+        distances = centroid_distances(z_masked, centroids)
+    best_centroids = tf.argmin(distances, axis=-1)
+    return tf.gather(centroids, best_centroids), best_centroids
+
+
+def quantize(z_masked, sigma, centroids):
+    """ soft_Q and Q, sharing the distances. :return: (z_tilde, z_hat, best_centroids) """
+    distances = centroid_distances(z_masked, centroids)
+    z_hat, best_centroids = Q(z_masked, centroids, distances=distances)
+    return soft_Q(z_masked, sigma, centroids, distances=distances), z_hat, best_centroids
+
+
+def symbol_probabilities(P, best_centroids):
+    """ :param P: [N, H, W, K, L] :param best_centroids: [N, H, W, K] :return: P of the chosen centroids [N, H, W, K] """
+    return tf.reduce_sum(P * tf.one_hot(best_centroids, tf.shape(P)[-1], dtype=P.dtype), axis=-1)
+
+
+def entropies(m, P, best_centroids, t_primo, beta):
+    """
+    H and H_context_model of AutoEncoder.py: the clipped number of bits per image, of the symbols kept by the mask m
+    and of all symbols, summed over the batch.
+    :return: (h, h_context_model)
+    """
+    bits = -np.log2(np.e) * tf.log(tf.maximum(1e-9, symbol_probabilities(P, best_centroids)))
+    h = tf.reduce_sum(tf.maximum(0.0, beta * (tf.reduce_sum(m * bits, axis=[3, 2, 1]) - t_primo)))
+    h_context_model = tf.reduce_sum(tf.maximum(0.0, beta * (tf.reduce_sum(bits, axis=[3, 2, 1]) - t_primo)))
+    return h, h_context_model
@@ -0,0 +1,125 @@
+"""
+Byte-oriented range coder (LZMA-style carry handling) for multi-symbol alphabets.
+
+Frequencies are integer tables with a total of at most 2**16, so that the coder only ever works on 32 bit ranges.
+"""
+import numpy as np
+
+_TOP = 1 << 24
+_MASK32 = 0xFFFFFFFF
+
+MAX_TOTAL = 1 << 16
+
+
+def freqs_to_cdf(freqs):
+    """ freqs: int array [..., L] -> cdf: int64 array [..., L + 1], starting at 0 """
+    freqs = np.asarray(freqs, dtype=np.int64)
+    cdf = np.zeros(freqs.shape[:-1] + (freqs.shape[-1] + 1,), dtype=np.int64)
+    np.cumsum(freqs, axis=-1, out=cdf[..., 1:])
+    assert np.all(cdf[..., -1] <= MAX_TOTAL), 'Total frequency exceeds {}'.format(MAX_TOTAL)
+    return cdf
+
+
+class RangeEncoder(object):
+
+    def __init__(self):
+        self.low = 0
+        self.range = _MASK32
+        self.cache = 0
+        self.cache_size = 1
+        self.out = bytearray()
+
+    def _shift_low(self):
+        if self.low < 0xFF000000 or self.low > _MASK32:
+            carry = self.low >> 32
+            temp = self.cache
+            while True:
+                self.out.append((temp + carry) & 0xFF)
+                temp = 0xFF
+                self.cache_size -= 1
+                if self.cache_size == 0:
+                    break
+            self.cache = (self.low >> 24) & 0xFF
+        self.cache_size += 1
+        self.low = (self.low & 0x00FFFFFF) << 8
+
+    def encode(self, start, freq, total):
+        r = self.range // total
+        self.low += start * r
+        self.range = r * freq
+        while self.range < _TOP:
+            self.range <<= 8
+            self._shift_low()
+
+    def encode_symbols(self, symbols, cdfs):
+        """ Encode symbols[i] with the table cdfs[i]. Tables are precomputed for the whole sequence. """
+        starts = np.take_along_axis(cdfs, symbols[:, np.newaxis], axis=1)[:, 0].tolist()
+        ends = np.take_along_axis(cdfs, symbols[:, np.newaxis] + 1, axis=1)[:, 0].tolist()
+        totals = cdfs[:, -1].tolist()
+        for start, end, total in zip(starts, ends, totals):
+            self.encode(start, end - start, total)
+
+    def finish(self):
+        for _ in range(5):
+            self._shift_low()
+        return bytes(self.out)
+
+
+class RangeDecoder(object):
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos + 1  # first byte is always the initial (zero) cache byte
+        self.range = _MASK32
+        self.code = 0
+        for _ in range(4):
+            self.code = (self.code << 8) | self._next_byte()
+
+    def _next_byte(self):
+        b = self.data[self.pos] if self.pos < len(self.data) else 0
+        self.pos += 1
+        return b
+
+    def decode(self, cdf):
+        """ :param cdf: sequence of L + 1 ints starting at 0 :return: decoded symbol """
+        total = cdf[-1]
+        r = self.range // total
+        v = min(self.code // r, total - 1)
+        s = 0
+        while cdf[s + 1] <= v:
+            s += 1
+        self.code -= cdf[s] * r
+        self.range = r * (cdf[s + 1] - cdf[s])
+        while self.range < _TOP:
+            self.code = ((self.code << 8) | self._next_byte()) & _MASK32
+            self.range <<= 8
+        return s
+
+
+class AdaptiveFrequencies(object):
+    """ Adaptive frequency table, for side information that has no context model. Identical on both sides. """
+
+    def __init__(self, num_symbols, increment=32):
+        self.freqs = [1] * num_symbols
+        self.increment = increment
+
+    def cdf(self):
+        cdf = [0]
+        for f in self.freqs:
+            cdf.append(cdf[-1] + f)
+        return cdf
+
+    def update(self, s):
+        self.freqs[s] += self.increment
+        if sum(self.freqs) > MAX_TOTAL:
+            self.freqs = [max(1, f // 2) for f in self.freqs]
+
+    def encode(self, encoder, s):
+        cdf = self.cdf()
+        encoder.encode(cdf[s], cdf[s + 1] - cdf[s], cdf[-1])
+        self.update(s)
+
+    def decode(self, decoder):
+        s = decoder.decode(self.cdf())
+        self.update(s)
+        return s
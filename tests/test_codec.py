@@ -0,0 +1,86 @@
+"""
+Round trips of the tiled bitstreams of codec.py. The networks are replaced by fixed NumPy functions and the context
+model has random weights, so only the container, the entropy coding of the tiles and their stitching are tested.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')  # imported by codec.py and model.py
+
+import codec
+import context_model
+
+
+_K = 4
+_L = 6
+
+
+class _FakeCodec(codec.Codec):
+    """ Encoder: 8x8 block means, mapped to centroids. Decoder: first three channels of z_hat, as 8x8 blocks. """
+
+    def __init__(self, tile_batch_size=4):
+        self.num_workers = 2
+        self.batch_size = tile_batch_size
+        self.centroids = np.linspace(-2., 2., _L)
+        rnd = np.random.RandomState(6)
+        variables = {}
+        c_in = 1
+        for name, c_out in zip(context_model.LAYER_NAMES, (4, 4, 4, _L)):
+            variables['W_' + name] = rnd.normal(0., .3, (3, 3, 3, c_in, c_out))
+            variables['b_' + name] = rnd.normal(0., .1, c_out)
+            c_in = c_out
+        self.context_model = context_model.MaskedContextModel(variables, self.centroids)
+
+    def _run_encoder(self, imgs):
+        x = np.stack(imgs).astype(np.float64)
+        n, h, w, _ = x.shape
+        blocks = x.reshape(n, h // 8, 8, w // 8, 8, 3).mean(axis=(2, 4))
+        z = np.stack([blocks[..., k % 3] / 255. * 4. - 2. + .5 * k for k in range(_K)], axis=-1)
+        y = blocks.mean(axis=-1, keepdims=True) / 255. * _K
+        return z, y, np.zeros((n, 1, 1, 3)), np.ones((n, 1, 1, 3))
+
+    def _run_decoder(self, z_hats, means, variances):
+        z_hat = np.stack(z_hats)[..., :3]
+        x_hat = np.round((z_hat + 2.) * 60.).astype(np.uint8)
+        return x_hat.repeat(8, axis=1).repeat(8, axis=2)
+
+
+def _image(h, w, seed=6):
+    return np.random.RandomState(seed).randint(0, 256, (h, w, 3)).astype(np.uint8)
+
+
+def _decode_tiles_one_by_one(c, img, tile_size, mode):
+    """ Expected result of decompress_tiled: every tile coded on its own, with compress and decompress """
+    img_padded = codec.pad_to_multiple(img, tile_size)
+    out = np.zeros_like(img)
+    for top, left, height, width in codec.tile_grid(img.shape[0], img.shape[1], tile_size):
+        tile = img_padded[top:top + tile_size, left:left + tile_size]
+        out[top:top + height, left:left + width] = c.decompress(c.compress(tile, mode))[:height, :width]
+    return out
+
+
+@pytest.mark.parametrize('mode', codec.MODES)
+def test_tiled_round_trip(mode):
+    c = _FakeCodec()
+    img = _image(40, 24)
+    data = c.compress_tiled(img, tile_size=16, mode=mode)
+    expected = _decode_tiles_one_by_one(c, img, 16, mode)
+    np.testing.assert_array_equal(c.decompress(data), expected)
+    region = (10, 5, 20, 12)  # overlaps 4 of the 6 tiles
+    top, left, height, width = region
+    np.testing.assert_array_equal(c.decompress_tiled(data, region),
+                                  expected[top:top + height, left:left + width])
+
+
+def test_pack_streams_round_trip():
+    streams = [b'', b'a', b'bcd', b'', b'efghij']
+    header = b'HEAD'
+    assert codec._unpack_streams(codec._pack_streams(header, streams), len(header), len(streams)) == streams
+
+
+def test_unpack_streams_rejects_truncated_data():
+    data = codec._pack_streams(b'HEAD', [b'abc', b'de'])
+    with pytest.raises(AssertionError):
+        codec._unpack_streams(data[:-1], 4, 2)
@@ -0,0 +1,113 @@
+"""
+Round trips of single latents through compress_latent and decompress_latent of codec.py, for the masked, grouped and
+temporal context models of context_model.py, with random weights. Does not need TF.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+import codec
+import context_model
+
+
+_L = 6
+_CENTROIDS = np.linspace(-2., 2., _L)
+
+
+def _variables(rnd, prefix='', c_in=1, channels=4, std=.3):
+    """ :return: dict of random context model variables, named as in a checkpoint """
+    variables = {}
+    for name, c_out in zip(context_model.LAYER_NAMES, (channels, channels, channels, _L)):
+        variables['W' + prefix + '_' + name] = rnd.normal(0., std, (3, 3, 3, c_in, c_out))
+        variables['b' + prefix + '_' + name] = rnd.normal(0., .1, c_out)
+        c_in = c_out
+    return variables
+
+
+def _masked_model(rnd, std=.3):
+    return context_model.MaskedContextModel(_variables(rnd, std=std), _CENTROIDS)
+
+
+def _grouped_model(rnd, std=.3):
+    variables = _variables(rnd, prefix=context_model.GROUPED_PREFIX, c_in=2, std=std)
+    return context_model.GroupedContextModel(variables, _CENTROIDS, num_slices=2)
+
+
+def _temporal_model(rnd, channels=4):
+    variables = _variables(rnd, channels=channels)
+    variables[context_model.TEMPORAL_VARIABLE] = rnd.normal(0., .3, (3, 3, 3, 2, channels))
+    return context_model.TemporalContextModel(variables, _CENTROIDS)
+
+
+def _latent(rnd, shape=(5, 7, 4)):
+    """ :return: z [H, W, K], y [H, W, 1], such that all importance levels 0..K occur """
+    z = rnd.normal(0., 1.5, shape)
+    y = rnd.uniform(0., shape[2] + 1., shape[:2] + (1,))
+    return z, y
+
+
+def _round_trip(cm, z, y, mode):
+    img_shape = (8 * z.shape[0] - 3, 8 * z.shape[1] - 5)
+    mean, var = np.array([1., 2., 3.]), np.array([4., 5., 6.])
+    data = codec.compress_latent(img_shape, z, y, mean, var, _CENTROIDS, cm, mode)
+    z_hat, mean_out, var_out, img_shape_out = codec.decompress_latent(data, _CENTROIDS, cm)
+    assert img_shape_out == img_shape
+    np.testing.assert_allclose(mean_out, mean)
+    np.testing.assert_allclose(var_out, var)
+    return z_hat
+
+
+@pytest.mark.parametrize('mode', codec.MODES)
+@pytest.mark.parametrize('make_model', (_masked_model, _grouped_model, _temporal_model))
+def test_round_trip(make_model, mode):
+    rnd = np.random.RandomState(6)
+    cm = make_model(rnd)
+    z, y = _latent(rnd)
+    z_hat = _round_trip(cm, z, y, mode)
+    np.testing.assert_array_equal(z_hat, _CENTROIDS[codec.quantize(z, y, _CENTROIDS)])
+
+
+@pytest.mark.parametrize('mode', codec.MODES)
+def test_temporal_round_trip_given_previous_frame(mode):
+    rnd = np.random.RandomState(6)
+    cm = _temporal_model(rnd)
+    z_prev, y_prev = _latent(rnd)
+    prev_symbols = codec.quantize(z_prev, y_prev, _CENTROIDS)
+    z, y = _latent(rnd)
+    cm_given = cm.given(prev_symbols)
+    z_hat = _round_trip(cm_given, z, y, mode)
+    np.testing.assert_array_equal(z_hat, _CENTROIDS[codec.quantize(z, y, _CENTROIDS)])
+    assert not np.array_equal(cm_given.logits(prev_symbols), cm.logits(prev_symbols))
+
+
+@pytest.mark.parametrize('given_previous_frame', (False, True))
+def test_incremental_logits_equal_full_logits(given_previous_frame):
+    """ IncrementalContextModel, as used for decoding, has to agree exactly with the logits used for encoding """
+    rnd = np.random.RandomState(6)
+    cm = _temporal_model(rnd)
+    z, y = _latent(rnd)
+    symbols = codec.quantize(z, y, _CENTROIDS)
+    if given_previous_frame:
+        cm = cm.given(np.roll(symbols, 1, axis=0))
+    expected = cm.logits(symbols)
+    incremental = context_model.IncrementalContextModel(symbols.shape, cm.qweights)
+    for h, w, k in np.ndindex(*symbols.shape):
+        incremental.advance(h, w, k)
+        np.testing.assert_array_equal(incremental.logits(h, w, k), expected[h, w, k])
+        incremental.set(h, w, k, cm.qcentroids[symbols[h, w, k]])
+
+
+@pytest.mark.parametrize('make_model', (_masked_model, _grouped_model))
+def test_coded_size_matches_estimated_bits(make_model):
+    """
+    Both models code close to the bits of their softmax. Small weights keep the logits within the range of the exp
+    table, beyond which logits_to_freqs gives unlikely symbols a frequency of 1 rather than their probability.
+    """
+    rnd = np.random.RandomState(6)
+    cm = make_model(rnd, std=.1)
+    z, y = _latent(rnd, shape=(12, 12, 4))
+    symbols = codec.quantize(z, y, _CENTROIDS)
+    estimated_bits = context_model.bits(cm.logits(symbols), symbols).sum()
+    coded_bits = 8 * len(codec.encode_symbols(symbols, cm))
+    assert abs(coded_bits - estimated_bits) <= .01 * estimated_bits + 32
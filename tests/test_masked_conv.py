@@ -0,0 +1,28 @@
+"""
+masked_conv.masked_conv3d has to compute the same values and gradients as a dense conv3d with the masked kernel.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from masked_conv import masked_conv3d
+from util import bench_masked_conv
+
+
+@pytest.mark.parametrize('c_in, c_out, include_center', bench_masked_conv.LAYERS)
+def test_same_as_dense(c_in, c_out, include_center):
+    rng = np.random.RandomState(6)
+    z_val = rng.normal(size=(2, 5, 6, 7, c_in)).astype(np.float32)
+    W_val = rng.normal(size=(3, 3, 3, c_in, c_out)).astype(np.float32)
+    values = []
+    for conv in (bench_masked_conv._dense, masked_conv3d):
+        with tf.Graph().as_default():
+            z, W = tf.constant(z_val), tf.constant(W_val)
+            out = conv(z, W, include_center)
+            with tf.Session() as sess:
+                values.append(sess.run([out] + tf.gradients(tf.reduce_sum(out ** 2), [z, W])))
+    for name, dense_value, sparse_value in zip(('out', 'grad z', 'grad W'), *values):
+        np.testing.assert_allclose(sparse_value, dense_value, rtol=1e-4, atol=1e-3, err_msg=name)
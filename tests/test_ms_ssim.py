@@ -0,0 +1,32 @@
+"""
+ms_ssim.py has to compute the same MS-SSIM and gradient as the previous per channel implementation, which is kept in
+util/bench_ms_ssim.py.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from ms_ssim import ms_ssim
+from util import bench_ms_ssim
+
+
+def test_same_as_legacy():
+    rng = np.random.RandomState(6)
+    x_val = rng.uniform(size=(3, 160, 144, 3)).astype(np.float32)
+    x_hat_val = np.clip(x_val + rng.normal(scale=0.05, size=x_val.shape), 0, 1).astype(np.float32)
+    with tf.Graph().as_default():
+        x = tf.constant(x_val)
+        x_hat = tf.constant(x_hat_val)
+        per_image, batch = ms_ssim(x, x_hat)
+        legacy_per_image = tf.stack([bench_ms_ssim._legacy_getMSSSIM(x[i:i + 1], x_hat[i:i + 1]) for i in range(3)])
+        legacy = bench_ms_ssim._legacy_getMSSSIM(x, x_hat)
+        grads = tf.gradients(batch, x_hat)[0], tf.gradients(legacy, x_hat)[0]
+        with tf.Session() as sess:
+            values = sess.run([per_image, legacy_per_image, batch, legacy, grads])
+    per_image_val, legacy_per_image_val, batch_val, legacy_val, (grad_val, legacy_grad_val) = values
+    np.testing.assert_allclose(per_image_val, legacy_per_image_val, atol=1e-4)
+    np.testing.assert_allclose(batch_val, legacy_val, atol=1e-4)
+    np.testing.assert_allclose(grad_val, legacy_grad_val, rtol=1e-3, atol=1e-6)
@@ -0,0 +1,31 @@
+"""
+quantizer.py has to compute the same values and gradients as the previous tile/reshape/transpose implementation of
+Mask, soft_Q and Q, which is kept in util/bench_quantizer.py.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from util import bench_quantizer
+
+
+_EXACT = ('m', 'z_hat', 'best_centroids')
+
+
+@pytest.fixture(scope='module')
+def values():
+    legacy_values, _ = bench_quantizer.run(bench_quantizer._legacy_graph, batch_size=2, latent_size=6, K=8)
+    new_values, _ = bench_quantizer.run(bench_quantizer._new_graph, batch_size=2, latent_size=6, K=8)
+    return dict(zip(bench_quantizer.NAMES, zip(legacy_values, new_values)))
+
+
+@pytest.mark.parametrize('name', bench_quantizer.NAMES)
+def test_same_as_legacy(values, name):
+    legacy_value, new_value = values[name]
+    if name in _EXACT:
+        np.testing.assert_array_equal(new_value, legacy_value)
+    else:
+        np.testing.assert_allclose(new_value, legacy_value, rtol=1e-5, atol=1e-5)
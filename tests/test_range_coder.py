@@ -0,0 +1,106 @@
+"""
+Round trips through the range coder of range_coder.py, with static and adaptive frequencies.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+from range_coder import MAX_TOTAL, RangeEncoder, RangeDecoder, AdaptiveFrequencies, freqs_to_cdf
+
+
+def _round_trip(symbols, freqs):
+    """ Encode symbols[i] with freqs[i] and decode them again :return: (decoded symbols, number of bytes) """
+    cdfs = freqs_to_cdf(freqs)
+    encoder = RangeEncoder()
+    encoder.encode_symbols(np.asarray(symbols, dtype=np.int64), cdfs)
+    data = encoder.finish()
+    decoder = RangeDecoder(data)
+    return [decoder.decode(cdf) for cdf in cdfs.tolist()], len(data)
+
+
+def _sample(freqs, rnd):
+    """ :return: one symbol per row of freqs, drawn with these frequencies """
+    p = freqs / freqs.sum(axis=1, keepdims=True)
+    return (p.cumsum(axis=1) < rnd.uniform(size=(len(freqs), 1))).sum(axis=1)
+
+
+@pytest.mark.parametrize('num_symbols', (1, 2, 6, 33))
+def test_random_frequencies(num_symbols):
+    rnd = np.random.RandomState(6)
+    freqs = rnd.randint(1, MAX_TOTAL // num_symbols, size=(2000, num_symbols))
+    symbols = _sample(freqs, rnd)
+    decoded, _ = _round_trip(symbols, freqs)
+    assert decoded == symbols.tolist()
+
+
+def test_uniform_frequencies_cost_log2_bits():
+    rnd = np.random.RandomState(6)
+    symbols = rnd.randint(0, 16, size=4000)
+    decoded, num_bytes = _round_trip(symbols, np.full((4000, 16), 1024))
+    assert decoded == symbols.tolist()
+    assert num_bytes <= 4000 * 4 / 8 + 8
+
+
+def test_extreme_frequencies():
+    """ Frequencies of 1 next to MAX_TOTAL - 5, with the unlikely symbols in long runs, which propagate carries """
+    num_symbols = 6
+    freqs = np.ones((3000, num_symbols), dtype=np.int64)
+    freqs[:, 0] = MAX_TOTAL - (num_symbols - 1)
+    symbols = np.zeros(3000, dtype=np.int64)
+    symbols[100:400] = 5
+    symbols[1000:1002] = 1
+    symbols[2000::7] = 3
+    decoded, _ = _round_trip(symbols, freqs)
+    assert decoded == symbols.tolist()
+
+
+def test_only_likely_symbols_are_almost_free():
+    freqs = np.ones((10000, 2), dtype=np.int64)
+    freqs[:, 0] = MAX_TOTAL - 1
+    decoded, num_bytes = _round_trip(np.zeros(10000, dtype=np.int64), freqs)
+    assert decoded == [0] * 10000
+    assert num_bytes <= 8
+
+
+def test_empty():
+    decoded, _ = _round_trip(np.zeros(0, dtype=np.int64), np.ones((0, 4), dtype=np.int64))
+    assert decoded == []
+
+
+@pytest.mark.parametrize('increment', (1, 32, 4096))
+def test_adaptive_frequencies(increment):
+    """ Long enough for the tables to be rescaled several times """
+    rnd = np.random.RandomState(6)
+    symbols = np.concatenate([rnd.randint(0, 33, size=3000), np.full(3000, 7), rnd.randint(30, 33, size=3000)])
+    encoder = RangeEncoder()
+    model = AdaptiveFrequencies(33, increment)
+    for s in symbols.tolist():
+        model.encode(encoder, s)
+    data = encoder.finish()
+    decoder = RangeDecoder(data)
+    model = AdaptiveFrequencies(33, increment)
+    assert [model.decode(decoder) for _ in symbols] == symbols.tolist()
+
+
+def test_mixed_static_and_adaptive():
+    """ As in codec.encode_symbols: adaptive side information, followed by symbols with static tables """
+    rnd = np.random.RandomState(6)
+    levels = rnd.randint(0, 5, size=50)
+    freqs = rnd.randint(1, 1000, size=(300, 6))
+    symbols = _sample(freqs, rnd)
+    cdfs = freqs_to_cdf(freqs)
+    encoder = RangeEncoder()
+    levels_model = AdaptiveFrequencies(5)
+    for level in levels.tolist():
+        levels_model.encode(encoder, level)
+    encoder.encode_symbols(symbols, cdfs)
+    decoder = RangeDecoder(encoder.finish())
+    levels_model = AdaptiveFrequencies(5)
+    assert [levels_model.decode(decoder) for _ in levels] == levels.tolist()
+    assert [decoder.decode(cdf) for cdf in cdfs.tolist()] == symbols.tolist()
+
+
+def test_total_above_max_is_rejected():
+    with pytest.raises(AssertionError):
+        freqs_to_cdf([[MAX_TOTAL, 1]])
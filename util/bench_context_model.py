@@ -0,0 +1,83 @@
+"""
+Compare the masked and the grouped context model: bits and entropy decoding time.
+
+With checkpoints of both models, images are compressed with each and the real file sizes are reported:
+
+    python -m util.bench_context_model --masked_ckpt A --grouped_ckpt B image1.png image2.png ...
+
+Without checkpoints, both models get random weights and only the decoding times are meaningful:
+
+    python -m util.bench_context_model --latent_shape 20 20 32
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+import codec
+import context_model
+
+
+def _random_variables(prefix, c_in, L, rng):
+    shapes = {'conv1': (3, 3, 3, c_in, 24), 'conv2': (3, 3, 3, 24, 24), 'conv3': (3, 3, 3, 24, 24),
+              'conv4': (3, 3, 3, 24, L)}
+    variables = {}
+    for name, shape in shapes.items():
+        variables['W' + prefix + '_' + name] = rng.normal(scale=0.1, size=shape)
+        variables['b' + prefix + '_' + name] = np.full(shape[-1], 0.1)
+    return variables
+
+
+def _time_decode(data, centroids, cm):
+    start = time.time()
+    codec.decompress_latent(data, centroids, cm)
+    return time.time() - start
+
+
+def bench_random(latent_shape, num_slices, L=6, seed=666):
+    rng = np.random.RandomState(seed)
+    centroids = np.sort(rng.uniform(-2, 2, L)).astype(np.float32)
+    models = {'masked': context_model.MaskedContextModel(_random_variables('', 1, L, rng), centroids),
+              'grouped': context_model.GroupedContextModel(
+                  _random_variables(context_model.GROUPED_PREFIX, 2, L, rng), centroids, num_slices)}
+    z = rng.normal(size=latent_shape).astype(np.float32)
+    y = rng.uniform(0, latent_shape[2], size=latent_shape[:2] + (1,)).astype(np.float32)
+    img_shape = (latent_shape[0] * 8, latent_shape[1] * 8)
+    for name, cm in sorted(models.items()):
+        data = codec.compress_latent(img_shape, z, y, np.zeros(3), np.ones(3), centroids, cm)
+        print('{:>8}: {} bytes (random weights), decode {:.3f}s'.format(
+            name, len(data), _time_decode(data, centroids, cm)))
+
+
+def bench_checkpoints(ckpts, image_paths):
+    from PIL import Image
+    imgs = [np.array(Image.open(p).convert('RGB')) for p in image_paths]
+    for name, ckpt in ckpts:
+        c = codec.Codec(ckpt)
+        num_bytes, num_pixels, decode_time = 0, 0, 0.
+        for img in imgs:
+            data = c.compress(img)
+            num_bytes += len(data)
+            num_pixels += img.shape[0] * img.shape[1]
+            decode_time += _time_decode(data, c.centroids, c.context_model)
+        print('{:>8}: {:.4f} bpp, decode {:.3f}s per image'.format(
+            name, 8. * num_bytes / num_pixels, decode_time / len(imgs)))
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', type=str, nargs='*')
+    parser.add_argument('--masked_ckpt', type=str)
+    parser.add_argument('--grouped_ckpt', type=str)
+    parser.add_argument('--latent_shape', type=int, nargs=3, default=[20, 20, 32], metavar=('H', 'W', 'K'))
+    parser.add_argument('--num_slices', type=int, default=2)
+    flags = parser.parse_args(args)
+    if flags.masked_ckpt and flags.grouped_ckpt:
+        assert flags.images, 'Need images to compress'
+        bench_checkpoints([('masked', flags.masked_ckpt), ('grouped', flags.grouped_ckpt)], flags.images)
+    else:
+        bench_random(tuple(flags.latent_shape), flags.num_slices)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+"""
+Compare the time of the forward and backward pass of masked_conv.masked_conv3d and of a dense conv3d with the masked
+kernel on the context model layers. tests/test_masked_conv.py checks that both compute the same values and gradients.
+
+    python -m util.bench_masked_conv [--batch_size 30] [--steps 20]
+"""
+import argparse
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+from context_model import MASK_A, MASK_B
+from masked_conv import masked_conv3d
+
+
+# (C_in, C_out, include_center) of the layers of the context model
+LAYERS = ((1, 24, False), (24, 24, True), (24, 24, True), (24, 6, True))
+
+
+def _dense(z, W, include_center):
+    mask = (MASK_B if include_center else MASK_A)[:, :, :, np.newaxis, np.newaxis].astype(np.float32)
+    return tf.nn.conv3d(z, W * mask, strides=[1, 1, 1, 1, 1], padding='SAME')
+
+
+def _time(sess, fetches, steps):
+    sess.run(fetches)
+    start = time.time()
+    for _ in range(steps):
+        sess.run(fetches)
+    return (time.time() - start) / steps
+
+
+def bench(batch_size, steps, latent_size=20, K=32, seed=666):
+    rng = np.random.RandomState(seed)
+    for c_in, c_out, include_center in LAYERS:
+        with tf.Graph().as_default():
+            z = tf.constant(rng.normal(size=(batch_size, latent_size, latent_size, K, c_in)).astype(np.float32))
+            W = tf.constant(rng.normal(size=(3, 3, 3, c_in, c_out)).astype(np.float32))
+            results = {}
+            for name, conv in (('dense', _dense), ('tap-sparse', masked_conv3d)):
+                out = conv(z, W, include_center)
+                fetches = [out] + tf.gradients(tf.reduce_sum(out ** 2), [z, W])
+                with tf.Session() as sess:
+                    results[name] = _time(sess, fetches, steps)
+        dense_time, sparse_time = results['dense'], results['tap-sparse']
+        print('{:>2} -> {:>2} channels: dense {:.1f} ms, tap-sparse {:.1f} ms'.format(
+            c_in, c_out, dense_time * 1e3, sparse_time * 1e3))
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=30)
+    parser.add_argument('--steps', type=int, default=20)
+    flags = parser.parse_args(args)
+    bench(flags.batch_size, flags.steps)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+"""
+Compare the time of ms_ssim.py and of the previous per channel implementation on a batch, and print the differences of
+their MS-SSIM per image and for the whole batch. tests/test_ms_ssim.py checks that they are equal.
+
+    python -m util.bench_ms_ssim [--batch_size 30] [--size 160] [--steps 20]
+"""
+import argparse
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+from ms_ssim import ms_ssim
+
+
+# Previous implementation, as it was in AutoEncoder.py ----------------------------------------------------------------
+
+def _legacy_fspecial_gauss(size, sigma):
+    x_data, y_data = np.mgrid[-size // 2 + 1:size // 2 + 1, -size // 2 + 1:size // 2 + 1]
+    x = tf.constant(x_data[:, :, np.newaxis, np.newaxis], dtype=tf.float32)
+    y = tf.constant(y_data[:, :, np.newaxis, np.newaxis], dtype=tf.float32)
+    g = tf.exp(-((x ** 2 + y ** 2) / (2.0 * sigma ** 2)))
+    return g / tf.reduce_sum(g)
+
+
+def _legacy_ssim(img1, img2, size=9, sigma=1.5):
+    window = _legacy_fspecial_gauss(size, sigma)
+    C1 = 0.01 ** 2
+    C2 = 0.03 ** 2
+    mu1 = tf.nn.conv2d(img1, window, strides=[1, 1, 1, 1], padding='VALID')
+    mu2 = tf.nn.conv2d(img2, window, strides=[1, 1, 1, 1], padding='VALID')
+    mu1_sq = mu1 * mu1
+    mu2_sq = mu2 * mu2
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = tf.nn.conv2d(img1 * img1, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_sq
+    sigma2_sq = tf.nn.conv2d(img2 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu2_sq
+    sigma12 = tf.nn.conv2d(img1 * img2, window, strides=[1, 1, 1, 1], padding='VALID') - mu1_mu2
+    return (((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)),
+            (2.0 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2))
+
+
+def _legacy_ms_ssim(img1, img2, level=5):
+    weight = tf.constant([0.0448, 0.2856, 0.3001, 0.2363, 0.1333], dtype=tf.float32)
+    mssim = []
+    mcs = []
+    for l in range(level):
+        ssim_map, cs_map = _legacy_ssim(img1, img2)
+        mssim.append(tf.reduce_mean(ssim_map))
+        mcs.append(tf.reduce_mean(cs_map))
+        img1 = tf.nn.avg_pool(img1, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
+        img2 = tf.nn.avg_pool(img2, [1, 2, 2, 1], [1, 2, 2, 1], padding='SAME')
+    mssim = tf.stack(mssim, axis=0)
+    mcs = tf.stack(mcs, axis=0)
+    return tf.reduce_prod(mcs[0:level - 1] ** weight[0:level - 1]) * (mssim[level - 1] ** weight[level - 1])
+
+
+def _legacy_getMSSSIM(x, x_hat):
+    return sum(_legacy_ms_ssim(x[:, :, :, c:c + 1], x_hat[:, :, :, c:c + 1]) for c in range(3)) / 3
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def _time(sess, fetches, steps):
+    sess.run(fetches)
+    start = time.time()
+    for _ in range(steps):
+        sess.run(fetches)
+    return (time.time() - start) / steps
+
+
+def bench(batch_size, size, steps, num_checked=4, seed=666):
+    rng = np.random.RandomState(seed)
+    x_val = rng.uniform(size=(batch_size, size, size, 3)).astype(np.float32)
+    x_hat_val = np.clip(x_val + rng.normal(scale=0.05, size=x_val.shape), 0, 1).astype(np.float32)
+    with tf.Graph().as_default():
+        x = tf.constant(x_val)
+        x_hat = tf.constant(x_hat_val)
+        per_image, batch = ms_ssim(x, x_hat)
+        legacy_per_image = tf.stack([_legacy_getMSSSIM(x[i:i + 1], x_hat[i:i + 1]) for i in range(num_checked)])
+        legacy = _legacy_getMSSSIM(x, x_hat)
+        new_grad = tf.gradients(batch, x_hat)[0]
+        legacy_grad = tf.gradients(legacy, x_hat)[0]
+        with tf.Session() as sess:
+            per_image_val, legacy_per_image_val, batch_val, legacy_val = sess.run(
+                    [per_image, legacy_per_image, batch, legacy])
+            max_diff = np.max(np.abs(per_image_val[:num_checked] - legacy_per_image_val))
+            print('per image MS-SSIM: max abs difference {:.3g}'.format(max_diff))
+            print('batch MS-SSIM: abs difference {:.3g}'.format(abs(batch_val - legacy_val)))
+            legacy_time = _time(sess, [legacy, legacy_grad], steps)
+            new_time = _time(sess, [batch, new_grad], steps)
+    print('MS-SSIM and gradient of a {}x{}x{} batch: legacy {:.1f} ms, fused {:.1f} ms'.format(
+        batch_size, size, size, legacy_time * 1e3, new_time * 1e3))
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=30)
+    parser.add_argument('--size', type=int, default=160)
+    parser.add_argument('--steps', type=int, default=20)
+    flags = parser.parse_args(args)
+    bench(flags.batch_size, flags.size, flags.steps)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+"""
+Compare the peak memory of quantizer.py and of the previous tile/reshape/transpose implementation of Mask, soft_Q and Q,
+and print the differences of their values and gradients. tests/test_quantizer.py checks that they are equal.
+
+    python -m util.bench_quantizer [--batch_size 30]
+"""
+import argparse
+import sys
+import numpy as np
+import tensorflow as tf
+
+import quantizer
+
+
+# Previous implementation, as it was in AutoEncoder.py ----------------------------------------------------------------
+
+def _legacy_Mask(y, K):
+    yy = tf.transpose(tf.reshape(tf.tile(tf.reshape(y, [-1]), [K]),
+                                 [K, tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2]]), [1, 2, 3, 0])
+    kk = tf.transpose(tf.reshape(tf.tile(tf.linspace(0., K-1, K), [np.prod(y.get_shape().as_list())]),
+                                 [tf.shape(y)[0], tf.shape(y)[1], tf.shape(y)[2], K]), [0, 1, 2, 3])
+    m = yy - kk
+    z = tf.zeros(tf.shape(m))
+    m = tf.maximum(x=m, y=z)
+    z = tf.ones(tf.shape(m))
+    m = tf.minimum(x=m, y=z)
+    m = m + tf.stop_gradient(tf.ceil(m) - m)
+    return m
+
+
+def _legacy_soft_Q(z_masked, sigma, centroids, L):
+    zz = tf.transpose(tf.reshape(tf.tile(
+        tf.reshape(z_masked, [-1]), [L]),
+        [L, tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3]]),
+        [1, 2, 3, 4, 0])
+    cc = tf.reshape(tf.tile(centroids, [tf.size(z_masked)]),
+                    [tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3], L])
+    return tf.reduce_sum(tf.nn.softmax(tf.abs(zz - cc) * (-sigma), axis=4) * cc, axis=4)
+
+
+def _legacy_Q(z_masked, centroids, L, z):
+    zz = tf.transpose(tf.reshape(tf.tile(
+        tf.reshape(z_masked, [-1]), [L]),
+        [L, tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3]]),
+        [1, 2, 3, 4, 0])
+    cc = tf.reshape(tf.tile(centroids, [tf.size(z_masked)]),
+                    [tf.shape(z_masked)[0], tf.shape(z_masked)[1], tf.shape(z_masked)[2], tf.shape(z_masked)[3], L])
+    best_centroids = tf.argmin(tf.abs(zz - cc), axis=-1)
+    shape = z.get_shape().as_list()
+    X, Y, Z, W = tf.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]))
+    idx = tf.transpose(tf.stack([tf.reshape(X, [-1]), tf.reshape(Y, [-1]), tf.reshape(Z, [-1]), tf.reshape(W, [-1]),
+                                 tf.reshape(best_centroids, [-1])]))
+    z_hat = tf.reshape(tf.gather_nd(cc, idx), [shape[0], shape[1], shape[2], shape[3]])
+    return z_hat, best_centroids
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def _legacy_graph(z, y, centroids, sigma, K, L):
+    m = _legacy_Mask(y, K)
+    z_masked = z * m
+    z_tilde = _legacy_soft_Q(z_masked, sigma, centroids, L)
+    z_hat, best_centroids = _legacy_Q(z_masked, centroids, L, z)
+    return m, z_tilde, z_hat, best_centroids
+
+
+def _new_graph(z, y, centroids, sigma, K, L):
+    m = quantizer.Mask(y, K)
+    z_masked = z * m
+    z_tilde, z_hat, best_centroids = quantizer.quantize(z_masked, sigma, centroids)
+    return m, z_tilde, z_hat, best_centroids
+
+
+def _peak_bytes(run_metadata):
+    """ Peak of the bytes in use on each device, by replaying the allocation records of a traced step """
+    peak = 0
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        records = sorted((record.alloc_micros, record.alloc_bytes)
+                         for node_stats in dev_stats.node_stats
+                         for memory in node_stats.memory
+                         for record in memory.allocation_records)
+        in_use = 0
+        for _, num_bytes in records:
+            in_use += num_bytes
+            peak = max(peak, in_use)
+    return peak
+
+
+# Names of the values returned by run()
+NAMES = ('m', 'z_tilde', 'z_hat', 'best_centroids', 'grad z', 'grad y', 'grad centroids')
+
+
+def run(build, batch_size, latent_size=20, K=32, L=6, seed=666):
+    """
+    Evaluate the quantizer graph of build, _legacy_graph or _new_graph, on random inputs given by seed
+    :return: (values of NAMES, peak bytes in use)
+    """
+    rng = np.random.RandomState(seed)
+    z_val = rng.normal(size=(batch_size, latent_size, latent_size, K)).astype(np.float32)
+    y_val = rng.uniform(0, K, size=(batch_size, latent_size, latent_size, 1)).astype(np.float32)
+    with tf.Graph().as_default():
+        z = tf.constant(z_val)
+        y = tf.constant(y_val)
+        centroids = tf.get_variable('centroid', shape=(L,), dtype=tf.float32,
+                                    initializer=tf.random_uniform_initializer(minval=-2, maxval=2, seed=seed))
+        m, z_tilde, z_hat, best_centroids = build(z, y, centroids, tf.constant(1.), K, L)
+        z_differentiable = tf.stop_gradient(z_hat - z_tilde) + z_tilde
+        grads = tf.gradients(tf.reduce_sum(z_differentiable ** 2), [z, y, centroids])
+        fetches = (m, z_tilde, z_hat, best_centroids) + tuple(grads)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            run_metadata = tf.RunMetadata()
+            values = sess.run(fetches, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                              run_metadata=run_metadata)
+    return values, _peak_bytes(run_metadata)
+
+
+def bench(batch_size):
+    legacy_values, legacy_peak = run(_legacy_graph, batch_size)
+    new_values, new_peak = run(_new_graph, batch_size)
+    for name, legacy_value, new_value in zip(NAMES, legacy_values, new_values):
+        max_diff = np.max(np.abs(np.asarray(legacy_value, np.float64) - np.asarray(new_value, np.float64)))
+        print('{:>15}: max abs difference {:.3g}'.format(name, max_diff))
+    print('Peak memory: legacy {:.1f} MB, broadcasting {:.1f} MB'.format(legacy_peak / 2 ** 20, new_peak / 2 ** 20))
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=30)
+    flags = parser.parse_args(args)
+    bench(flags.batch_size)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,139 @@
+"""
+Disk footprint and read throughput of TFRecords without compression, with GZIP and with ZLIB
+(`tf_records.py --record_compression`), for examples of JPEGs and for examples of pre-decoded uint8 crops, as written by
+`tf_records.py mk_raw_recs`. The first NUM_EXAMPLES examples of RECORDS_GLOB are written to a temporary directory in
+each format, and read back with tf.data, parsed and decoded into crops as in input_pipeline.py.
+
+The files are in the page cache when they are read, so the measured rate is bound by the CPU. With --disk_mb_per_s,
+the rate when reading from a disk of that bandwidth, e.g., a network disk, is also estimated, as the lower of the
+measured rate and the bandwidth divided by the bytes per example on disk.
+
+    python -m util.bench_record_compression "/mnt/disks/disk2/records/train/train-*" [--num_examples 1000]
+                                            [--disk_mb_per_s 120]
+"""
+import argparse
+import glob
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+import input_pipeline
+
+
+COMPRESSION_TYPES = ('', 'GZIP', 'ZLIB')
+
+
+def read_examples(records_glob, num_examples):
+    """ :return: the first num_examples serialized examples of the records matching records_glob """
+    examples = []
+    for record_p in sorted(glob.glob(records_glob)):
+        options = input_pipeline.record_options(input_pipeline.record_compression(record_p))
+        records = tf.python_io.tf_record_iterator(record_p, options)
+        examples.extend(itertools.islice(records, num_examples - len(examples)))
+        if len(examples) == num_examples:
+            break
+    assert examples, 'Did not find any records matching {}'.format(records_glob)
+    return examples
+
+
+def to_raw_example(serialized, crop_size):
+    """ :return: serialized example of the center crop of the JPEG of serialized, as written by mk_raw_recs """
+    features = tf.train.Example.FromString(serialized).features.feature
+    img = np.array(Image.open(io.BytesIO(features['image/encoded'].bytes_list.value[0])).convert('RGB'))
+    top, left = (img.shape[0] - crop_size) // 2, (img.shape[1] - crop_size) // 2
+    img = img[top:top + crop_size, left:left + crop_size]
+    feature = {'image/encoded' + input_pipeline.RAW_SUFFIX: tf.train.Feature(
+                   bytes_list=tf.train.BytesList(value=[img.tobytes()])),
+               'image/shape': tf.train.Feature(int64_list=tf.train.Int64List(value=list(img.shape))),
+               'image/filename': features['image/filename']}
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def write_records(examples, record_p, compression_type):
+    """ :return: size of the written file in bytes """
+    with tf.python_io.TFRecordWriter(record_p, input_pipeline.record_options(compression_type)) as writer:
+        for serialized in examples:
+            writer.write(serialized)
+    return os.path.getsize(record_p)
+
+
+def read_rate(record_p, compression_type, decode_fn, batch_size, num_epochs):
+    """ :return: examples per second of reading record_p num_epochs times, parsing and decoding with decode_fn """
+    dataset = tf.data.TFRecordDataset(record_p, compression_type).repeat(num_epochs)
+    dataset = dataset.apply(tf.contrib.data.map_and_batch(decode_fn, batch_size,
+                                                          num_parallel_calls=input_pipeline.AUTOTUNE))
+    next_batch = dataset.prefetch(input_pipeline.AUTOTUNE).make_one_shot_iterator().get_next()
+    num_examples = 0
+    with tf.Session() as sess:
+        sess.run(next_batch)  # warmup
+        start = time.time()
+        while True:
+            try:
+                _, filenames = sess.run(next_batch)
+            except tf.errors.OutOfRangeError:
+                break
+            num_examples += len(filenames)
+    return num_examples / (time.time() - start)
+
+
+def bench(records_glob, num_examples, crop_size, batch_size, num_epochs, disk_mb_per_s=None):
+    jpeg_examples = read_examples(records_glob, num_examples)
+
+    def _decode_jpeg(example_proto):
+        encoded, filename = input_pipeline.parse_example(example_proto)
+        return input_pipeline.decode_random_crop_window(encoded, crop_size), filename
+
+    def _decode_raw(example_proto):
+        return input_pipeline.parse_raw_example(example_proto, (crop_size, crop_size, 3))
+
+    payloads = [('jpeg', jpeg_examples, _decode_jpeg),
+                ('raw', [to_raw_example(serialized, crop_size) for serialized in jpeg_examples], _decode_raw)]
+    print('{} examples, {}x{} crops, {} epochs'.format(len(jpeg_examples), crop_size, crop_size, num_epochs))
+    print('{:<8}{:<8}{:>12}{:>8}{:>12}{:>10}{:>12}'.format('payload', 'comp', 'disk MB', 'ratio', 'KB/ex', 'ex/s',
+                                                        'disk MB/s') +
+          ('{:>14}'.format('ex/s @ {:.0f}'.format(disk_mb_per_s)) if disk_mb_per_s else ''))
+    out_dir = tempfile.mkdtemp()
+    try:
+        for name, examples, decode_fn in payloads:
+            uncompressed_bytes = None
+            for compression_type in COMPRESSION_TYPES:
+                record_p = os.path.join(out_dir, '{}_{}.tfrecord'.format(name, compression_type.lower() or 'none'))
+                num_bytes = write_records(examples, record_p, compression_type)
+                uncompressed_bytes = uncompressed_bytes or num_bytes
+                with tf.Graph().as_default():
+                    rate = read_rate(record_p, compression_type, decode_fn, batch_size, num_epochs)
+                bytes_per_example = num_bytes / len(examples)
+                row = '{:<8}{:<8}{:>12.1f}{:>8.2f}{:>12.1f}{:>10.0f}{:>12.1f}'.format(
+                        name, compression_type or 'none', num_bytes / 2 ** 20, uncompressed_bytes / num_bytes,
+                        bytes_per_example / 2 ** 10, rate, rate * bytes_per_example / 2 ** 20)
+                if disk_mb_per_s:
+                    row += '{:>14.0f}'.format(min(rate, disk_mb_per_s * 2 ** 20 / bytes_per_example))
+                print(row)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('records_glob', type=str, help='Records of JPEGs, with image/encoded and image/filename.')
+    parser.add_argument('--num_examples', type=int, default=1000)
+    parser.add_argument('--crop_size', type=int, default=input_pipeline.CROP_SIZE)
+    parser.add_argument('--batch_size', type=int, default=30)
+    parser.add_argument('--num_epochs', type=int, default=3, help='Number of times each file is read.')
+    parser.add_argument('--disk_mb_per_s', type=float,
+                        help='If given, also estimate the examples per second when reading is limited by a disk '
+                             'with this bandwidth.')
+    flags = parser.parse_args(args)
+    bench(flags.records_glob, flags.num_examples, flags.crop_size, flags.batch_size, flags.num_epochs,
+          flags.disk_mb_per_s)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
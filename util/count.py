@@ -1,9 +1,16 @@
-from os import listdir
-import tensorflow as tf
+import sys
+from os import listdir, path
+
+import record_index
+import record_reader
+
+records_dir = sys.argv[1] if len(sys.argv) > 1 else '/mnt/disks/disk2/records/train'
 
 c = 0
-for fn in listdir('/mnt/disks/disk2/ae_out/records/train'):
-  for record in tf.python_io.tf_record_iterator('/mnt/disks/disk2/records/train/' + fn):
-     c += 1
+for fn in sorted(listdir(records_dir)):
+    if not fn.endswith('.tfrecord'):  # skip anything else in the directory
+        continue
+    p = path.join(records_dir, fn)
+    c += record_index.count(p) if record_index.has_index(p) else record_reader.count_records(p)  # never writes indices
 
 print(c)
@@ -0,0 +1,156 @@
+"""
+Listing of the images matching a glob, for sets of tens of millions of images. Directories are walked with os.scandir,
+and only the entries of one directory at a time are sorted, so paths are streamed in a fixed order: sorted by name
+within each directory, depth first. This is the order of sorted(glob.glob(image_glob)), unless a directory name is
+the prefix of another name in the same directory.
+
+With a cache_dir, the listing is also written to cache_dir, together with the mtime of every directory that was
+walked, and later listings of the same glob are read from there as long as none of these mtimes changed. Adding or
+removing a file changes the mtime of its directory, so the cache is never stale.
+"""
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import zlib
+
+
+_CACHE_PREFIX = 'images_'
+
+
+def iterate_images(image_glob, cache_dir=None):
+    """ :return: generator of the paths matching image_glob, in the order described above """
+    if cache_dir is None:
+        yield from _walk_glob(image_glob, {})
+        return
+    cache_p = _cache_path(image_glob, cache_dir)
+    header = _read_cache_header(cache_p)
+    if header is None or not _is_valid(header, image_glob):
+        _write_cache(image_glob, cache_p)
+    with open(cache_p) as f:
+        next(f)  # header
+        for line in f:
+            yield line[:-1]
+
+
+def count_images(image_glob, cache_dir):
+    """ :return: number of paths matching image_glob, from the cached listing, which is built if needed """
+    cache_p = _cache_path(image_glob, cache_dir)
+    header = _read_cache_header(cache_p)
+    if header is None or not _is_valid(header, image_glob):
+        header = _write_cache(image_glob, cache_p)
+    return header['count']
+
+
+def iterate_images_of_job(image_glob, job_id, num_jobs, contiguous, cache_dir=None):
+    """
+    Split the images of image_glob into num_jobs disjoint sets, the same for all jobs, without a list of all paths.
+    :param job_id: in 1...num_jobs
+    :param contiguous: if True, job j gets the j-th of num_jobs consecutive slices of the listing, e.g., to keep the
+    frames of a video together. Otherwise, paths are assigned by their hash, which needs only a single pass.
+    """
+    if num_jobs == 1:
+        yield from iterate_images(image_glob, cache_dir)
+        return
+    if not contiguous:
+        for p in iterate_images(image_glob, cache_dir):
+            if zlib.crc32(p.encode()) % num_jobs == job_id - 1:
+                yield p
+        return
+    num_images = (count_images(image_glob, cache_dir) if cache_dir is not None
+                  else sum(1 for _ in iterate_images(image_glob)))
+    start, end = (job_id - 1) * num_images // num_jobs, job_id * num_images // num_jobs
+    for i, p in enumerate(iterate_images(image_glob, cache_dir)):
+        if i >= end:
+            return
+        if i >= start:
+            yield p
+
+
+# Walking ---
+
+def _split_static_prefix(image_glob):
+    """ :return: (directory without wildcards, list of the remaining components) """
+    parts = image_glob.split(os.sep)
+    static = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            break
+        static.append(part)
+    root = os.sep.join(static) if static != [''] else os.sep
+    return root, parts[len(static):]
+
+
+def _walk_glob(image_glob, dir_mtimes):
+    root, parts = _split_static_prefix(image_glob)
+    yield from _walk(root, parts, dir_mtimes)
+
+
+def _walk(directory, parts, dir_mtimes):
+    """ Like glob, for the pattern components parts below directory. Stores the mtime of all directories walked. """
+    part, rest = parts[0], parts[1:]
+    try:
+        dir_mtimes[directory] = os.stat(directory or os.curdir).st_mtime_ns
+        with os.scandir(directory or os.curdir) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for entry in entries:
+        if entry.name.startswith('.') and not part.startswith('.'):  # as glob, wildcards do not match hidden files
+            continue
+        if not fnmatch.fnmatchcase(entry.name, part):
+            continue
+        p = os.path.join(directory, entry.name)
+        if rest:
+            if entry.is_dir():
+                yield from _walk(p, rest, dir_mtimes)
+        elif entry.is_file():
+            yield p
+
+
+# Cache ---
+
+def _cache_path(image_glob, cache_dir):
+    key = hashlib.sha1(os.path.abspath(image_glob).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, '{}{}.txt'.format(_CACHE_PREFIX, key))
+
+
+def _read_cache_header(cache_p):
+    if not os.path.isfile(cache_p):
+        return None
+    with open(cache_p) as f:
+        return json.loads(next(f))
+
+
+def _is_valid(header, image_glob):
+    if header['glob'] != image_glob:
+        return False
+    for directory, mtime_ns in header['dirs'].items():
+        try:
+            if os.stat(directory or os.curdir).st_mtime_ns != mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def _write_cache(image_glob, cache_p):
+    """ Walk image_glob and write its listing to cache_p, after a header with the count. :return: header """
+    os.makedirs(os.path.dirname(cache_p) or os.curdir, exist_ok=True)
+    dir_mtimes = {}
+    num_images = 0
+    paths_p = '{}.{}.paths'.format(cache_p, os.getpid())
+    with open(paths_p, 'w') as f:
+        for p in _walk_glob(image_glob, dir_mtimes):
+            f.write(p + '\n')
+            num_images += 1
+    header = {'glob': image_glob, 'count': num_images, 'dirs': dir_mtimes}
+    tmp_p = '{}.{}.tmp'.format(cache_p, os.getpid())
+    with open(tmp_p, 'w') as f_out, open(paths_p) as f_in:
+        f_out.write(json.dumps(header) + '\n')
+        for line in f_in:
+            f_out.write(line)
+    os.remove(paths_p)
+    os.replace(tmp_p, cache_p)  # atomic, so concurrent jobs always see a complete listing
+    return header
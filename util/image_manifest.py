@@ -0,0 +1,112 @@
+"""
+Manifest of the images in a directory of records, the hidden file OUT_DIR/.manifest.jsonl, which globs of the records
+do not match, used to add only new images to existing records. It has one JSON line per complete shard:
+
+    {"shard": "shard_00000012.tfrecord", "images": [[path, size, mtime_ns, sha1], ...]}
+
+A line is appended only after the shard and its index are closed, so shards without a line are incomplete, e.g.,
+after a crash, and are written again by the next run. Images whose path, size and mtime are in the manifest are
+skipped without reading them, all others are hashed, and skipped if their content is already in the records.
+
+Images that were ingested but are in no example, e.g., frames that do not fill a tuple of consecutive frames, are
+listed in lines {"skipped": [[path, size, mtime_ns, sha1], ...]}, so that they are not hashed again by every run.
+"""
+import hashlib
+import json
+import os
+from concurrent import futures
+
+
+MANIFEST_FILE_NAME = '.manifest.jsonl'
+_LEGACY_MANIFEST_FILE_NAME = 'manifest.jsonl'
+_HASH_CHUNK_SIZE = 2 ** 20
+
+
+def manifest_path(out_dir):
+    return os.path.join(out_dir, MANIFEST_FILE_NAME)
+
+
+def content_hash(p):
+    h = hashlib.sha1()
+    with open(p, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest(object):
+
+    def __init__(self, out_dir):
+        self.path = manifest_path(out_dir)
+        legacy_path = os.path.join(out_dir, _LEGACY_MANIFEST_FILE_NAME)
+        if not os.path.exists(self.path) and os.path.isfile(legacy_path):  # written before the manifest was hidden
+            os.rename(legacy_path, self.path)
+        self.shards = []  # file names of the complete shards, in the order they were written
+        self._images = {}  # path -> (size, mtime_ns, sha1)
+        self._hashes = set()
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if 'skipped' in entry:
+                            self._add_skipped(entry['skipped'])
+                        else:
+                            self._add(entry['shard'], entry['images'])
+
+    def _add(self, shard_name, images):
+        self.shards.append(shard_name)
+        for p, size, mtime_ns, sha1 in images:
+            self._images[p] = (size, mtime_ns, sha1)
+            self._hashes.add(sha1)
+
+    def _add_skipped(self, images):
+        for p, size, mtime_ns, sha1 in images:  # not in _hashes, as their content is not in the records
+            self._images[p] = (size, mtime_ns, sha1)
+
+    def __len__(self):
+        return len(self._images)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def create(self):
+        """ Create the manifest file if it does not exist yet, so that the records it lists can be resumed """
+        open(self.path, 'a').close()
+
+    def _append(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_shard(self, shard_name, images):
+        """ :param images: list of (path, size, mtime_ns, sha1) of the images in the complete shard shard_name """
+        images = [list(image) for image in images]
+        self._append({'shard': shard_name, 'images': images})
+        self._add(shard_name, images)
+
+    def add_skipped(self, images):
+        """ :param images: list of (path, size, mtime_ns, sha1) of images that were not written to any shard """
+        images = [list(image) for image in images]
+        if images:
+            self._append({'skipped': images})
+            self._add_skipped(images)
+
+    def find_new_images(self, paths, num_threads=16):
+        """
+        :return: (list of (path, size, mtime_ns, sha1) of the images of paths that are not in the records yet, in the
+        order of paths, number of skipped duplicates). Only images whose path, size or mtime is new are read.
+        """
+        with futures.ThreadPoolExecutor(num_threads) as pool:
+            stats = list(pool.map(os.stat, paths))
+            changed = [(p, st.st_size, st.st_mtime_ns) for p, st in zip(paths, stats)
+                       if self._images.get(p, (None, None))[:2] != (st.st_size, st.st_mtime_ns)]
+            hashes = list(pool.map(content_hash, [p for p, _, _ in changed]))
+        new_images = []
+        seen = set(self._hashes)
+        for (p, size, mtime_ns), sha1 in zip(changed, hashes):
+            if sha1 not in seen:
+                seen.add(sha1)
+                new_images.append((p, size, mtime_ns, sha1))
+        return new_images, len(changed) - len(new_images)
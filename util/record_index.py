@@ -0,0 +1,99 @@
+"""
+Index of the examples in a TFRecord file, stored next to it as the hidden file .RECORD.index, which globs of the
+records such as "dir/*" or "dir/shard_*" do not match: a little endian uint64 array of (offset, length) pairs, one
+per example, where offset is the position of the record in the file, and length the size of the serialized example.
+With it, examples can be counted without reading the records, and single examples can be read directly.
+
+Each record in the file is: uint64 length, uint32 CRC of the length, the serialized example, uint32 CRC of the example.
+For files written with GZIP or ZLIB compression, offsets are positions in the uncompressed records, and reading an
+example decompresses the file up to it.
+"""
+import os
+import struct
+import numpy as np
+
+import record_reader
+
+
+INDEX_EXT = 'index'
+RECORD_OVERHEAD = 16  # bytes of a record around the serialized example
+_DATA_OFFSET = 12  # bytes of length and CRC before the serialized example
+_INDEX_DTYPE = np.dtype('<u8')
+
+
+def index_path(record_path):
+    record_dir, record_name = os.path.split(record_path)
+    return os.path.join(record_dir, '.{}.{}'.format(record_name, INDEX_EXT))
+
+
+class IndexWriter(object):
+    """ Builds the index of a record file while it is written, from the lengths of the serialized examples """
+
+    def __init__(self, record_path):
+        self.record_path = record_path
+        self.lengths = []
+
+    def add(self, length):
+        self.lengths.append(length)
+
+    def close(self):
+        write_index(self.record_path, self.lengths)
+
+
+def write_index(record_path, lengths):
+    """ :param lengths: lengths of the serialized examples, in the order they were written """
+    lengths = np.asarray(lengths, dtype=_INDEX_DTYPE)
+    offsets = np.cumsum(lengths + RECORD_OVERHEAD, dtype=_INDEX_DTYPE) - (lengths + RECORD_OVERHEAD)
+    np.stack([offsets, lengths], axis=1).astype(_INDEX_DTYPE).tofile(index_path(record_path))
+
+
+def has_index(record_path):
+    return os.path.isfile(index_path(record_path))
+
+
+def read_index(record_path):
+    """ :return: memory mapped uint64 array [N, 2] of (offset, length) """
+    p = index_path(record_path)
+    if os.path.getsize(p) == 0:
+        return np.zeros((0, 2), dtype=_INDEX_DTYPE)
+    return np.memmap(p, dtype=_INDEX_DTYPE, mode='r').reshape(-1, 2)
+
+
+def count(record_path):
+    """ Number of examples in record_path, from the size of its index """
+    return os.path.getsize(index_path(record_path)) // (2 * _INDEX_DTYPE.itemsize)
+
+
+def build_index(record_path):
+    """ (Re)build the index of an existing record file, by reading only the length of each record. :return: count """
+    if record_reader.detect_compression(record_path):
+        with record_reader.RecordFile(record_path) as f:
+            lengths = f.lengths()
+        write_index(record_path, lengths)
+        return len(lengths)
+    lengths = []
+    file_size = os.path.getsize(record_path)
+    with open(record_path, 'rb') as f:
+        offset = 0
+        while offset < file_size:
+            header = f.read(8)
+            assert len(header) == 8, 'Truncated record at {} in {}'.format(offset, record_path)
+            length, = struct.unpack('<Q', header)
+            lengths.append(length)
+            offset += length + RECORD_OVERHEAD
+            f.seek(offset)
+    assert offset == file_size, 'Truncated record at the end of {}'.format(record_path)
+    write_index(record_path, lengths)
+    return len(lengths)
+
+
+def read_example(record_path, i, index=None):
+    """ :return: bytes of the serialized example i of record_path """
+    offset, length = (read_index(record_path) if index is None else index)[i]
+    compression = record_reader.detect_compression(record_path)
+    if compression:
+        start = int(offset) + _DATA_OFFSET
+        return record_reader.read_decompressed(record_path, compression, start + int(length))[start:start + int(length)]
+    with open(record_path, 'rb') as f:
+        f.seek(int(offset) + _DATA_OFFSET)
+        return f.read(int(length))
@@ -0,0 +1,245 @@
+"""
+Read TFRecord files without TensorFlow: records are sliced out of the memory mapped file, optionally checking their
+CRCs, and tf.train.Example messages are parsed by parse_example into a dict of lists.
+
+Each record is: uint64 length, uint32 masked CRC-32C of the length, data, uint32 masked CRC-32C of the data.
+CRC checks use the crc32c package if it is installed, and a much slower pure Python CRC-32C otherwise.
+
+Files written with GZIP or ZLIB compression (TFRecordOptions) are detected from their first bytes, and decompressed
+into memory instead of being memory mapped.
+"""
+import mmap
+import struct
+import zlib
+import numpy as np
+
+try:
+    from crc32c import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+
+_HEADER = struct.Struct('<QI')
+_FOOTER = struct.Struct('<I')
+_MASK_DELTA = 0xa282ead8
+
+
+# CRC ------------------------------------------------------------------------------------------------------------------
+
+def _make_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0x82f63b78 if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def crc32c(data):
+    if _crc32c is not None:
+        return _crc32c(data)
+    crc = 0xffffffff
+    table = _CRC32C_TABLE
+    for b in bytes(data):
+        crc = table[(crc ^ b) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + _MASK_DELTA) & 0xffffffff
+
+
+# Compression ----------------------------------------------------------------------------------------------------------
+
+def detect_compression(record_path):
+    """ :return: compression type of record_path, as for tf.data.TFRecordDataset: '', 'GZIP' or 'ZLIB' """
+    with open(record_path, 'rb') as f:
+        head = f.read(_HEADER.size)
+    if not head:
+        return ''
+    if len(head) == _HEADER.size and masked_crc32c(head[:8]) == _HEADER.unpack(head)[1]:
+        return ''
+    if head[:2] == b'\x1f\x8b':
+        return 'GZIP'
+    if len(head) >= 2 and head[0] & 0x0f == 8 and (head[0] << 8 | head[1]) % 31 == 0:  # zlib header
+        return 'ZLIB'
+    raise IOError('Not a TFRecord file: {}'.format(record_path))
+
+
+def read_decompressed(record_path, compression, size=None):
+    """ :return: the first size bytes (at least) of the uncompressed records of a compressed file, or all of them """
+    decompressor = zlib.decompressobj(31 if compression == 'GZIP' else 15)  # 31: with gzip header
+    chunks = []
+    num_bytes = 0
+    with open(record_path, 'rb') as f:
+        while size is None or num_bytes < size:
+            data = f.read(2 ** 20)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+            num_bytes += len(chunks[-1])
+    return b''.join(chunks)
+
+
+# Records --------------------------------------------------------------------------------------------------------------
+
+class RecordFile(object):
+    """ Memory mapped TFRecord file. Use as context manager, or call close(). """
+
+    def __init__(self, record_path):
+        self.record_path = record_path
+        self.compression = detect_compression(record_path)
+        self._f = open(record_path, 'rb')
+        if self.compression:
+            self._mm = read_decompressed(record_path, self.compression)
+            return
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._mm = b''
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, offset, check_crc=False):
+        """ :return: (data of the record at offset, offset of the next record) """
+        length, length_crc = _HEADER.unpack_from(self._mm, offset)
+        start = offset + _HEADER.size
+        end = start + length
+        if end + _FOOTER.size > len(self._mm):
+            raise IOError('Truncated record at {} in {}'.format(offset, self.record_path))
+        data = self._mm[start:end]
+        if check_crc:
+            data_crc, = _FOOTER.unpack_from(self._mm, end)
+            if masked_crc32c(self._mm[offset:offset + 8]) != length_crc or masked_crc32c(data) != data_crc:
+                raise IOError('CRC mismatch in record at {} in {}'.format(offset, self.record_path))
+        return data, end + _FOOTER.size
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, check_crc=False):
+        """ :return: generator of the data of all records """
+        offset = 0
+        while offset < len(self._mm):
+            data, offset = self.read(offset, check_crc)
+            yield data
+
+    def lengths(self):
+        """ :return: lengths of all records, reading only their headers """
+        lengths = []
+        offset = 0
+        while offset < len(self._mm):
+            length, _ = _HEADER.unpack_from(self._mm, offset)
+            lengths.append(length)
+            offset += _HEADER.size + length + _FOOTER.size
+        if offset != len(self._mm):
+            raise IOError('Truncated record at the end of {}'.format(self.record_path))
+        return lengths
+
+
+def iterate_records(record_path, check_crc=False):
+    """ Like tf.python_io.tf_record_iterator: generator of the serialized examples of record_path """
+    with RecordFile(record_path) as f:
+        yield from f.iterate(check_crc)
+
+
+def count_records(record_path):
+    with RecordFile(record_path) as f:
+        return len(f.lengths())
+
+
+# Example parsing ------------------------------------------------------------------------------------------------------
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """ :return: generator of (field number, wire type, value) of a protobuf message, value is an int or a slice """
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _varint(buf, pos)
+        wire_type = tag & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        else:
+            raise ValueError('Unsupported wire type {}'.format(wire_type))
+        yield tag >> 3, wire_type, value
+
+
+def _int64(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _parse_feature(buf):
+    """ :return: list of bytes, floats or ints """
+    for field, _, value in _fields(buf):
+        if field == 1:  # BytesList
+            return [bytes(v) for _, _, v in _fields(value)]
+        if field == 2:  # FloatList, packed or not
+            return [f for _, wire_type, v in _fields(value)
+                    for f in np.frombuffer(bytes(v), dtype='<f4').tolist()]
+        if field == 3:  # Int64List, packed or not
+            values = []
+            for _, wire_type, v in _fields(value):
+                if wire_type == 0:
+                    values.append(_int64(v))
+                else:
+                    pos = 0
+                    while pos < len(v):
+                        i, pos = _varint(v, pos)
+                        values.append(_int64(i))
+            return values
+    return []
+
+
+def parse_example(serialized):
+    """ Minimal parser of a serialized tf.train.Example. :return: dict feature key -> list of values """
+    buf = memoryview(serialized)
+    features = {}
+    for field, _, features_buf in _fields(buf):
+        if field != 1:
+            continue
+        for entry_field, _, entry in _fields(features_buf):
+            if entry_field != 1:
+                continue
+            key, feature = '', b''
+            for f, _, v in _fields(entry):
+                if f == 1:
+                    key = bytes(v).decode()
+                elif f == 2:
+                    feature = v
+            features[key] = _parse_feature(feature)
+    return features
@@ -1,44 +1,234 @@
 """
 
 """
-import itertools
-import tensorflow as tf
+import importlib
+import io
+import zlib
+import numpy as np
 from os import path
 import os
 import sys
 import re
 import random
 import argparse
+import collections
 import glob
+from concurrent import futures
 from PIL import Image
-from fjcommon import tf_helpers
 from fjcommon import printing
-from fjcommon import iterable_ext
 from fjcommon import functools_ext
 
+import image_listing
+import image_manifest
+import record_index
+import record_reader
+
+
+class _LazyModule(object):
+    """ Imports the module on first use, so that modes that do not need TensorFlow start without importing it """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+tf = _LazyModule('tensorflow')
+
 
 _JOB_SUBDIR_PREFIX = 'job_'
 _TF_RECORD_EXT = 'tfrecord'
 _DEFAULT_FEATURE_KEY = 'M'  # TODO: let this be a parameter
+_RAW_SUFFIX = '/raw'  # pre-decoded image of the feature KEY is stored in KEY/raw, see input_pipeline.py
+_RAW_COMPRESSIONS = ('none', 'zlib')
+_RECORD_COMPRESSIONS = ('none', 'gzip', 'zlib')  # of whole record files, see _record_options
+_DEFAULT_LABEL_ROOT = '/mnt/disks/disk2/ae_out/label'  # labels of the AE output, see create_paired_records
 
 
 # TODO: let this be a parameter
 _FRAME_ID_REGEX = r'(.*?)(\d{3,})\.png'  # filename, at least 3 digits right before the extension
 
 
-def create_images_records_distributed(image_glob, job_id, num_jobs, out_dir, num_per_shard, num_per_example, feature_key):
+def create_images_records_distributed(image_glob, job_id, num_jobs, out_dir, num_per_shard, num_per_example, feature_key,
+                                      num_workers=None, num_io_threads=8, target_bytes_per_shard=None,
+                                      balance_jobs_by_bytes=False, listing_cache_dir=None, frame_stride=None,
+                                      record_compression=None):
+    """
+    :param num_workers: if given, shards are written by this many processes at once, see create_records_in_parallel
+    :param target_bytes_per_shard: if given, cut shards by size instead of every num_per_shard examples
+    :param balance_jobs_by_bytes: if True, give each job the same number of bytes instead of the same number of images
+    :param listing_cache_dir: if given, cache the listing of image_glob there, see image_listing.py
+    :param frame_stride: distance of the first frames of consecutive examples, see iterate_in_consecutive_frame_tuples
+    :param record_compression: if given, 'gzip' or 'zlib', to compress the record files, see _record_options
+    """
     assert 1 <= job_id <= num_jobs, 'Invalid job_id: {}'.format(job_id)
     assert num_jobs >= 1, 'Invalid num_jobs: {}'.format(num_jobs)
-    image_paths = _get_image_paths(image_glob, shuffle=num_per_example == 1)
-    image_paths_per_job = iterable_ext.chunks(image_paths, num_chunks=num_jobs)
-    image_paths_current_job = iterable_ext.get_element_at(job_id - 1, image_paths_per_job)
+    if balance_jobs_by_bytes:
+        image_paths = _get_image_paths(image_glob, shuffle=num_per_example == 1, listing_cache_dir=listing_cache_dir)
+        image_paths_current_job = _partition_by_bytes(image_paths, _file_sizes(image_paths), num_jobs)[job_id - 1]
+    else:
+        image_paths_current_job = list(image_listing.iterate_images_of_job(
+            image_glob, job_id, num_jobs, contiguous=num_per_example > 1, cache_dir=listing_cache_dir))
+        assert len(image_paths_current_job) > 0, 'No images for job {} in {}'.format(job_id, image_glob)
     consecutive_frames_paths = list(iterate_in_consecutive_frame_tuples(
-        image_paths_current_job, num_consecutive=num_per_example))
+        image_paths_current_job, num_consecutive=num_per_example, stride=frame_stride))
     _shuffle_in_place(consecutive_frames_paths)
-    feature_dicts = wrap_frames_in_feature_dicts(consecutive_frames_paths, feature_key=feature_key)
 
     out_dir_job = out_dir if num_jobs == 1 else path.join(out_dir, '{}{}'.format(_JOB_SUBDIR_PREFIX, job_id))
-    create_records_with_feature_dicts(feature_dicts, out_dir_job, num_per_shard)
+    if num_workers:
+        create_records_in_parallel(consecutive_frames_paths, out_dir_job, num_per_shard, feature_key, num_workers,
+                                   num_io_threads, target_bytes_per_shard=target_bytes_per_shard,
+                                   record_compression=record_compression)
+        return
+    feature_dicts = wrap_frames_in_feature_dicts(consecutive_frames_paths, feature_key=feature_key)
+    create_records_with_feature_dicts(feature_dicts, out_dir_job, num_per_shard,
+                                      target_bytes_per_shard=target_bytes_per_shard,
+                                      record_compression=record_compression)
+
+
+def _file_sizes(paths, num_threads=16):
+    """ Stat pass over paths, with num_threads threads, for slow (network) file systems """
+    with futures.ThreadPoolExecutor(num_threads) as pool:
+        return list(pool.map(os.path.getsize, paths))
+
+
+def _partition_by_bytes(items, sizes, num_parts):
+    """ Split items into num_parts consecutive lists of about the same total size """
+    parts = [[] for _ in range(num_parts)]
+    total = max(1, sum(sizes))
+    start = 0
+    for item, size in zip(items, sizes):
+        parts[min(num_parts - 1, start * num_parts // total)].append(item)
+        start += size
+    return parts
+
+
+def _split_into_shards(sizes, num_per_shard, target_bytes_per_shard=None):
+    """ :return: list of (start, end) of the examples of each shard, cut as in create_records_with_feature_dicts """
+    if not target_bytes_per_shard:
+        return [(start, min(start + num_per_shard, len(sizes))) for start in range(0, len(sizes), num_per_shard)]
+    bounds = []
+    start = 0
+    bytes_in_shard = 0
+    for i, size in enumerate(sizes):
+        record_bytes = size + record_index.RECORD_OVERHEAD
+        if i > start and bytes_in_shard + record_bytes > target_bytes_per_shard:
+            bounds.append((start, i))
+            start = i
+            bytes_in_shard = 0
+        bytes_in_shard += record_bytes
+    if start < len(sizes):
+        bounds.append((start, len(sizes)))
+    return bounds
+
+
+def create_records_in_parallel(frame_paths, out_dir, num_per_shard, feature_key, num_workers, num_io_threads=8,
+                               file_name='shard', target_bytes_per_shard=None, record_compression=None):
+    """
+    Like create_records_with_feature_dicts(wrap_frames_in_feature_dicts(frame_paths, feature_key), ...), on a single
+    machine: num_workers processes each write one shard at a time, reading the images with num_io_threads threads.
+    Shard i always holds examples [i * num_per_shard, (i + 1) * num_per_shard) of frame_paths, so the shards are the
+    same as with the sequential writer, and no join is needed. With target_bytes_per_shard, shards are cut up front
+    from the file sizes, which are slightly smaller than the serialized examples.
+    :param frame_paths: list of lists of paths, the images of each example
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    sizes = [0] * len(frame_paths)
+    if target_bytes_per_shard:
+        file_sizes = iter(_file_sizes([p for paths in frame_paths for p in paths]))
+        sizes = [sum(next(file_sizes) for _ in paths) for paths in frame_paths]
+    shards = [(path.join(out_dir, _records_file_name(file_name, shard_number)),
+               frame_paths[start:end], feature_key, num_io_threads, record_compression)
+              for shard_number, (start, end) in enumerate(
+                  _split_into_shards(sizes, num_per_shard, target_bytes_per_shard))]
+    if not shards:
+        print('Nothing written...')
+        return
+    for record_p, _, _, _, _ in shards:
+        assert not path.exists(record_p), 'Record already exists! {}'.format(record_p)
+    print('Writing {} examples to {} shards with {} processes...'.format(len(frame_paths), len(shards), num_workers))
+    with futures.ProcessPoolExecutor(num_workers) as pool:
+        for record_p, count in pool.map(_write_shard, shards):
+            print('Created {} ({} examples)'.format(record_p, count))
+
+
+def _read_files(paths):
+    contents = []
+    for p in paths:
+        with open(p, 'rb') as f:
+            contents.append(f.read())
+    return contents
+
+
+def _write_shard(args):
+    """ Runs in a worker process of create_records_in_parallel. :return: (path of the shard, number of examples) """
+    record_p, frame_paths, feature_key, num_io_threads, record_compression = args
+    index_writer = record_index.IndexWriter(record_p)
+    keys = None
+    with futures.ThreadPoolExecutor(num_io_threads) as io_pool, _record_writer(record_p, record_compression) as writer:
+        for frames in io_pool.map(_read_files, frame_paths):
+            if not keys:
+                keys = keys_for_num_frames_per_example(len(frames), feature_key)
+            feature = {key: bytes_feature(b) for key, b in zip(keys, frames)}
+            serialized = tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+            writer.write(serialized)
+            index_writer.add(len(serialized))
+    index_writer.close()
+    return record_p, len(frame_paths)
+
+
+def create_images_records_incremental(image_glob, out_dir, num_per_shard, num_per_example, feature_key,
+                                      num_workers=None, num_io_threads=8, target_bytes_per_shard=None,
+                                      file_name='shard', listing_cache_dir=None, frame_stride=None,
+                                      record_compression=None):
+    """
+    Add the images of image_glob that are not in the records of out_dir yet as new shards, see image_manifest.py.
+    Incomplete shards of a previous run are removed first, and written again.
+    :param num_workers: if given, write this many shards at once, as in create_records_in_parallel
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = image_manifest.Manifest(out_dir)
+    existing = sorted(glob.glob(path.join(out_dir, '*.{}'.format(_TF_RECORD_EXT))))
+    assert manifest.exists() or not existing, '{} has records without {}, i.e., not created incrementally'.format(
+        out_dir, image_manifest.MANIFEST_FILE_NAME)
+    manifest.create()  # before any shard, so that a run that crashes before completing one can be resumed
+    for record_p in existing:
+        if path.basename(record_p) not in manifest.shards:
+            print('Removing incomplete {}...'.format(record_p))
+            os.remove(record_p)
+            if record_index.has_index(record_p):
+                os.remove(record_index.index_path(record_p))
+
+    image_paths = _get_image_paths(image_glob, shuffle=False, listing_cache_dir=listing_cache_dir)
+    new_images, num_duplicates = manifest.find_new_images(image_paths)
+    print('{} images: {} new, {} duplicates, {} already ingested, into {} shards'.format(
+        len(image_paths), len(new_images), num_duplicates, len(image_paths) - len(new_images) - num_duplicates,
+        len(manifest.shards)))
+    images = {image[0]: image for image in new_images}
+    frame_paths = list(iterate_in_consecutive_frame_tuples([image[0] for image in new_images], num_per_example,
+                                                           stride=frame_stride))
+    used = {p for paths in frame_paths for p in paths}
+    unused = [image for image in new_images if image[0] not in used]
+    if unused:
+        print('{} new images are in no tuple of {} consecutive frames, skipping them'.format(
+            len(unused), num_per_example))
+        manifest.add_skipped(unused)  # not hashed again, and never added, even if later frames complete a tuple
+    _shuffle_in_place(frame_paths)
+    sizes = [sum(images[p][1] for p in paths) for paths in frame_paths]
+    shards = [(path.join(out_dir, _records_file_name(file_name, shard_number)), frame_paths[start:end],
+               feature_key, num_io_threads, record_compression)
+              for shard_number, (start, end) in enumerate(
+                  _split_into_shards(sizes, num_per_shard, target_bytes_per_shard), start=len(manifest.shards))]
+    if not shards:
+        print('Nothing written...')
+        return
+    with futures.ProcessPoolExecutor(num_workers or 1) as pool:
+        # pool.map returns in order, so the manifest only ever lists a prefix of the shards
+        for (record_p, count), (_, shard_frame_paths, _, _, _) in zip(pool.map(_write_shard, shards), shards):
+            shard_paths = collections.OrderedDict.fromkeys(p for paths in shard_frame_paths for p in paths)
+            manifest.add_shard(path.basename(record_p), [images[p] for p in shard_paths])  # once, even if overlapping
+            print('Created {} ({} examples)'.format(record_p, count))
 
 
 def join_created_images_records(out_dir, num_jobs):
@@ -53,6 +243,8 @@ def join_created_images_records(out_dir, num_jobs):
     for shard_number, records_p in enumerate(printing.ProgressPrinter('Moving records...', iter_list=records)):
         target_p = path.join(out_dir, _records_file_name(base_records_file_name, shard_number))
         os.rename(records_p, target_p)
+        if record_index.has_index(records_p):
+            os.rename(record_index.index_path(records_p), record_index.index_path(target_p))
 
     print('Removing empty job dirs...')
     list(map(os.removedirs, jobs_dirs))  # remove all job dirs, which are now empty
@@ -64,11 +256,63 @@ def join_created_images_records(out_dir, num_jobs):
 
 
 def _number_of_examples_in_record(p):
-    return sum(1 for _ in tf.python_io.tf_record_iterator(p))
+    if record_index.has_index(p):
+        return record_index.count(p)
+    return record_reader.count_records(p)
+
+
+def build_indices(records_glob, missing_only=False):
+    """ (Re)build the index of every record matching records_glob """
+    records_paths = sorted(glob.glob(records_glob))
+    assert records_paths, 'Did not find any records matching {}'.format(records_glob)
+    for p in records_paths:
+        if missing_only and record_index.has_index(p):
+            continue
+        print('{}: {} examples'.format(path.basename(p), record_index.build_index(p)))
+
+
+@functools_ext.print_generator()
+def count_examples(records_glob):
+    """ Count the examples of all records matching records_glob from their indices, reading those without one """
+    num_examples = 0
+    for p in sorted(glob.glob(records_glob)):
+        count = _number_of_examples_in_record(p)
+        num_examples += count
+        yield '{}: {}'.format(path.basename(p), count)
+    yield 'Found {} examples in total'.format(num_examples)
 
 
-def _get_image_paths(image_glob, shuffle):
-    paths = sorted(glob.glob(image_glob))
+def get_example(records_glob, i):
+    """
+    :return: example i of all records matching records_glob, in sorted order, using their indices, as dict of
+    feature key -> list of values
+    """
+    for p in sorted(glob.glob(records_glob)):
+        if not record_index.has_index(p):
+            record_index.build_index(p)
+        index = record_index.read_index(p)
+        if i < len(index):
+            return record_reader.parse_example(record_index.read_example(p, i, index))
+        i -= len(index)
+    raise IndexError('Example index out of range')
+
+
+@functools_ext.print_generator()
+def show_example(records_glob, i, save_key=None, out_path=None):
+    example = get_example(records_glob, i)
+    for key, values in sorted(example.items()):
+        if values and isinstance(values[0], bytes):
+            yield '{}: {} bytes'.format(key, [len(v) for v in values])
+        else:
+            yield '{}: {}'.format(key, values)
+    if save_key:
+        with open(out_path, 'wb') as f:
+            f.write(example[save_key][0])
+        yield 'Saved {} to {}'.format(save_key, out_path)
+
+
+def _get_image_paths(image_glob, shuffle, listing_cache_dir=None):
+    paths = list(image_listing.iterate_images(image_glob, listing_cache_dir))
     assert len(paths) > 0, 'No matches for glob {}'.format(image_glob)
     if shuffle:
         _shuffle_in_place(paths)
@@ -79,35 +323,75 @@ def _shuffle_in_place(paths):
     random.Random(6).shuffle(paths)  # shuffle deterministically, so that the returned list is consistent between jobs
 
 
-def iterate_in_consecutive_frame_tuples(frame_paths, num_consecutive, frame_id_regex=_FRAME_ID_REGEX):
+def iterate_in_consecutive_frame_tuples(frame_paths, num_consecutive, frame_id_regex=_FRAME_ID_REGEX, stride=None):
+    """
+    :param frame_paths: paths of frames, matching frame_id_regex, in any order
+    :param stride: distance between the first frames of consecutive tuples of a sequence, defaults to num_consecutive,
+    i.e., no overlap
+    :return: generator of lists of the paths of num_consecutive consecutive frames of the same sequence. Gaps in a
+    sequence only drop the frames that do not fit into a tuple before or after them.
+    """
     if num_consecutive == 1:
         yield from ([p] for p in frame_paths)
         return
+    stride = stride or num_consecutive
+    sequences = index_frame_sequences(frame_paths, frame_id_regex)
+    print(frame_sequences_report(sequences, num_consecutive, stride))
+    for base in sorted(sequences):
+        ids, paths = sequences[base]
+        for run_start, run_end in _consecutive_runs(ids):
+            for start in range(run_start, run_end - num_consecutive + 1, stride):
+                yield paths[start:start + num_consecutive]
 
-    pat = re.compile(frame_id_regex)
 
-    def _get_path_base_id(p):
+def index_frame_sequences(frame_paths, frame_id_regex=_FRAME_ID_REGEX):
+    """
+    Parse each path once, and group the frames by sequence, i.e., by the path without the frame id.
+    :return: dict base -> (sorted int64 array of frame ids, list of paths in the same order)
+    """
+    pat = re.compile(frame_id_regex)
+    ids_per_base = collections.defaultdict(list)
+    paths_per_base = collections.defaultdict(list)
+    for p in frame_paths:
         m = pat.search(p)
         if not m:
             raise ValueError('Regex did not match: {} not in {}'.format(frame_id_regex, p))
         p_base, p_id = m.group(1, 2)
-        return p_base, p_id
-
-    for image_paths_slice in iterable_ext.sliced_iter(
-            frame_paths, slice_len=num_consecutive, allow_smaller_final_slice=False):
-        # image_paths_slice is a list of paths
-        image_paths_slice_it = iter(image_paths_slice)
-        p0 = next(image_paths_slice_it)
-        p_0_base, p_0_id = _get_path_base_id(p0)
-        p_prev_id = p_0_id
-        for p_cur in image_paths_slice_it:
-            p_cur_base, p_cur_id = _get_path_base_id(p_cur)
-            if p_0_base != p_cur_base or int(p_prev_id) + 1 != int(p_cur_id):
-                tf.logging.info('Non consequtive paths found in {}'.format(image_paths_slice))
-                break
-            p_prev_id = p_cur_id
-        else:  # no-break, i.e., all consequtive
-            yield image_paths_slice
+        ids_per_base[p_base].append(int(p_id))
+        paths_per_base[p_base].append(p)
+    sequences = {}
+    for p_base, ids in ids_per_base.items():
+        ids = np.array(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        paths = paths_per_base[p_base]
+        sequences[p_base] = ids[order], [paths[i] for i in order]
+    return sequences
+
+
+def _consecutive_runs(ids):
+    """ :return: list of (start, end) of the runs of consecutive ids in the sorted array ids """
+    breaks = (np.flatnonzero(np.diff(ids) != 1) + 1).tolist()
+    return list(zip([0] + breaks, breaks + [len(ids)]))
+
+
+def frame_sequences_report(sequences, num_consecutive, stride, max_gaps=10):
+    """ :return: summary of the tuples of the sequences of index_frame_sequences, with the first max_gaps gaps """
+    gaps = []
+    num_frames = num_tuples = num_used = 0
+    for base in sorted(sequences):
+        ids, _ = sequences[base]
+        runs = _consecutive_runs(ids)
+        num_frames += len(ids)
+        gaps += ['{}: {} -> {}'.format(base, ids[end - 1], ids[start]) for (_, end), (start, _) in zip(runs, runs[1:])]
+        for run_start, run_end in runs:
+            if run_end - run_start >= num_consecutive:
+                run_tuples = (run_end - run_start - num_consecutive) // stride + 1
+                num_tuples += run_tuples
+                num_used += min(run_tuples * num_consecutive, (run_tuples - 1) * stride + num_consecutive)
+    lines = ['{} sequences, {} frames, {} gaps: {} tuples of {} frames with stride {}, {} frames unused'.format(
+        len(sequences), num_frames, len(gaps), num_tuples, num_consecutive, stride, num_frames - num_used)]
+    lines += gaps[:max_gaps] + (['...'] if len(gaps) > max_gaps else [])
+    return '\n'.join(lines)
 
 
 def wrap_frames_in_feature_dicts(frame_paths, feature_key):
@@ -142,57 +426,191 @@ def int64_feature(i):
     return tf.train.Feature(int64_list=tf.train.Int64List(value=[i]))
 
 
-def create_records_with_feature_dicts(feature_dicts, out_dir, num_per_shard, max_shards=None, file_name='shard'):
+def int64_list_feature(values):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
+
+
+def create_records_with_feature_dicts(feature_dicts, out_dir, num_per_shard, max_shards=None, file_name='shard',
+                                      target_bytes_per_shard=None, record_compression=None):
     """
     :param feature_dicts: iterator yielding dictionaries with tf.train.Feature as values, to encode as features
     :param out_dir:
-    :param num_per_shard:
+    :param num_per_shard: number of examples per shard, ignored if target_bytes_per_shard is given
     :param file_name:
+    :param target_bytes_per_shard: if given, start a new shard before it would grow beyond this size, counted
+    uncompressed
+    :param record_compression: if given, 'gzip' or 'zlib', to compress the record files, see _record_options
     :return:
     """
     os.makedirs(out_dir, exist_ok=True)
     writer = None
+    index_writer = None
+    shard_number = -1
+    num_in_shard = bytes_in_shard = 0
     with printing.ProgressPrinter() as progress_printer:
-        for count, feature in enumerate(feature_dicts):
-            if count % num_per_shard == 0:
+        for feature in feature_dicts:
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            serialized = example.SerializeToString()
+            record_bytes = len(serialized) + record_index.RECORD_OVERHEAD
+            if target_bytes_per_shard:
+                shard_full = num_in_shard > 0 and bytes_in_shard + record_bytes > target_bytes_per_shard
+            else:
+                shard_full = num_in_shard == num_per_shard
+            if writer is None or shard_full:
                 progress_printer.finish_line()
                 if writer:
                     writer.close()
-                shard_number = count // num_per_shard
+                    index_writer.close()
+                shard_number += 1
                 if max_shards is not None and shard_number == max_shards:
                     print('Created {} shards...'.format(max_shards))
                     return
                 record_p = path.join(out_dir, _records_file_name(file_name, shard_number))
                 assert not path.exists(record_p), 'Record already exists! {}'.format(record_p)
                 print('Creating {}...'.format(record_p))
-                writer = tf.python_io.TFRecordWriter(record_p)
-            example = tf.train.Example(features=tf.train.Features(feature=feature))
-            writer.write(example.SerializeToString())
-            progress_printer.update((count % num_per_shard) / num_per_shard)
+                writer = _record_writer(record_p, record_compression)
+                index_writer = record_index.IndexWriter(record_p)
+                num_in_shard = bytes_in_shard = 0
+            writer.write(serialized)
+            index_writer.add(len(serialized))
+            num_in_shard += 1
+            bytes_in_shard += record_bytes
+            progress_printer.update(min(1., bytes_in_shard / target_bytes_per_shard) if target_bytes_per_shard
+                                    else num_in_shard / num_per_shard)
     if writer:
         writer.close()
+        index_writer.close()
     else:
         print('Nothing written...')
 
 
-def create_record(in_paths, out_record_path, key=_DEFAULT_FEATURE_KEY, assert_size=None):
-    with tf.python_io.TFRecordWriter(out_record_path) as writer:
-        print('Writing {} images to {}...'.format(len(in_paths), out_record_path))
-        for p in in_paths:
-            if assert_size:
-                w, h = Image.open(p).size
-                assert w >= assert_size and h >= assert_size
-            feature_dict = {key: bytes_feature(open(p, 'rb').read()),
-                            'image/label': bytes_feature(open("/mnt/disks/disk2/ae_out/label" + p[1:], 'rb').read()),
-                            'image/filename': bytes_feature(tf.compat.as_bytes(os.path.basename(p)))}
+def create_record(in_paths, out_record_path, key=_DEFAULT_FEATURE_KEY, assert_size=None, input_root='.',
+                  label_root=_DEFAULT_LABEL_ROOT, num_io_threads=8, record_compression=None):
+    """ Write all images of in_paths with their labels, see pair_with_labels, to the single record out_record_path """
+    pairs = pair_with_labels(in_paths, input_root, label_root)
+    index_writer = record_index.IndexWriter(out_record_path)
+    with _record_writer(out_record_path, record_compression) as writer:
+        print('Writing {} images to {}...'.format(len(pairs), out_record_path))
+        for feature_dict in iterate_paired_feature_dicts(pairs, key, assert_size, num_io_threads):
             example = tf.train.Example(features=tf.train.Features(feature=feature_dict))
-            writer.write(example.SerializeToString())
+            serialized = example.SerializeToString()
+            writer.write(serialized)
+            index_writer.add(len(serialized))
+    index_writer.close()
+
+
+def create_paired_records(image_glob, out_dir, num_per_shard, input_root, label_root, key='image/encoded',
+                          assert_size=None, num_io_threads=8, target_bytes_per_shard=None, record_compression=None,
+                          file_name='shard'):
+    """
+    Make shards of examples with an input image at key and its label at 'image/label', as read by gan.py and AEGAN.py.
+    The shards are named FILE_NAME_XXXXXXXX.tfrecord.
+    :param image_glob: input images, all below input_root
+    :param label_root: the label of input_root/P is label_root/P
+    """
+    pairs = pair_with_labels(_get_image_paths(image_glob, shuffle=True), input_root, label_root)
+    feature_dicts = iterate_paired_feature_dicts(pairs, key, assert_size, num_io_threads)
+    create_records_with_feature_dicts(feature_dicts, out_dir, num_per_shard, file_name=file_name,
+                                      target_bytes_per_shard=target_bytes_per_shard,
+                                      record_compression=record_compression)
+
+
+def pair_with_labels(in_paths, input_root, label_root, num_threads=16):
+    """ :return: list of (input path, label path). Fails before anything is written if any label is missing. """
+    label_paths = [path.join(label_root, path.relpath(p, input_root)) for p in in_paths]
+    with futures.ThreadPoolExecutor(num_threads) as pool:
+        missing = [p for p, exists in zip(label_paths, pool.map(path.isfile, label_paths)) if not exists]
+    assert not missing, '{} of {} labels missing, e.g. {}'.format(len(missing), len(label_paths), missing[:5])
+    return list(zip(in_paths, label_paths))
+
+
+def iterate_paired_feature_dicts(pairs, key, assert_size=None, num_io_threads=8):
+    """ Reads input and label of each pair with num_io_threads threads. :return: generator of feature dicts """
+    with futures.ThreadPoolExecutor(num_io_threads) as io_pool:
+        for (in_path, _), (image, label) in zip(pairs, _map_ahead(io_pool, _read_files, pairs, 4 * num_io_threads)):
+            if assert_size:
+                w, h = Image.open(io.BytesIO(image)).size  # only parses the header
+                assert w >= assert_size and h >= assert_size, 'Too small: {} ({}x{})'.format(in_path, w, h)
+            yield {key: bytes_feature(image),
+                   'image/label': bytes_feature(label),
+                   'image/filename': bytes_feature(os.path.basename(in_path).encode())}
+
+
+def _map_ahead(pool, fn, items, max_pending):
+    """ Like pool.map, in order, but with at most max_pending results in memory """
+    pending = collections.deque()
+    for item in items:
+        if len(pending) == max_pending:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def create_raw_records(records_glob, out_dir, num_per_shard, image_keys=('image/encoded',), crop_size=None,
+                       crops_per_image=1, compression='none', copy_keys=('image/filename',), record_compression=None):
+    """
+    Convert records of encoded images into records of pre-decoded uint8 images, to be read with
+    input_pipeline.get_raw_dataset without any decoding on the training path.
+    :param image_keys: keys of the encoded images. The images of an example are cropped at the same location.
+    :param crop_size: if given, store crops_per_image random crops of crop_size x crop_size of each example.
+    Otherwise, all images are stored whole, and need to have the same shape.
+    :param compression: one of _RAW_COMPRESSIONS, of each image
+    :param copy_keys: keys of features that are copied unchanged, if present
+    :param record_compression: if given, 'gzip' or 'zlib', to compress the record files, see _record_options
+    """
+    assert compression in _RAW_COMPRESSIONS, 'Invalid compression: {}'.format(compression)
+    records_paths = sorted(glob.glob(records_glob))
+    assert records_paths, 'Did not find any records matching {}'.format(records_glob)
+    rnd = random.Random(6)  # crop deterministically
+    shapes = set()
+
+    def _raw_feature(img):
+        raw = img.tobytes()
+        return bytes_feature(zlib.compress(raw, 1) if compression == 'zlib' else raw)
+
+    def _feature_dicts():
+        for records_p in records_paths:
+            options = _record_options(record_reader.detect_compression(records_p))
+            for example in map(tf.train.Example.FromString, tf.python_io.tf_record_iterator(records_p, options)):
+                features = example.features.feature
+                imgs = [np.array(Image.open(io.BytesIO(features[key].bytes_list.value[0])).convert('RGB'))
+                        for key in image_keys]
+                h, w = imgs[0].shape[:2]
+                for _ in range(crops_per_image if crop_size else 1):
+                    if crop_size:
+                        top, left = rnd.randint(0, h - crop_size), rnd.randint(0, w - crop_size)
+                        imgs_out = [img[top:top + crop_size, left:left + crop_size] for img in imgs]
+                    else:
+                        imgs_out = imgs
+                    shapes.update(img.shape for img in imgs_out)
+                    assert len(shapes) == 1, 'Images of different shapes, use crop_size: {}'.format(shapes)
+                    feature = {key + _RAW_SUFFIX: _raw_feature(img) for key, img in zip(image_keys, imgs_out)}
+                    feature['image/shape'] = int64_list_feature(imgs_out[0].shape)
+                    feature.update({key: features[key] for key in copy_keys if key in features})
+                    yield feature
+
+    create_records_with_feature_dicts(_feature_dicts(), out_dir, num_per_shard, record_compression=record_compression)
+    print('Shape: {}, compression: {}'.format(shapes.pop() if shapes else None, compression))
 
 
 def _records_file_name(base_filename, shard_number):
     return '{}_{:08d}.{}'.format(base_filename, shard_number, _TF_RECORD_EXT)
 
 
+def _record_options(compression):
+    """
+    :param compression: None, 'none', 'gzip' or 'zlib', or '', 'GZIP' or 'ZLIB' as from record_reader.detect_compression
+    """
+    return tf.python_io.TFRecordOptions(
+            getattr(tf.python_io.TFRecordCompressionType, (compression or 'none').upper()))
+
+
+def _record_writer(record_p, compression=None):
+    """ Compressed records are smaller on disk, but need CPU to decompress. Readers detect the compression. """
+    return tf.python_io.TFRecordWriter(record_p, _record_options(compression))
+
+
 def feature_to_image(feature):
     """ Use case: feature_to_img(read_records(...)) """
     im = tf.image.decode_image(feature, channels=3)
@@ -206,18 +624,76 @@ def features_to_images(features):
     return tf.stack([feature_to_image(feature) for feature in features], axis=0)
 
 
-def extract_images(records_glob, max_images, out_dir, feature_key=_DEFAULT_FEATURE_KEY):
-    tf.logging.set_verbosity(tf.logging.INFO)
-    image = feature_to_image(read_records(records_glob, num_epochs=1, shuffle=False, feature_key=feature_key))
-    image = tf.expand_dims(image, axis=0)  # make 'batched'
-    index_iterator = range(max_images) if max_images else itertools.count()
-    img_names_iterator = map('img_{:010d}'.format, index_iterator)
-    img_saver = tf_helpers.ImageSaver(out_dir)
-    with tf_helpers.start_queues_in_sess() as (sess, coord):
-        img_fetcher = sess.make_callable(img_saver.get_fetch_dict(image))
-        for img_name in img_names_iterator:
-            tf.logging.info('Saving {}...'.format(img_name))
-            img_saver.save(img_fetcher(), img_names=[img_name])
+def extract_images(records_glob, max_images, out_dir, feature_key=_DEFAULT_FEATURE_KEY, every_nth=None,
+                   sample_fraction=None, batch_size=64, num_writers=8):
+    """
+    Save the images of the examples in records_glob to out_dir, as img_I.png, where I is the index of the example.
+    :param every_nth: if given, only the examples 0, N, 2N, ...
+    :param sample_fraction: if given, only a random sample of about this fraction of the examples
+    """
+    names = ['img_{:010d}.png']
+    _save_examples(records_glob, out_dir, [feature_key], names, max_images, every_nth, sample_fraction, batch_size,
+                   num_writers)
+
+
+def check(records_glob, out_dir, num_imgs_to_save, num_per_ex, every_nth=None, sample_fraction=None, batch_size=64,
+          num_writers=8):
+    """ Save the frames of num_imgs_to_save examples with num_per_ex frames each, as I_F.png, for frame F of example I """
+    keys = keys_for_num_frames_per_example(num_per_ex, _DEFAULT_FEATURE_KEY)
+    names = ['{{:02d}}_{:02d}.png'.format(ex) for ex in range(num_per_ex)]
+    _save_examples(records_glob, out_dir, keys, names, num_imgs_to_save, every_nth, sample_fraction, batch_size,
+                   num_writers)
+
+
+def read_dataset(records_glob, keys, every_nth=None, sample_fraction=None, batch_size=64, max_examples=None):
+    """
+    Batched tf.data reader of the examples of records_glob, in order.
+    :return: dataset of (indices of the examples [B], dict key -> encoded images [B]), see extract_images for the
+    sampling options
+    """
+    records_paths = sorted(glob.glob(records_glob))
+    assert records_paths, 'Did not find any records matching {}'.format(records_glob)
+    dataset = tf.data.TFRecordDataset(records_paths, record_reader.detect_compression(records_paths[0]),
+                                      buffer_size=8 * 2 ** 20)
+    dataset = dataset.apply(tf.contrib.data.enumerate_dataset())
+    if every_nth:
+        dataset = dataset.filter(lambda i, _: tf.equal(i % every_nth, 0))
+    if sample_fraction:
+        dataset = dataset.filter(lambda i, _: tf.random_uniform([], seed=6) < sample_fraction)
+    if max_examples:
+        dataset = dataset.take(max_examples)
+    features_dict = {key: tf.FixedLenFeature([], tf.string) for key in keys}
+    dataset = dataset.batch(batch_size).map(lambda i, serialized: (i, tf.parse_example(serialized, features_dict)))
+    return dataset.prefetch(2)
+
+
+def _save_examples(records_glob, out_dir, keys, names, max_examples, every_nth, sample_fraction, batch_size,
+                   num_writers):
+    """ Save feature keys[j] of each example i to out_dir/names[j].format(i), with num_writers threads """
+    os.makedirs(out_dir, exist_ok=True)
+    dataset = read_dataset(records_glob, keys, every_nth, sample_fraction, batch_size, max_examples)
+    next_batch = dataset.make_one_shot_iterator().get_next()
+    num_saved = 0
+    with tf.Session() as sess, futures.ThreadPoolExecutor(num_writers) as pool:
+        pending = collections.deque()
+        while True:
+            try:
+                indices, features = sess.run(next_batch)
+            except tf.errors.OutOfRangeError:
+                break
+            for key, name in zip(keys, names):
+                for i, encoded in zip(indices, features[key]):
+                    pending.append(pool.submit(_save_image, encoded, path.join(out_dir, name.format(i))))
+            while len(pending) > 4 * batch_size * len(keys):
+                pending.popleft().result()
+            num_saved += len(indices)
+            print('Saved {} examples...'.format(num_saved))
+        for f in pending:
+            f.result()
+
+
+def _save_image(encoded, out_p):
+    Image.open(io.BytesIO(encoded)).convert('RGB').save(out_p)
 
 
 def read_records(records_glob, num_epochs=None, shuffle=True, feature_key=_DEFAULT_FEATURE_KEY, num_per_ex=1):
@@ -227,9 +703,9 @@ def read_records(records_glob, num_epochs=None, shuffle=True, feature_key=_DEFAU
 
 
 def read_records_with_features_dict(records_glob, features_dict, num_epochs=None, shuffle=True):
-    reader = tf.TFRecordReader()
     records_paths = glob.glob(records_glob)
     assert records_paths, 'Did not find any records matching {}'.format(records_glob)
+    reader = tf.TFRecordReader(options=_record_options(record_reader.detect_compression(records_paths[0])))
     if not shuffle:
         records_paths = sorted(records_paths)
 
@@ -238,20 +714,8 @@ def read_records_with_features_dict(records_glob, features_dict, num_epochs=None
     return tf.parse_single_example(serialized_example, features=features_dict)
 
 
-def check(records_glob, out_dir, num_imgs_to_save, num_per_ex):
-    features = read_records(records_glob, num_per_ex=num_per_ex)
-    imgs = features_to_images(features)
-    imsaver = tf_helpers.ImageSaver(out_dir)
-    imsaver_fetch = imsaver.get_fetch_dict(imgs)
-    with tf_helpers.start_queues_in_sess() as (sess, _):
-        for run in range(num_imgs_to_save):
-            print('Run {}...'.format(run))
-            imsaver.save(sess.run(imsaver_fetch),
-                         img_names=['{:02d}_{:02d}.png'.format(run, ex) for ex in range(num_per_ex)])
-
-
 @functools_ext.print_generator()
-def inspect(records_glob):
+def inspect(records_glob, check_crc=False):
     all_keys = set()
     num_examples = 0
     for rec in sorted(glob.glob(records_glob)):
@@ -260,8 +724,8 @@ def inspect(records_glob):
         yield 'Iterating {}...'.format(rec)
 
         for count, example in enumerate(
-                map(tf.train.Example.FromString, tf.python_io.tf_record_iterator(rec))):
-            rec_keys.update(set(example.features.feature))
+                map(record_reader.parse_example, record_reader.iterate_records(rec, check_crc))):
+            rec_keys.update(set(example))
         count += 1
 
         num_examples += count
@@ -275,6 +739,25 @@ def inspect(records_glob):
     yield from all_keys
 
 
+def _add_sampling_arguments(parser):
+    parser_sample = parser.add_mutually_exclusive_group()
+    parser_sample.add_argument('--every_nth', type=int, metavar='N', help='Only save examples 0, N, 2N, ...')
+    parser_sample.add_argument('--sample', type=float, metavar='FRACTION',
+                               help='Only save a random sample of about FRACTION of the examples.')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_writers', type=int, default=8, help='Number of threads writing images.')
+
+
+def _add_record_compression_argument(parser):
+    parser.add_argument('--record_compression', type=str, choices=_RECORD_COMPRESSIONS, default='none',
+                        help='Compression of the record files. Readers detect it. See '
+                             'util/bench_record_compression.py for the trade-off.')
+
+
+def _mb_to_bytes(mb):
+    return int(mb * 2 ** 20) if mb else None
+
+
 def main(args):
     parser = argparse.ArgumentParser()
     mode_subparsers = parser.add_subparsers(dest='mode', title='Mode')
@@ -283,15 +766,54 @@ def main(args):
     parser_make_single.add_argument('paths', type=str, nargs='+')
     parser_make_single.add_argument('--out_record_path', '-o', type=str, required=True)
     parser_make_single.add_argument('--feature_key', type=str, default=_DEFAULT_FEATURE_KEY)
-    parser_make_single.add_argument('--assert_size', metavar='LENGTH', type=str,
+    parser_make_single.add_argument('--assert_size', metavar='LENGTH', type=int,
+                                    help='If given, assert that for each image, width >= LENGTH and height >= LENGTH.')
+    parser_make_single.add_argument('--input_root', type=str, default='.')
+    parser_make_single.add_argument('--label_root', type=str, default=_DEFAULT_LABEL_ROOT)
+    _add_record_compression_argument(parser_make_single)
+    # Make paired image records ---
+    parser_make_paired = mode_subparsers.add_parser(
+            'mk_paired_recs',
+            help='Make TF records of pairs of images, INPUT_ROOT/P as --feature_key and LABEL_ROOT/P as image/label, '
+                 'for gan.py and AEGAN.py.')
+    parser_make_paired.add_argument('out_dir', type=str)
+    parser_make_paired.add_argument('image_glob', type=str)
+    parser_make_paired.add_argument('--input_root', type=str, required=True)
+    parser_make_paired.add_argument('--label_root', type=str, required=True)
+    parser_make_paired_shard_size = parser_make_paired.add_mutually_exclusive_group(required=True)
+    parser_make_paired_shard_size.add_argument('--num_per_shard', type=int)
+    parser_make_paired_shard_size.add_argument('--target_shard_mb', type=float,
+                                               help='Cut shards by size, at about TARGET_SHARD_MB each, instead.')
+    parser_make_paired.add_argument('--feature_key', type=str, default='image/encoded')
+    parser_make_paired.add_argument('--assert_size', metavar='LENGTH', type=int,
                                     help='If given, assert that for each image, width >= LENGTH and height >= LENGTH.')
+    parser_make_paired.add_argument('--num_io_threads', type=int, default=8)
+    parser_make_paired.add_argument('--file_name', type=str, default='shard',
+                                    help='Shards are named FILE_NAME_XXXXXXXX.tfrecord.')
+    _add_record_compression_argument(parser_make_paired)
     # Make image records ---
     parser_make = mode_subparsers.add_parser('mk_img_recs', help='Make TF records from images.')
     parser_make.add_argument('out_dir', type=str)
     parser_make.add_argument('image_glob', type=str)
-    parser_make.add_argument('--num_per_shard', type=int, required=True)
+    parser_make_shard_size = parser_make.add_mutually_exclusive_group(required=True)
+    parser_make_shard_size.add_argument('--num_per_shard', type=int)
+    parser_make_shard_size.add_argument('--target_shard_mb', type=float,
+                                        help='Cut shards by size, at about TARGET_SHARD_MB each, instead.')
     parser_make.add_argument('--num_per_ex', type=int, default=1)
+    parser_make.add_argument('--frame_stride', type=int,
+                             help='With --num_per_ex > 1, start an example every FRAME_STRIDE frames. Default: '
+                                  'NUM_PER_EX, i.e., examples do not overlap.')
     parser_make.add_argument('--feature_key', type=str, default=_DEFAULT_FEATURE_KEY)
+    parser_make.add_argument('--num_workers', type=int,
+                             help='If given, write this many shards at once, each in its own process.')
+    parser_make.add_argument('--num_io_threads', type=int, default=8,
+                             help='With --num_workers, number of threads reading images, per process.')
+    parser_make.add_argument('--listing_cache_dir', type=str,
+                             help='If given, cache the listing of IMAGE_GLOB there, see util/image_listing.py.')
+    parser_make.add_argument('--incremental', action='store_true',
+                             help='Only add images that are not in the records of OUT_DIR yet, as new shards, and '
+                                  'resume after a crash, using OUT_DIR/.manifest.jsonl.')
+    _add_record_compression_argument(parser_make)
     # Make image records, distributed ---
     parser_make_dist = mode_subparsers.add_parser(
             'mk_img_recs_dist',
@@ -302,9 +824,47 @@ def main(args):
     parser_make_dist.add_argument('image_glob', type=str)
     parser_make_dist.add_argument('--job_id', type=int, required=True)
     parser_make_dist.add_argument('--num_jobs', type=int, required=True)
-    parser_make_dist.add_argument('--num_per_shard', type=int, required=True)
+    parser_make_dist_shard_size = parser_make_dist.add_mutually_exclusive_group(required=True)
+    parser_make_dist_shard_size.add_argument('--num_per_shard', type=int)
+    parser_make_dist_shard_size.add_argument('--target_shard_mb', type=float,
+                                             help='Cut shards by size, at about TARGET_SHARD_MB each, instead.')
     parser_make_dist.add_argument('--num_per_ex', type=int, default=1)
+    parser_make_dist.add_argument('--frame_stride', type=int, help='See mk_img_recs.')
     parser_make_dist.add_argument('--feature_key', type=str, default=_DEFAULT_FEATURE_KEY)
+    parser_make_dist.add_argument('--balance_jobs_by_bytes', action='store_true',
+                                  help='Give each job the same number of bytes of images, from a stat pass, instead '
+                                       'of the same number of images.')
+    parser_make_dist.add_argument('--listing_cache_dir', type=str,
+                                  help='If given, cache the listing of IMAGE_GLOB there, see util/image_listing.py. '
+                                       'Run ls_imgs with it once before starting the jobs, so that they all read the '
+                                       'same listing.')
+    _add_record_compression_argument(parser_make_dist)
+    # Report frame sequences ---
+    parser_frames = mode_subparsers.add_parser(
+            'frames', help='Report the sequences, gaps and tuples of frames that mk_img_recs --num_per_ex would use.')
+    parser_frames.add_argument('image_glob', type=str)
+    parser_frames.add_argument('--num_per_ex', type=int, required=True)
+    parser_frames.add_argument('--frame_stride', type=int)
+    parser_frames.add_argument('--max_gaps', type=int, default=10, help='Number of gaps to show.')
+    # List images ---
+    parser_ls = mode_subparsers.add_parser('ls_imgs', help='List and count the images of IMAGE_GLOB, into a cache.')
+    parser_ls.add_argument('image_glob', type=str)
+    parser_ls.add_argument('--listing_cache_dir', type=str, required=True)
+    # Make pre-decoded image records ---
+    parser_make_raw = mode_subparsers.add_parser(
+            'mk_raw_recs',
+            help='Make TF records of pre-decoded, fixed size uint8 images from TF records of encoded images, to be '
+                 'read with input_pipeline.get_raw_dataset.')
+    parser_make_raw.add_argument('out_dir', type=str)
+    parser_make_raw.add_argument('records_glob', type=str)
+    parser_make_raw.add_argument('--num_per_shard', type=int, required=True)
+    parser_make_raw.add_argument('--image_keys', type=str, nargs='+', default=['image/encoded'])
+    parser_make_raw.add_argument('--crop_size', type=int,
+                                 help='If given, store random crops of CROP_SIZE x CROP_SIZE instead of whole images.')
+    parser_make_raw.add_argument('--crops_per_image', type=int, default=1)
+    parser_make_raw.add_argument('--compression', type=str, choices=_RAW_COMPRESSIONS, default='none',
+                                 help='Compression of each image.')
+    _add_record_compression_argument(parser_make_raw)
     # Join image records ---
     parser_join = mode_subparsers.add_parser('join')
     parser_join.add_argument('out_dir', type=str)
@@ -315,34 +875,85 @@ def main(args):
     parser_extract.add_argument('out_dir', type=str)
     parser_extract.add_argument('max_imgs', type=int)
     parser_extract.add_argument('--feature_key', type=str, default=_DEFAULT_FEATURE_KEY)
+    _add_sampling_arguments(parser_extract)
     # Inspect ---
     parser_inspect = mode_subparsers.add_parser('inspect')
     parser_inspect.add_argument('records_glob', type=str)
+    parser_inspect.add_argument('--check_crc', action='store_true', help='Check the CRCs of all records.')
+    # Indices ---
+    parser_index = mode_subparsers.add_parser('index', help='Build the offset index of existing records.')
+    parser_index.add_argument('records_glob', type=str)
+    parser_index.add_argument('--missing_only', action='store_true', help='Only build indices that do not exist.')
+    parser_count = mode_subparsers.add_parser('count', help='Count examples using the indices, where they exist.')
+    parser_count.add_argument('records_glob', type=str)
+    parser_get = mode_subparsers.add_parser('get', help='Show example I of the records, using the indices.')
+    parser_get.add_argument('records_glob', type=str)
+    parser_get.add_argument('i', type=int)
+    parser_get.add_argument('--save', type=str, nargs=2, metavar=('KEY', 'OUT_PATH'),
+                            help='Write the bytes of feature KEY to OUT_PATH.')
     #
     parser_check = mode_subparsers.add_parser('check', help='Check records with multiple examples, save images')
     parser_check.add_argument('records_glob', type=str)
     parser_check.add_argument('out_dir', type=str)
     parser_check.add_argument('num_imgs', type=int)
     parser_check.add_argument('num_per_ex', type=int)
+    _add_sampling_arguments(parser_check)
     # ---
     flags = parser.parse_args(args)
     if flags.mode == 'mk_img_rec':
-        create_record(flags.paths, flags.out_record_path, flags.feature_key, flags.assert_size)
+        create_record(flags.paths, flags.out_record_path, flags.feature_key, flags.assert_size, flags.input_root,
+                      flags.label_root, record_compression=flags.record_compression)
+    elif flags.mode == 'mk_paired_recs':
+        create_paired_records(flags.image_glob, flags.out_dir, flags.num_per_shard, flags.input_root, flags.label_root,
+                              flags.feature_key, flags.assert_size, flags.num_io_threads,
+                              _mb_to_bytes(flags.target_shard_mb), flags.record_compression, flags.file_name)
+    elif flags.mode == 'mk_img_recs' and flags.incremental:
+        create_images_records_incremental(flags.image_glob, flags.out_dir, flags.num_per_shard, flags.num_per_ex,
+                                          flags.feature_key, flags.num_workers, flags.num_io_threads,
+                                          _mb_to_bytes(flags.target_shard_mb),
+                                          listing_cache_dir=flags.listing_cache_dir, frame_stride=flags.frame_stride,
+                                          record_compression=flags.record_compression)
     elif flags.mode == 'mk_img_recs':
         create_images_records_distributed(flags.image_glob, job_id=1, num_jobs=1, out_dir=flags.out_dir,
                                           num_per_shard=flags.num_per_shard, num_per_example=flags.num_per_ex,
-                                          feature_key=flags.feature_key)
+                                          feature_key=flags.feature_key, num_workers=flags.num_workers,
+                                          num_io_threads=flags.num_io_threads,
+                                          target_bytes_per_shard=_mb_to_bytes(flags.target_shard_mb),
+                                          listing_cache_dir=flags.listing_cache_dir, frame_stride=flags.frame_stride,
+                                          record_compression=flags.record_compression)
     elif flags.mode == 'mk_img_recs_dist':
         create_images_records_distributed(flags.image_glob, flags.job_id, flags.num_jobs, flags.out_dir,
-                                          flags.num_per_shard, flags.num_per_ex, feature_key=flags.feature_key)
+                                          flags.num_per_shard, flags.num_per_ex, feature_key=flags.feature_key,
+                                          target_bytes_per_shard=_mb_to_bytes(flags.target_shard_mb),
+                                          balance_jobs_by_bytes=flags.balance_jobs_by_bytes,
+                                          listing_cache_dir=flags.listing_cache_dir, frame_stride=flags.frame_stride,
+                                          record_compression=flags.record_compression)
+    elif flags.mode == 'frames':
+        sequences = index_frame_sequences(image_listing.iterate_images(flags.image_glob))
+        print(frame_sequences_report(sequences, flags.num_per_ex, flags.frame_stride or flags.num_per_ex,
+                                     flags.max_gaps))
+    elif flags.mode == 'ls_imgs':
+        num_images = image_listing.count_images(flags.image_glob, flags.listing_cache_dir)
+        print('{}: {} images'.format(flags.image_glob, num_images))
+    elif flags.mode == 'mk_raw_recs':
+        create_raw_records(flags.records_glob, flags.out_dir, flags.num_per_shard, flags.image_keys, flags.crop_size,
+                           flags.crops_per_image, flags.compression, record_compression=flags.record_compression)
     elif flags.mode == 'join':
         join_created_images_records(flags.out_dir, flags.num_jobs)
     elif flags.mode == 'extract':
-        extract_images(flags.records_glob, flags.max_imgs, flags.out_dir, flags.feature_key)
+        extract_images(flags.records_glob, flags.max_imgs, flags.out_dir, flags.feature_key, flags.every_nth,
+                       flags.sample, flags.batch_size, flags.num_writers)
     elif flags.mode == 'inspect':
-        inspect(flags.records_glob)
+        inspect(flags.records_glob, flags.check_crc)
+    elif flags.mode == 'index':
+        build_indices(flags.records_glob, flags.missing_only)
+    elif flags.mode == 'count':
+        count_examples(flags.records_glob)
+    elif flags.mode == 'get':
+        show_example(flags.records_glob, flags.i, *(flags.save or (None, None)))
     elif flags.mode == 'check':
-        check(flags.records_glob, flags.out_dir, flags.num_imgs, flags.num_per_ex)
+        check(flags.records_glob, flags.out_dir, flags.num_imgs, flags.num_per_ex, flags.every_nth, flags.sample,
+              flags.batch_size, flags.num_writers)
     else:
         parser.print_usage()
 